@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.extract
+    ~~~~~~~~~~~~~~~~~~
+
+    Measures extracting a large zipball serially and with pools of
+    processes of increasing size (see :func:`hydrogen.extract_members`).
+
+    Usage::
+
+        python benchmarks/extract.py [--files N] [--file-size BYTES]
+                                     [--processes N,N,...] [--runs N]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+import hydrogen  # noqa: E402
+
+
+def generate(path, files, file_size, seed=0):
+    """Write a zipball of *files* files, which compress like media assets:
+    mostly random, with some repetition.
+    """
+    rng = random.Random(seed)
+    block = bytes(bytearray(rng.getrandbits(8) for _ in range(64 * 1024)))
+    members = []
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        for i in range(files):
+            name = "assets/{}/file{}.bin".format(i % 16, i)
+            offset = rng.randrange(len(block))
+            data = (block[offset:] + block[:offset]) * \
+                (file_size // len(block) + 1)
+            data = data[:file_size // 2] + b"\0" * (file_size - file_size // 2)
+            z.writestr(name, data)
+            members.append((name, name))
+    return members
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--files", type=int, default=400)
+    parser.add_argument("--file-size", type=int, default=512 * 1024)
+    parser.add_argument("--processes", default="1,2,4,{}".format(
+        hydrogen.multiprocessing.cpu_count()))
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="hydrogen_bench_")
+    # extract in parallel whatever the size, to see where it pays off
+    hydrogen.parallel_extract_size = 0
+    try:
+        zip_path = os.path.join(work_dir, "package.zip")
+        members = generate(zip_path, args.files, args.file_size)
+        print("{} files, {} in total, {} compressed".format(
+            args.files, hydrogen.format_size(args.files * args.file_size),
+            hydrogen.format_size(os.path.getsize(zip_path))))
+        print("{:<14} {:>10} {:>9}".format("processes", "best (ms)",
+                                           "speedup"))
+        serial = None
+        for processes in sorted(set(int(p) for p in
+                                    args.processes.split(","))):
+            timings = []
+            for run in range(args.runs):
+                dest = os.path.join(work_dir, "dest")
+                for directory in set(os.path.dirname(path)
+                                     for _, path in members):
+                    os.makedirs(os.path.join(dest, directory))
+                start = time.time()
+                with zipfile.ZipFile(zip_path) as zip_file:
+                    hydrogen.extract_members(zip_file, dest, members,
+                                             processes=processes)
+                timings.append(time.time() - start)
+                shutil.rmtree(dest)
+            best = min(timings)
+            serial = serial or best
+            print("{:<14} {:>10.1f} {:>8.2f}x".format(
+                processes, best * 1000, serial / best))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.fakeregistry
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    A local stand-in for the bower registry and the GitHub API, serving a
+    generated tree of packages, so that installs can be measured without
+    touching the network.
+
+    The tree has a single root package, ``root``. Each package on level
+    ``n`` (the root is on level 0) depends on *fanout* packages of level
+    ``n + 1``, down to *depth* levels; a level holds at most *width*
+    packages, so deep trees share dependencies as real ones do.
+
+    It serves:
+
+    - ``/packages`` and ``/packages/{name}``, like the bower registry
+    - ``/repos/{user}/{repo}/tags``, paginated like the GitHub API
+    - ``/repos/{user}/{repo}/zipball/v{version}``, generated zipballs,
+      which can be fetched in byte ranges
+"""
+import hashlib
+import io
+import json
+import random
+import threading
+import zipfile
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+
+
+class PackageTree(object):
+    """A generated set of packages and their zipballs."""
+
+    def __init__(self, fanout=3, depth=3, width=20, versions=3, files=20,
+                 file_size=4096, seed=0):
+        self.fanout = fanout
+        self.depth = depth
+        self.files = files
+        self.file_size = file_size
+        self.seed = seed
+        self.versions = ["1.{}.0".format(minor) for minor in range(versions)]
+        self.levels = [["root"]]
+        for level in range(1, depth + 1):
+            count = min(fanout ** level, width)
+            self.levels.append(["pkg-{}-{}".format(level, i)
+                                for i in range(count)])
+        self._zipballs = {}
+        self._lock = threading.Lock()
+
+    @property
+    def names(self):
+        return [name for level in self.levels for name in level]
+
+    def dependencies(self, name):
+        for level, names in enumerate(self.levels[:-1]):
+            if name in names:
+                index = names.index(name)
+                below = self.levels[level + 1]
+                return sorted(set(
+                    below[(index * self.fanout + i) % len(below)]
+                    for i in range(self.fanout)))
+        return []
+
+    def zipball(self, name, version):
+        """Return the zipball of a package version, generating it once."""
+        key = (name, version)
+        with self._lock:
+            if key not in self._zipballs:
+                self._zipballs[key] = self._generate(name, version)
+            return self._zipballs[key]
+
+    def _generate(self, name, version):
+        rng = random.Random("{}-{}-{}".format(self.seed, name, version))
+        root = "user-{}-{}/".format(name, version)
+        bower_json = {
+            "name": name,
+            "version": version,
+            "main": "dist/{}.js".format(name),
+            "dependencies": dict((dependency, "^1.0.0") for dependency
+                                 in self.dependencies(name)),
+            "ignore": ["test", "**/.*"],
+        }
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr(root + "bower.json", json.dumps(bower_json))
+            for i in range(self.files):
+                directory = ("dist", "src", "test")[i % 3]
+                # half random, half repetitive, so it compresses like code
+                data = bytearray(rng.getrandbits(8)
+                                 for _ in range(self.file_size // 2))
+                data += b"x" * (self.file_size - len(data))
+                z.writestr("{}{}/file{}.js".format(root, directory, i),
+                           bytes(data))
+        return buf.getvalue()
+
+
+class Registry(object):
+    """Serves a :class:`PackageTree` over HTTP on a background thread, and
+    counts the requests and bytes it serves.
+    """
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                registry.handle(self)
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{}".format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def counters(self):
+        with self._lock:
+            return self.requests, self.bytes_sent
+
+    def handle(self, request):
+        url = urlparse(request.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+        body, content_type, headers = None, "application/json", []
+        status = 200
+        if parts == ["packages"]:
+            body = json.dumps([{
+                "name": name,
+                "url": "git://github.com/user/{}.git".format(name),
+            } for name in self.tree.names])
+        elif len(parts) == 2 and parts[0] == "packages":
+            if parts[1] in self.tree.names:
+                body = json.dumps({
+                    "name": parts[1],
+                    "url": "git://github.com/user/{}.git".format(parts[1]),
+                })
+        elif len(parts) == 4 and parts[0] == "repos" and parts[3] == "tags":
+            if parts[2] in self.tree.names:
+                per_page = min(int(query.get("per_page", [30])[0]), 100)
+                page = int(query.get("page", [1])[0])
+                versions = list(reversed(self.tree.versions))
+                last = max(-(-len(versions) // per_page), 1)
+                body = json.dumps([{
+                    "name": "v" + version,
+                    "zipball_url": "{}/repos/{}/{}/zipball/v{}".format(
+                        self.url, parts[1], parts[2], version),
+                } for version in versions[(page - 1) * per_page:
+                                          page * per_page]])
+                if page < last:
+                    page_url = "{}{}?per_page={}&page=".format(
+                        self.url, url.path, per_page)
+                    headers.append(("Link", '<{0}{1}>; rel="next", '
+                                    '<{0}{2}>; rel="last"'.format(
+                                        page_url, page + 1, last)))
+        elif (len(parts) == 5 and parts[0] == "repos"
+              and parts[3] == "zipball"):
+            if (parts[2] in self.tree.names
+                    and parts[4][1:] in self.tree.versions):
+                body = self.tree.zipball(parts[2], parts[4][1:])
+                content_type = "application/zip"
+                status, body, headers = self.byte_range(request, body)
+        if body is None:
+            request.send_response(status if status != 200 else 404)
+            request.end_headers()
+            body = b""
+        else:
+            if not isinstance(body, bytes):
+                body = body.encode("utf-8")
+            request.send_response(status)
+            request.send_header("Content-Type", content_type)
+            request.send_header("Content-Length", str(len(body)))
+            for header in headers:
+                request.send_header(*header)
+            request.end_headers()
+            request.wfile.write(body)
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += len(body)
+
+    @staticmethod
+    def byte_range(request, body):
+        """Answer a ``Range`` request for a single range of *body*.
+
+        :param return: a tuple of the status, the part of *body* to send
+            (`None` if the range cannot be satisfied) and extra headers.
+        """
+        headers = [("Accept-Ranges", "bytes"), ("ETag", '"{}"'.format(
+            hashlib.sha1(body).hexdigest()))]
+        requested = request.headers.get("Range")
+        validator = request.headers.get("If-Range")
+        if (not requested or not requested.startswith("bytes=")
+                or (validator and validator != headers[1][1])):
+            return 200, body, headers
+        first, last = requested[len("bytes="):].split("-", 1)
+        start = int(first)
+        end = min(int(last), len(body) - 1) if last else len(body) - 1
+        if start >= len(body):
+            return 416, None, headers
+        headers.append(("Content-Range", "bytes {}-{}/{}".format(
+            start, end, len(body))))
+        return 206, body[start:end + 1], headers
+
+    def install(self, hydrogen):
+        """Point a hydrogen module at this registry."""
+        hydrogen.Bower.bower_base_uri = self.url
+        hydrogen.github_api_uri = self.url
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.install
+    ~~~~~~~~~~~~~~~~~~
+
+    Measures bower installs, freezing and extraction against a local fake
+    registry (see :mod:`benchmarks.fakeregistry`), reporting wall time,
+    requests made, bytes transferred and peak memory for each scenario.
+
+    Usage::
+
+        python benchmarks/install.py [--fanout N] [--depth N] [--width N]
+                                     [--files N] [--file-size BYTES]
+                                     [--jobs N] [--runs N] [--no-memory]
+
+    Tracing memory slows Python down noticeably, so pass ``--no-memory`` when
+    only comparing wall times.
+"""
+import argparse
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+try:
+    import tracemalloc
+except ImportError:  # python 2
+    tracemalloc = None
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import hydrogen  # noqa: E402
+from fakeregistry import PackageTree, Registry  # noqa: E402
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence hydrogen's output, which would otherwise dominate."""
+    stdout = sys.stdout
+    with open(os.devnull, "w") as devnull:
+        sys.stdout = devnull
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+
+def reset_caches(app_dir):
+    """Point hydrogen at a new application directory, and forget any cached
+    state from the previous one.
+    """
+    hydrogen.app_dir = app_dir
+    hydrogen.MetadataCache.reset_default()
+    hydrogen.InstalledPackageIndex.reset_default()
+    hydrogen.Bower._ranges.clear()
+
+
+def measure(registry, func, memory=True):
+    memory = memory and tracemalloc is not None
+    requests, bytes_sent = registry.counters()
+    if memory:
+        tracemalloc.start()
+    start = time.time()
+    try:
+        with quiet():
+            func()
+        elapsed = time.time() - start
+        peak = tracemalloc.get_traced_memory()[1] if memory else None
+    finally:
+        if memory:
+            tracemalloc.stop()
+    after_requests, after_bytes = registry.counters()
+    return (elapsed, after_requests - requests, after_bytes - bytes_sent,
+            peak)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--fanout", type=int, default=3)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--width", type=int, default=20)
+    parser.add_argument("--versions", type=int, default=3)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--file-size", type=int, default=4096)
+    parser.add_argument("--jobs", type=int, default=hydrogen.default_workers)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true")
+    args = parser.parse_args()
+
+    tree = PackageTree(fanout=args.fanout, depth=args.depth,
+                       width=args.width, versions=args.versions,
+                       files=args.files, file_size=args.file_size)
+    registry = Registry(tree).start()
+    registry.install(hydrogen)
+    hydrogen.debug = False
+    work_dir = tempfile.mkdtemp(prefix="hydrogen_bench_")
+    cwd = os.getcwd()
+    state = {"run": 0}
+
+    def project(name):
+        path = os.path.join(work_dir, "run{}".format(state["run"]), name)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return path
+
+    def new_hydrogen(project_dir):
+        # as if in a new process, which only has the on-disk caches
+        hydrogen.TagIndex.forget()
+        os.chdir(project_dir)
+        with open("requirements.yml", "w") as f:
+            f.write("all: []\ndev: []\nbower:\n- root\nbower-dev: []\n")
+        return hydrogen.Hydrogen(
+            assets_dir=hydrogen.Path(project_dir) / "assets",
+            workers=args.jobs)
+
+    def install_cold():
+        reset_caches(project("app"))
+        h = new_hydrogen(project("cold"))
+        h.install_bower_batch(h.requirements["bower"], dest=h.assets_dir)
+
+    def install_warm():
+        # same application directory, so the caches are warm
+        h = new_hydrogen(project("warm"))
+        h.install_bower_batch(h.requirements["bower"], dest=h.assets_dir)
+
+    def reinstall():
+        h = new_hydrogen(project("warm"))
+        h.install_bower_batch(h.requirements["bower"], dest=h.assets_dir)
+
+    def freeze():
+        os.chdir(project("warm"))
+        with quiet():
+            hydrogen.main.main(["freeze", "--yaml", "--resolve"],
+                               prog_name="hydrogen", standalone_mode=False)
+
+    zip_path = os.path.join(work_dir, "root.zip")
+    with open(zip_path, "wb") as f:
+        f.write(tree.zipball("root", tree.versions[-1]))
+
+    def extract():
+        h = hydrogen.Hydrogen(workers=args.jobs, cache=False)
+        with zipfile.ZipFile(zip_path) as pkg:
+            h.extract_bower_zipfile(pkg, hydrogen.Path(project("extract")),
+                                    process_deps=False)
+
+    scenarios = [
+        ("install (cold caches)", install_cold),
+        ("install (warm caches)", install_warm),
+        ("reinstall (up to date)", reinstall),
+        ("freeze --resolve", freeze),
+        ("extract root zipball", extract),
+    ]
+    print("{} packages, {} files of {} each, fan-out {}, depth {}".format(
+        len(tree.names), args.files, hydrogen.format_size(args.file_size),
+        args.fanout, args.depth))
+    print("{:<26} {:>10} {:>9} {:>10} {:>10}".format(
+        "scenario", "best (ms)", "requests", "bytes", "peak mem"))
+    try:
+        results = dict((name, []) for name, _ in scenarios)
+        for run in range(args.runs):
+            state["run"] = run
+            for name, func in scenarios:
+                results[name].append(measure(registry, func,
+                                             memory=not args.no_memory))
+        for name, _ in scenarios:
+            elapsed, requests, bytes_sent, peak = min(results[name])
+            print("{:<26} {:>10.1f} {:>9} {:>10} {:>10}".format(
+                name, elapsed * 1000, requests,
+                hydrogen.format_size(bytes_sent),
+                hydrogen.format_size(peak) if peak is not None else "n/a"))
+    finally:
+        os.chdir(cwd)
+        registry.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
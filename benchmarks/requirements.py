@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.requirements
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures parsing a large requirements.txt, and adding, replacing, looking
+    up and removing requirements in a :class:`hydrogen.Requirements` set.
+
+    Usage::
+
+        python benchmarks/requirements.py [--lines N] [--runs N]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+import hydrogen  # noqa: E402
+
+
+specs = ["", "==1.0.0", ">=1.0,<2.0", " >= 2.1 , != 2.3", "~=3.4", "==4.*"]
+
+
+def generate(lines, seed=0):
+    rng = random.Random(seed)
+    text = []
+    for i in range(lines):
+        name = rng.choice(["pkg-", "Pkg_", "pkg.", "PKG--"]) + str(i)
+        text.append(name + rng.choice(specs))
+        if i % 50 == 0:
+            text.append("# a comment")
+    return "\n".join(text)
+
+
+def best(func, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.time()
+        func()
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--lines", type=int, default=5000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    text = generate(args.lines)
+    names = ["PKG-{}".format(i) for i in range(args.lines)]
+    requirements = hydrogen.Requirements()
+    requirements.loads(text)
+
+    def parse():
+        hydrogen.Requirements().loads(text)
+
+    def add():
+        target = hydrogen.Requirements()
+        for line in text.splitlines():
+            if not line.startswith("#"):
+                target.add(line)
+
+    def replace():
+        for name in names:
+            requirements.add(hydrogen.Requirement(name, "2.0"), replace=True)
+
+    def lookup():
+        for name in names:
+            assert name in requirements
+
+    def remove():
+        target = hydrogen.Requirements()
+        target.loads(text)
+        for name in names:
+            target.remove(name)
+
+    print("{:<24} {:>10} {:>14}".format("operation", "best (ms)",
+                                        "per item (us)"))
+    for name, func in [("parse", parse), ("add", add), ("replace", replace),
+                       ("lookup", lookup), ("load + remove", remove)]:
+        elapsed = best(func, args.runs)
+        print("{:<24} {:>10.1f} {:>14.2f}".format(
+            name, elapsed * 1000, elapsed / args.lines * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.startup
+    ~~~~~~~~~~~~~~~~~~
+
+    Measures how long it takes to import hydrogen and to run commands which
+    should not need any of its heavy dependencies, compared to importing
+    every dependency up front as hydrogen used to.
+
+    Usage::
+
+        python benchmarks/startup.py [--runs N]
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+scenarios = [
+    ("import hydrogen", ["-c", "import hydrogen"]),
+    ("import hydrogen + eager deps", [
+        "-c", "import hydrogen\n"
+        "for name in ('envoy', 'pathspec', 'pkg_resources', 'requests',\n"
+        "             'rfc6266', 'semver', 'yaml'):\n"
+        "    getattr(getattr(hydrogen, name), '__name__', None)"]),
+    ("hydrogen --help", [os.path.join(root, "hydrogen.py"), "--help"]),
+    ("hydrogen cache stats", [os.path.join(root, "hydrogen.py"),
+                              "cache", "stats"]),
+]
+
+
+def run(args, cwd, env):
+    start = time.time()
+    with open(os.devnull, "w") as devnull:
+        subprocess.check_call([sys.executable] + args, cwd=cwd, env=env,
+                              stdout=devnull, stderr=devnull)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [root] + [p for p in [env.get("PYTHONPATH")] if p])
+    # an empty directory, so no requirements.yml is found or created
+    cwd = tempfile.mkdtemp(prefix="hydrogen_bench_")
+
+    print("{:<32} {:>10} {:>10}".format("scenario", "best (ms)",
+                                        "mean (ms)"))
+    try:
+        for name, scenario_args in scenarios:
+            run(scenario_args, cwd, env)  # warm up the filesystem cache
+            timings = [run(scenario_args, cwd, env)
+                       for _ in range(args.runs)]
+            print("{:<32} {:>10.1f} {:>10.1f}".format(
+                name, min(timings) * 1000,
+                sum(timings) / len(timings) * 1000))
+    finally:
+        shutil.rmtree(cwd, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,33 +11,96 @@
     :license: BSD, see LICENSE for details
 """
 import atexit
-from collections import defaultdict
-from functools import update_wrapper
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+import errno
+from bisect import bisect_left, bisect_right
+from functools import cmp_to_key, update_wrapper
+import hashlib
+from importlib import import_module
+import io
 import json
 import os
 import re
 import shutil
 import sys
 import tempfile
+import threading
+import time
 
-import yaml
 import zipfile
 
 import click
-import envoy
 from pathlib import Path, PurePath
-from pathspec import GitIgnorePattern, PathSpec
-from pip._vendor import pkg_resources
-import requests
-import rfc6266
-import semver
+
+
+class LazyModule(object):
+    """A stand-in for a module which is only imported once it is used.
+
+    Importing requests, yaml, pkg_resources and friends takes a significant
+    share of the time a simple command such as ``hydrogen --help`` runs for,
+    so they are deferred until an attribute is first looked up.
+    """
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+
+    def __getattr__(self, attr):
+        module = import_module(self._name)
+        value = getattr(module, attr)
+        self.__dict__[attr] = value
+        return value
+
+    def __repr__(self):
+        return "<LazyModule({})>".format(self._name)
+
+
+envoy = LazyModule("envoy")
+multiprocessing = LazyModule("multiprocessing")
+pathspec = LazyModule("pathspec")
+pkg_resources = LazyModule("pip._vendor.pkg_resources")
+requests = LazyModule("requests")
+rfc6266 = LazyModule("rfc6266")
+semver = LazyModule("semver")
+socket = LazyModule("socket")
+specifiers = LazyModule("pip._vendor.packaging.specifiers")
+sqlite3 = LazyModule("sqlite3")
+subprocess = LazyModule("subprocess")
+traceback = LazyModule("traceback")
+yaml = LazyModule("yaml")
 
 
 __version__ = "0.0.1-alpha"
 prog_name = "hydrogen"
 app_dir = click.get_app_dir(prog_name)
 github_api_uri = "https://api.github.com"
+pypi_uri = "https://pypi.org/pypi"
+lockfile_name = "hydrogen.lock"
+wheelhouse_name = "wheelhouse"
+#: directory, inside the assets directory, holding installed package manifests
+manifest_dir = ".hydrogen"
 debug = True
+default_workers = 4
+#: if `True`, no network requests are made and metadata is only served from
+#: the cache.
+offline = False
+#: number of seconds cached metadata is used without revalidation.
+metadata_ttl = 300
+#: number of byte ranges fetched in parallel for large downloads, if the
+#: server accepts range requests.
+download_segments = 4
+#: downloads smaller than this many bytes are never split into segments.
+segment_min_size = 8 * 1024 * 1024
+#: seconds after which a lock file is assumed to be left over by a process
+#: which died, and is taken over.
+lock_timeout = 600
+#: archives with at least this many bytes, or this many files, to extract
+#: are split across a pool of processes (see :func:`extract_members`).
+parallel_extract_size = 64 * 1024 * 1024
+parallel_extract_members = 4000
+#: size of the extraction process pool. Defaults to the number of CPUs.
+extract_processes = None
+#: seconds without a command after which the daemon exits.
+daemon_idle_timeout = 3600
 
 
 # borrowed from werkzeug._compat
@@ -50,6 +113,33 @@ else:
     text_type = str
 
 
+class Shared(object):
+    """A base for classes with one instance shared by the whole process,
+    returned by :meth:`default`.
+    """
+    _default = None
+    _default_lock = threading.RLock()
+
+    @classmethod
+    def default(cls):
+        """Return the instance shared by the whole process, creating it if
+        needed.
+        """
+        with Shared._default_lock:
+            # look in the class itself, so subclasses get their own instance
+            if cls.__dict__.get("_default") is None:
+                cls._default = cls()
+            return cls._default
+
+    @classmethod
+    def reset_default(cls):
+        """Forget the shared instance, so the next :meth:`default` creates a
+        new one.
+        """
+        with Shared._default_lock:
+            cls._default = None
+
+
 class InvalidRequirementSpecError(Exception):
     pass
 
@@ -66,23 +156,57 @@ class VersionNotFoundError(Exception):
     pass
 
 
+class GroupNotFoundError(Exception):
+    pass
+
+
+class OfflineError(Exception):
+    pass
+
+
+class VersionConflictError(Exception):
+    pass
+
+
+_name_separators_regex = re.compile(r"[-_.]+")
+
+
+def normalize_name(name):
+    """Normalize a project name as described in :pep:`503`, so that e.g.
+    ``Foo.Bar`` and ``foo_bar`` refer to the same project.
+    """
+    return _name_separators_regex.sub("-", name).lower()
+
+
 def get_installed_pypackages():
-    return {p.project_name.lower(): p for p in pkg_resources.working_set}
+    """Return a mapping of normalized project names to the versions of all
+    installed distributions.
+
+    See :class:`InstalledPackageIndex`.
+    """
+    return InstalledPackageIndex.default().versions()
+
+
+def echo(message, **kwargs):
+    """Print a (optionally styled) message without garbling the progress
+    display. Takes the same arguments as :func:`click.secho`.
+    """
+    ProgressReporter.default().secho(message, **kwargs)
 
 
 def success(message, **kwargs):
     kwargs["fg"] = kwargs.get("fg", "green")
-    click.secho(message, **kwargs)
+    echo(message, **kwargs)
 
 
 def warning(message, **kwargs):
     kwargs["fg"] = kwargs.get("fg", "red")
-    click.secho(u"warning: {}".format(message), **kwargs)
+    echo(u"warning: {}".format(message), **kwargs)
 
 
 def error(message, level="error", exit_code=1, **kwargs):
     kwargs["fg"] = kwargs.get("fg", "red")
-    click.secho(u"error: {}".format(message), **kwargs)
+    echo(u"error: {}".format(message), **kwargs)
     sys.exit(exit_code)
 
 
@@ -138,36 +262,105 @@ def secure_filename(filename):
     return filename
 
 
+_session = None
+_session_size = 0
+_session_workers = 0
+_session_lock = threading.Lock()
+
+
+def reserve_connections(workers):
+    """Make the pool of the shared session (see :func:`get_session`) large
+    enough for *workers* threads making requests at once.
+
+    This is cheap, and does not import :mod:`requests`: the pool is only
+    resized when the session is next used.
+    """
+    global _session_workers
+    with _session_lock:
+        _session_workers = max(_session_workers, workers)
+
+
+def get_session():
+    """Return the shared :class:`requests.Session`.
+
+    The session keeps connections alive between requests, and its pool
+    keeps a connection per host for every worker (`default_workers`, or as
+    many as were reserved with :func:`reserve_connections`) and every
+    segment each of them may split a download into (`download_segments`),
+    so that none of them is discarded.
+    """
+    global _session, _session_size
+    size = (max(_session_workers, default_workers) *
+            max(download_segments, 1))
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+        if size > _session_size:
+            adapter = requests.adapters.HTTPAdapter(pool_connections=10,
+                                                    pool_maxsize=size)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            _session_size = size
+    return _session
+
+
+_git_found = None
+
+
+def require_git():
+    """Exit with an error unless git is available.
+
+    The check runs a subprocess, so it is only done once, and only when a
+    git URL is actually installed.
+    """
+    global _git_found
+    if _git_found is None:
+        which = "where" if sys.platform == "win32" else "which"
+        _git_found = envoy.run(which + " git").status_code == 0
+    if not _git_found:
+        click.secho("fatal: git not found in PATH", fg="red")
+        sys.exit(1)
+
+
 def get(url, session=None, silent=not debug, **kwargs):
     """Retrieve a given URL and log response.
 
-    :param session: a :class:`requests.Session` object.
+    :param session: a :class:`requests.Session` object. Defaults to the shared
+        session returned by :func:`get_session`.
     :param silent: if **True**, response status and URL will not be printed.
+    :raises OfflineError: if running in offline mode.
     """
-    session = session or requests
+    if offline:
+        raise OfflineError("cannot retrieve {} while offline".format(url))
+    session = session or get_session()
     kwargs["verify"] = kwargs.get("verify", True)
+    count("http requests")
     r = session.get(url, **kwargs)
     if not silent:
         status_code = click.style(
             str(r.status_code),
             fg="green" if r.status_code in (200, 304) else "red")
-        click.echo(status_code + " " + url)
+        echo(status_code + " " + url)
         if r.status_code == 404:
             raise PackageNotFoundError
     return r
 
 
-def download_file(url, dest=None, chunk_size=1024, replace="ask",
+def download_file(url, dest=None, chunk_size=None, replace="ask",
                   label="Downloading {dest_basename} ({size:.2f}MB)",
-                  expected_extension=None):
+                  expected_extension=None, progress=True):
     """Download a file from a given URL and display progress.
 
+    The file is downloaded to ``<dest>.part`` first, and if the download is
+    interrupted, the next call resumes it (see :func:`fetch_resumable`).
+
     :param dest: If the destination exists and is a directory, the filename
         will be guessed from the Content-Disposition header. If the destination
         is an existing file, the user will either be prompted to overwrite, or
         the file will be replaced (depending on the value of **replace**). If
         the destination does not exist, it will be used as the filename.
-    :param int chunk_size: bytes read in at a time.
+    :param int chunk_size: bytes read in at a time. By default, it is chosen
+        from the size of the download.
     :param replace: If `False`, an existing destination file will not be
         overwritten.
     :param label: a string which is formatted and displayed as the progress bar
@@ -175,6 +368,8 @@ def download_file(url, dest=None, chunk_size=1024, replace="ask",
     :param expected_extension: if set, the filename will be sanitized to ensure
         it has the given extension. The extension should not start with a dot
         (`.`).
+    :param progress: if `False`, the download is not shown by the
+        :class:`ProgressReporter`.
     """
     dest = Path(dest or url.split("/")[-1])
     response = get(url, stream=True)
@@ -191,21 +386,411 @@ def download_file(url, dest=None, chunk_size=1024, replace="ask",
         if (replace is False
                 or replace == "ask"
                 and not click.confirm("Replace {}?".format(dest))):
+            response.close()
             return str(dest)
     size = int(response.headers.get("content-length", 0))
     label = label.format(dest=dest, dest_basename=dest.name,
                          size=size/1024.0/1024)
-    with click.open_file(str(dest), "wb") as f:
-        content_iter = response.iter_content(chunk_size=chunk_size)
-        with click.progressbar(content_iter, length=size/1024,
-                               label=label) as bar:
-            for chunk in bar:
-                if chunk:
-                    f.write(chunk)
-                    f.flush()
+    part_path = str(dest) + ".part"
+    fetch_resumable(url, part_path, progress=progress, label=label,
+                    response=response, chunk_size=chunk_size)
+    replace_file(part_path, str(dest))
     return str(dest)
 
 
+def stream_response(response, fileobj, chunk_size=None, progress=False,
+                    label=None, digest=None):
+    """Copy the body of a streamed response to a file, hashing it on the way.
+
+    :param fileobj: a writable file object.
+    :param chunk_size: bytes read in at a time. If `None`, it is chosen from
+        the size of the response, between 64KB and 1MB.
+    :param progress: if `True`, the download is shown by the
+        :class:`ProgressReporter`.
+    :param label: the label shown for the download.
+    :param digest: a :mod:`hashlib` object to update, e.g. one which has
+        already hashed the first part of a resumed download.
+    :param return: a tuple of the SHA-256 hex digest of the body (or of
+        *digest*), and the number of bytes written.
+    """
+    size = int(response.headers.get("content-length", 0))
+    if chunk_size is None:
+        chunk_size = (min(max(size // 64, 64 * 1024), 1024 * 1024) if size
+                      else 256 * 1024)
+    if digest is None:
+        digest = hashlib.sha256()
+    written = 0
+    chunks = (chunk for chunk in response.iter_content(chunk_size=chunk_size)
+              if chunk)
+    if progress:
+        with ProgressReporter.default().task(label, size or None) as task:
+            for chunk in chunks:
+                fileobj.write(chunk)
+                digest.update(chunk)
+                written += len(chunk)
+                task.update(len(chunk))
+    else:
+        for chunk in chunks:
+            fileobj.write(chunk)
+            digest.update(chunk)
+            written += len(chunk)
+    count("bytes downloaded", written)
+    return digest.hexdigest(), written
+
+
+@contextmanager
+def file_lock(path, timeout=None, poll=0.1):
+    """Hold an exclusive lock file while the block runs, waiting for any
+    other process holding it.
+
+    The lock file is created with ``O_EXCL``, which works across processes
+    on every platform. A lock file that has not been touched for *timeout*
+    seconds (defaults to `lock_timeout`) is taken over; while the block runs,
+    a thread touches it every quarter of that, so a slow download does not
+    lose its lock.
+    """
+    path = str(path)
+    timeout = lock_timeout if timeout is None else timeout
+    makedirs(os.path.dirname(path))
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        try:
+            if time.time() - os.path.getmtime(path) > timeout:
+                remove_file(path)
+                continue
+        except OSError:
+            continue
+        time.sleep(poll)
+    done = threading.Event()
+
+    def refresh():
+        while not done.wait(timeout / 4.0):
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+
+    heartbeat = threading.Thread(target=refresh, name="file_lock")
+    heartbeat.daemon = True
+    try:
+        os.write(fd, str(os.getpid()).encode("ascii"))
+        os.close(fd)
+        heartbeat.start()
+        yield
+    finally:
+        done.set()
+        if heartbeat.is_alive():
+            heartbeat.join()
+        remove_file(path)
+
+
+def fetch_resumable(url, part_path, sha256=None, segments=None,
+                    progress=False, label=None, response=None,
+                    chunk_size=None):
+    """Download *url* into *part_path*, resuming an interrupted download.
+
+    The response's validators (``ETag``/``Last-Modified``) and length are
+    kept in ``<part_path>.json``. If a part file is left over from an
+    earlier attempt, only the missing bytes are requested with a ``Range``
+    header; ``If-Range`` makes the server send the whole file instead if it
+    changed in the meantime. If the server sends ``Accept-Ranges: bytes``
+    and the file is at least `segment_min_size` bytes, it is fetched as
+    *segments* byte ranges in parallel, each of which is resumable too.
+
+    Callers downloading the same URL concurrently should hold a
+    :func:`file_lock`.
+
+    :param sha256: the expected SHA-256 of the file.
+    :param segments: the number of ranges to split large downloads into.
+        Defaults to `download_segments`.
+    :param response: an already opened streamed response for *url*, which
+        is used instead of making the first request, unless resuming.
+    :param chunk_size: passed to :func:`stream_response`.
+    :raises InvalidPackageError: if the complete file does not have the
+        expected length or SHA-256, or the file changed during a segmented
+        download. The part file is removed, so the next attempt starts
+        over.
+    :param return: a tuple of the SHA-256 of the file and its size.
+    """
+    part_path = str(part_path)
+    state_path = part_path + ".json"
+    segments = download_segments if segments is None else segments
+    try:
+        with open(state_path, "rb") as f:
+            state = json.loads(f.read().decode("utf-8"))
+    except (IOError, OSError, ValueError):
+        state = None
+    if (state is None or state.get("url") != url
+            or not os.path.exists(part_path)):
+        state = {"url": url}
+        remove_file(part_path)
+
+    def save_state():
+        atomic_write(state_path, json.dumps(state).encode("utf-8"))
+
+    if state.get("segments"):
+        if response is not None:
+            response.close()
+        return _fetch_segments(part_path, state, save_state, sha256,
+                               progress, label, chunk_size)
+
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if offset or response is None:
+        if response is not None:
+            response.close()
+        headers = {}
+        if offset:
+            headers["Range"] = "bytes={}-".format(offset)
+            validator = state.get("etag") or state.get("last_modified")
+            if validator:
+                headers["If-Range"] = validator
+        response = get(url, stream=True, headers=headers)
+    try:
+        if response.status_code == 416 and offset == state.get("size"):
+            # the previous attempt got everything, but was not verified
+            return _verify_download(part_path, state_path, sha256,
+                                    state.get("size"))
+        response.raise_for_status()
+        digest = hashlib.sha256()
+        if response.status_code == 206:
+            with open(part_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+        else:
+            offset = 0
+            size = int(response.headers.get("content-length", 0)) or None
+            state.update({
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "size": size,
+            })
+            if (segments > 1 and size and size >= segment_min_size and
+                    response.headers.get("Accept-Ranges") == "bytes"):
+                response.close()
+                step = -(-size // segments)
+                state["location"] = response.url
+                state["segments"] = [[start, min(start + step, size) - 1,
+                                      False]
+                                     for start in range(0, size, step)]
+                save_state()
+                return _fetch_segments(part_path, state, save_state, sha256,
+                                       progress, label, chunk_size)
+            save_state()
+        with open(part_path, "ab" if offset else "wb") as f:
+            stream_response(response, f, chunk_size=chunk_size,
+                            progress=progress, label=label, digest=digest)
+    finally:
+        response.close()
+    return _verify_download(part_path, state_path, sha256, state.get("size"),
+                            digest.hexdigest())
+
+
+def _fetch_segments(part_path, state, save_state, sha256, progress, label,
+                    chunk_size):
+    size = state["size"]
+    with open(part_path, "ab") as f:
+        if f.tell() != size:
+            f.truncate(size)
+    lock = threading.Lock()
+    validator = state.get("etag") or state.get("last_modified")
+
+    def fetch(segment):
+        start, end, _ = segment
+        headers = {"Range": "bytes={}-{}".format(start, end)}
+        if validator:
+            headers["If-Range"] = validator
+        response = get(state["location"], stream=True, headers=headers)
+        try:
+            if response.status_code != 206:
+                raise InvalidPackageError(
+                    "{} changed during the download".format(state["url"]))
+            with open(part_path, "r+b") as f:
+                f.seek(start)
+                _, written = stream_response(response, f,
+                                             chunk_size=chunk_size,
+                                             progress=progress, label=label)
+        finally:
+            response.close()
+        if written != end - start + 1:
+            raise IOError("incomplete segment of {}".format(state["url"]))
+        with lock:
+            segment[2] = True
+            save_state()
+
+    pending = [segment for segment in state["segments"] if not segment[2]]
+    try:
+        map_concurrently(fetch, pending, workers=len(pending))
+    except InvalidPackageError:
+        remove_file(part_path)
+        remove_file(part_path + ".json")
+        raise
+    return _verify_download(part_path, part_path + ".json", sha256, size)
+
+
+def _verify_download(part_path, state_path, sha256, size, digest=None):
+    actual_size = os.path.getsize(part_path)
+    if digest is None:
+        digest = file_digest(part_path)
+    if ((size is not None and actual_size != size) or
+            (sha256 is not None and digest != sha256)):
+        remove_file(part_path)
+        remove_file(state_path)
+        raise InvalidPackageError("{} is corrupt: expected {} bytes with "
+                                  "SHA-256 {}, got {} bytes with {}".format(
+                                      part_path, size, sha256 or "(any)",
+                                      actual_size, digest))
+    remove_file(state_path)
+    return digest, actual_size
+
+
+def get_json(url, session=None, ttl=None):
+    """Retrieve and decode a JSON document through the metadata cache.
+
+    See :meth:`MetadataCache.get`.
+    """
+    return MetadataCache.default().get(url, session=session, ttl=ttl)
+
+
+def read_bower_json(zip_file):
+    """Return the parsed ``bower.json`` of a zipped bower package.
+
+    :param zip_file: a :class:`zipfile.ZipFile` instance.
+    :param return: a tuple of the parsed ``bower.json`` and the name of the
+        directory containing it.
+    :raises InvalidPackageError: if the package has no ``bower.json``.
+    """
+    candidates = [name for name in zip_file.namelist()
+                  if PurePath(name).name == "bower.json"]
+    if not candidates:
+        raise InvalidPackageError(
+            "no bower.json in {}".format(zip_file.filename))
+    # the shallowest bower.json belongs to the package, deeper ones are
+    # usually test fixtures or vendored code
+    name = min(candidates, key=lambda name: name.count("/"))
+    with zip_file.open(name) as f:
+        bower_json = json.loads(f.read().decode("utf-8"))
+    return bower_json, str(PurePath(name).parent)
+
+
+def manifest_path(dest, name):
+    """Return the path of the manifest of package *name* installed in
+    *dest*.
+    """
+    return Path(str(dest)) / manifest_dir / (name + ".json")
+
+
+def read_manifest(path):
+    """Return the parsed manifest at *path*, or `None`."""
+    try:
+        with Path(str(path)).open("rb") as f:
+            return json.loads(f.read().decode("utf-8"))
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def load_manifests(dest):
+    """Return the manifests of all packages installed in *dest*, keyed by the
+    URL of the zipball they were installed from.
+    """
+    directory = Path(str(dest)) / manifest_dir
+    manifests = {}
+    if directory.is_dir():
+        for path in directory.iterdir():
+            manifest = read_manifest(path)
+            if manifest is not None and manifest.get("url"):
+                manifests[manifest["url"]] = manifest
+    return manifests
+
+
+def manifest_is_intact(dest, manifest):
+    """Return `True` if every file recorded in *manifest* is still installed
+    with its recorded size.
+    """
+    package_dir = Path(str(dest)) / manifest["name"]
+    for path, (_, size) in manifest["files"].items():
+        try:
+            if os.path.getsize(str(package_dir / path)) != size:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+_ignore_specs = {}
+
+
+def compile_ignore_patterns(patterns):
+    """Compile the ``ignore`` patterns of a ``bower.json`` file.
+
+    Compiled specs are kept, so packages sharing the same patterns only pay
+    for compiling them once.
+
+    :param patterns: a list of gitignore-style patterns.
+    :param return: a :class:`pathspec.PathSpec` instance.
+    """
+    key = tuple(patterns)
+    if key not in _ignore_specs:
+        _ignore_specs[key] = pathspec.PathSpec(
+            [pathspec.GitIgnorePattern(pattern) for pattern in patterns])
+    return _ignore_specs[key]
+
+
+def select_package_members(names, root, path_spec):
+    """Select the members of a zipped bower package to extract.
+
+    Paths are matched against *path_spec* relative to *root*, in a single
+    call. An ignored directory excludes everything below it, whether or not
+    the zip file has an entry for each intermediate directory.
+
+    :param names: the member names of the zip file.
+    :param root: the directory containing ``bower.json``, as returned by
+        :func:`read_bower_json`. Members outside of it are skipped.
+    :param path_spec: compiled ignore patterns.
+    :param return: a tuple of a sorted list of directories to create (only
+        the deepest of each branch, relative to *root*), and a list of
+        ``(member name, relative path)`` tuples of files to extract.
+    """
+    prefix = "" if root in ("", ".") else root.rstrip("/") + "/"
+    relative = {}
+    for name in names:
+        if name.startswith(prefix) and len(name) > len(prefix):
+            relative[name[len(prefix):]] = name
+    ignored = set(path_spec.match_files(relative))
+    pruned = set(path.rstrip("/") for path in ignored if path.endswith("/"))
+
+    def is_pruned(path):
+        parent = path.rpartition("/")[0]
+        while parent:
+            if parent in pruned:
+                return True
+            parent = parent.rpartition("/")[0]
+        return False
+
+    directories = set()
+    members = []
+    for path, name in relative.items():
+        if path in ignored or is_pruned(path.rstrip("/")):
+            continue
+        if path.endswith("/"):
+            directories.add(path.rstrip("/"))
+        else:
+            members.append((name, path))
+            directories.add(path.rpartition("/")[0])
+    parents = set()
+    for directory in directories:
+        parent = directory.rpartition("/")[0]
+        while parent and parent not in parents:
+            parents.add(parent)
+            parent = parent.rpartition("/")[0]
+    leaves = sorted(directories - parents - set([""]))
+    return leaves, members
+
+
 def get_dir_from_zipfile(zip_file, fallback=None):
     """Return the name of the root folder in a zip file.
 
@@ -240,6 +825,8 @@ def mkdtemp(suffix="", prefix=__name__ + "_", dir=None, cleanup=True,
     if cleanup:
         if on_cleanup_error is None:
             def on_cleanup_error(function, path, excinfo):
+                if getattr(excinfo[1], "errno", None) == errno.ENOENT:
+                    return  # removed already, e.g. by Hydrogen.close()
                 click.secho("warning: failed to remove file or directory: {}\n"
                             "please delete it manually.".format(path),
                             fg="red")
@@ -247,57 +834,678 @@ def mkdtemp(suffix="", prefix=__name__ + "_", dir=None, cleanup=True,
     return path
 
 
+def makedirs(path):
+    """Create a directory and any missing parents.
+
+    Unlike :func:`os.makedirs`, it is not an error for the directory to
+    exist already, which makes this safe to call from several threads
+    extracting into the same destination.
+    """
+    try:
+        os.makedirs(str(path))
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(str(path)):
+            raise
+
+
+def remove_empty_dirs(path, stop):
+    """Remove the now empty parent directories of *path*, up to but not
+    including *stop*.
+    """
+    parent = os.path.dirname(str(path))
+    stop = os.path.normpath(str(stop))
+    while os.path.normpath(parent) != stop and \
+            parent.startswith(stop + os.sep):
+        try:
+            os.rmdir(parent)
+        except OSError:
+            break
+        parent = os.path.dirname(parent)
+
+
+def load_yaml(text):
+    """Parse YAML safely, with libyaml's parser if it is available."""
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    return yaml.load(text, Loader=loader)
+
+
+def dump_yaml(data):
+    """Serialize *data* to block style YAML text, with libyaml's emitter if
+    it is available.
+    """
+    dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+    return yaml.dump(data, Dumper=dumper, default_flow_style=False,
+                     encoding=None)
+
+
+# read once, while importing, as reading it means briefly changing it
+_umask = os.umask(0o022)
+os.umask(_umask)
+
+
+def atomic_write(path, data):
+    """Write *data* (bytes) to *path* atomically.
+
+    The data is written to a temporary file in the same directory, which is
+    then renamed over *path*, so readers never observe a partially written
+    file. The file keeps its permissions, or if it is new gets those the
+    umask allows, rather than the owner-only ones of temporary files.
+    """
+    path = str(path)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                     prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        try:
+            mode = os.stat(path).st_mode & 0o7777
+        except OSError:
+            mode = 0o666 & ~_umask
+        os.chmod(temp_path, mode)
+        replace_file(temp_path, path)
+    except BaseException:
+        remove_file(temp_path)
+        raise
+
+
+def replace_file(source, dest):
+    """Rename *source* to *dest*, replacing *dest* if it exists."""
+    try:
+        os.rename(source, dest)
+    except OSError:
+        # windows refuses to rename over an existing file
+        if not os.path.exists(dest):
+            raise
+        os.remove(dest)
+        os.rename(source, dest)
+
+
+def remove_file(path):
+    """Remove a file, ignoring it if it has already gone away."""
+    try:
+        os.remove(str(path))
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def _extract_share(args):
+    """Extract some members of a zipball into a directory.
+
+    This runs in worker processes of :func:`extract_members`, so it must
+    remain a module-level function, and opens the zipball itself.
+    """
+    zip_path, dest, members = args
+    with zipfile.ZipFile(zip_path) as zip_file:
+        for name, path in members:
+            _extract_member(zip_file, name, os.path.join(dest, path))
+    return len(members)
+
+
+def _extract_member(zip_file, name, target_path):
+    source = zip_file.open(name)
+    target = open(target_path, "wb")
+    with source, target:
+        shutil.copyfileobj(source, target, 1024 * 1024)
+
+
+_extract_pool = None
+_extract_pool_size = 0
+_extract_pool_users = 0
+_extract_pool_lock = threading.Lock()
+
+
+@contextmanager
+def _shared_extract_pool(processes):
+    """Lend the process pool which every extraction shares, so concurrent
+    extractions queue their work on the same processes rather than each
+    starting a pool of its own.
+
+    The pool is started on first use, and only resized to *processes* while
+    no extraction is using it.
+    """
+    global _extract_pool, _extract_pool_size, _extract_pool_users
+    with _extract_pool_lock:
+        if _extract_pool is None or (_extract_pool_size != processes and
+                                     not _extract_pool_users):
+            _close_extract_pool()
+            # don't fork a process which may be running other threads
+            context = (multiprocessing.get_context("spawn")
+                       if hasattr(multiprocessing, "get_context")
+                       else multiprocessing)
+            _extract_pool = context.Pool(processes)
+            _extract_pool_size = processes
+        _extract_pool_users += 1
+        pool = _extract_pool
+    try:
+        yield pool
+    finally:
+        with _extract_pool_lock:
+            _extract_pool_users -= 1
+
+
+def _close_extract_pool():
+    global _extract_pool
+    if _extract_pool is not None:
+        _extract_pool.terminate()
+        _extract_pool.join()
+        _extract_pool = None
+
+
+def close_extract_pool():
+    """Stop the worker processes of :func:`extract_members`."""
+    with _extract_pool_lock:
+        _close_extract_pool()
+
+
+atexit.register(close_extract_pool)
+
+
+def extract_members(zip_file, dest, members, processes=None):
+    """Extract members of a zipball into *dest*, whose directories must
+    already exist.
+
+    Decompression is CPU-bound, so when there are at least
+    `parallel_extract_size` bytes or `parallel_extract_members` files to
+    extract, the members are split into shares of about equal size which are
+    extracted by a pool of processes, each reading the zipball on its own.
+    Otherwise they are extracted one by one in this process. The pool is
+    shared by every thread, so extracting several large archives at once
+    does not start more processes.
+
+    :param members: a list of ``(member name, path)`` tuples.
+    :param processes: the size of the pool. Defaults to
+        `extract_processes`, or the number of CPUs. With 1, members are
+        always extracted in this process.
+    """
+    if not members:
+        return
+    sizes = [zip_file.getinfo(name).file_size for name, _ in members]
+    if processes is None:
+        processes = extract_processes or multiprocessing.cpu_count()
+    shares = min(processes, len(members))
+    zip_path = zip_file.filename
+    # spawned workers re-import __main__, which must be a file to do so
+    main_file = getattr(sys.modules.get("__main__"), "__file__", None)
+    if (shares <= 1 or not zip_path or not os.path.isfile(zip_path) or
+            (main_file and not os.path.isfile(main_file)) or
+            (sum(sizes) < parallel_extract_size and
+             len(members) < parallel_extract_members)):
+        for name, path in members:
+            _extract_member(zip_file, name, os.path.join(str(dest), path))
+        return
+    # largest first, each to the smallest share so far
+    loads = [0] * shares
+    shares = [[] for _ in range(shares)]
+    for size, member in sorted(zip(sizes, members), key=lambda s: -s[0]):
+        smallest = loads.index(min(loads))
+        shares[smallest].append(member)
+        loads[smallest] += size
+    with span("parallel extract", processes=processes,
+              members=len(members)):
+        with _shared_extract_pool(processes) as pool:
+            pool.map(_extract_share, [(zip_path, str(dest), share)
+                                      for share in shares])
+    count("files extracted in parallel", len(members))
+
+
+def reflink_file(source, dest):
+    """Make *dest* a copy-on-write clone of *source*.
+
+    :raises OSError: if the platform or filesystem does not support it.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.ENOTSUP, "reflinks are not supported")
+    with open(source, "rb") as src, open(dest, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), 0x40049409, src.fileno())  # FICLONE
+        except (IOError, OSError):
+            dst.close()
+            remove_file(dest)
+            raise
+
+
+def link_file(source, dest):
+    """Populate *dest* with the contents of *source*, sharing storage where
+    possible: by hardlinking it, or failing that (e.g. across filesystems)
+    by reflinking it, or failing that by copying it.
+
+    :param return: ``"link"``, ``"reflink"`` or ``"copy"``.
+    """
+    try:
+        os.link(source, dest)
+        return "link"
+    except (AttributeError, OSError):
+        pass
+    try:
+        reflink_file(source, dest)
+        return "reflink"
+    except (IOError, OSError):
+        pass
+    shutil.copyfile(source, dest)
+    return "copy"
+
+
+def file_digest(path, algorithm="sha256", chunk_size=1024 * 1024):
+    """Return the hex digest of the contents of the file at *path*."""
+    h = hashlib.new(algorithm)
+    with open(str(path), "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def format_size(size):
+    """Format a number of bytes for display."""
+    size = float(size)
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            break
+        size /= 1024
+    return "{:.1f}{}".format(size, unit)
+
+
+def terminal_width():
+    try:
+        return shutil.get_terminal_size((80, 24))[0]
+    except AttributeError:  # python 2
+        return click.get_terminal_size()[0]
+
+
+def map_concurrently(func, iterable, workers=None):
+    """Apply *func* to every item of *iterable* using a pool of threads.
+
+    Results are returned in the same order as the input. If any call
+    raises (including :exc:`SystemExit`, which :func:`error` uses), the
+    first exception is re-raised in the calling thread once the pool has
+    finished.
+
+    :param workers: maximum number of threads. If `None`, `default_workers`
+        is used. With a single worker or a single item, *func* is simply
+        called in the current thread.
+    """
+    items = list(iterable)
+    workers = workers or default_workers
+    if workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    def call(item):
+        try:
+            return True, func(item)
+        except BaseException:
+            return False, sys.exc_info()[1]
+
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        results = pool.map(call, items)
+    finally:
+        pool.close()
+        pool.join()
+    for ok, result in results:
+        if not ok:
+            raise result
+    return [result for _, result in results]
+
+
+class ProgressTask(object):
+    """A unit of work shown by a :class:`ProgressReporter`."""
+    __slots__ = ("reporter", "label", "total", "done")
+
+    def __init__(self, reporter, label, total=None):
+        self.reporter = reporter
+        self.label = label
+        self.total = total
+        self.done = 0
+
+    def update(self, amount):
+        self.done += amount
+        self.reporter.refresh()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.reporter.finish(self)
+
+
+class ProgressReporter(Shared):
+    """A single status line summarizing every download in progress.
+
+    Downloads running at once in different threads (and different install
+    groups) share the line, instead of each drawing its own progress bar
+    over the others. The line is only drawn when stderr is a terminal, and
+    is cleared whenever a message is printed through :meth:`secho`.
+    """
+    #: minimum seconds between redraws
+    interval = 0.1
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stderr
+        self.tasks = []
+        self.finished = 0
+        self._drawn = 0
+        self._last_draw = 0
+        self._lock = threading.RLock()
+        isatty = getattr(self.stream, "isatty", None)
+        self.enabled = bool(isatty and isatty())
+
+    def task(self, label, total=None):
+        """Start showing a task.
+
+        :param total: the expected number of bytes, if known.
+        :param return: a :class:`ProgressTask`, which is removed from the
+            display when used as a context manager and exited.
+        """
+        task = ProgressTask(self, label, total)
+        with self._lock:
+            self.tasks.append(task)
+        self.refresh(force=True)
+        return task
+
+    def finish(self, task):
+        with self._lock:
+            if task in self.tasks:
+                self.tasks.remove(task)
+                self.finished += 1
+        self.refresh(force=True)
+
+    def status(self):
+        """Return the text of the status line."""
+        with self._lock:
+            tasks = list(self.tasks)
+        if not tasks:
+            return ""
+        done = sum(task.done for task in tasks)
+        parts = ["{} active".format(len(tasks))]
+        if self.finished:
+            parts.append("{} done".format(self.finished))
+        if all(task.total for task in tasks):
+            total = sum(task.total for task in tasks)
+            parts.append("{} of {} ({:.0%})".format(
+                format_size(done), format_size(total),
+                float(done) / total if total else 1))
+        else:
+            parts.append(format_size(done))
+        parts.append(", ".join(task.label for task in tasks if task.label))
+        return "[{}] {}".format(", ".join(parts[:-1]), parts[-1])
+
+    def refresh(self, force=False):
+        if not self.enabled:
+            return
+        with self._lock:
+            now = time.time()
+            if not force and now - self._last_draw < self.interval:
+                return
+            self._last_draw = now
+            self._draw(self.status()[:terminal_width() - 1])
+
+    def _draw(self, line):
+        padding = " " * max(self._drawn - len(line), 0)
+        self.stream.write("\r" + line + padding + ("" if line else "\r"))
+        self.stream.flush()
+        self._drawn = len(line)
+
+    def secho(self, message, **kwargs):
+        """Clear the status line, print a message like
+        :func:`click.secho`, and redraw the status line.
+        """
+        with self._lock:
+            if self._drawn:
+                self._draw("")
+            click.secho(message, **kwargs)
+            if self.tasks:
+                self.refresh(force=True)
+
+
+class Span(object):
+    """A timed phase recorded by a :class:`Tracer`."""
+    __slots__ = ("tracer", "name", "category", "args", "start", "end",
+                 "thread")
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = self.end = None
+        self.thread = None
+
+    def __enter__(self):
+        self.thread = threading.current_thread().ident
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.end = time.time()
+        self.tracer.record(self)
+
+
+class NullSpan(object):
+    """What :meth:`Tracer.span` returns while tracing is disabled."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class Tracer(Shared):
+    """Records how long each phase of a command takes, and counts events
+    such as requests, bytes transferred and cache hits.
+
+    Tracing is disabled by default, in which case :meth:`span` and
+    :meth:`count` do next to nothing. The ``--profile`` option prints
+    :meth:`summary`, and ``--trace`` writes :meth:`chrome_trace`, which can
+    be opened in ``chrome://tracing`` or Perfetto.
+    """
+    _null_span = NullSpan()
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.spans = []
+        self.counters = defaultdict(int)
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def span(self, name, category="hydrogen", **args):
+        """Time a phase, as a context manager.
+
+        :param name: the name of the phase. Spans are summarized by name.
+        :param args: details shown in the trace, such as a URL.
+        """
+        if not self.enabled:
+            return self._null_span
+        return Span(self, name, category, args)
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += amount
+
+    def record(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def summary(self):
+        """Return a list of ``(name, calls, total seconds, max seconds)``
+        tuples, slowest first.
+        """
+        phases = defaultdict(list)
+        with self._lock:
+            for span in self.spans:
+                phases[span.name].append(span.end - span.start)
+        return sorted(((name, len(durations), sum(durations), max(durations))
+                       for name, durations in phases.items()),
+                      key=lambda phase: -phase[2])
+
+    def format_summary(self):
+        lines = ["{:<24} {:>7} {:>10} {:>10}".format(
+            "phase", "calls", "total (s)", "max (s)")]
+        for name, calls, total, longest in self.summary():
+            lines.append("{:<24} {:>7} {:>10.3f} {:>10.3f}".format(
+                name, calls, total, longest))
+        lines.append("{:<24} {:>7} {:>10.3f}".format(
+            "wall time", "", time.time() - self.started))
+        if self.counters:
+            lines.append("")
+            for name, value in sorted(self.counters.items()):
+                if name.startswith("bytes"):
+                    value = format_size(value)
+                lines.append("{:<24} {:>7}".format(name, value))
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        """Return the recorded spans and counters in the Chrome trace event
+        format.
+        """
+        pid = os.getpid()
+        with self._lock:
+            spans = list(self.spans)
+            counters = dict(self.counters)
+        threads = {}
+        events = []
+        for span in sorted(spans, key=lambda span: span.start):
+            tid = threads.setdefault(span.thread, len(threads))
+            events.append({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": (span.start - self.started) * 1e6,
+                "dur": (span.end - span.start) * 1e6,
+                "pid": pid,
+                "tid": tid,
+                "args": span.args,
+            })
+        if counters:
+            events.append({
+                "name": "counters",
+                "ph": "C",
+                "ts": (time.time() - self.started) * 1e6,
+                "pid": pid,
+                "args": counters,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save_chrome_trace(self, path):
+        atomic_write(path, json.dumps(self.chrome_trace()).encode("utf-8"))
+
+
+def span(name, **args):
+    """Time a phase with the default :class:`Tracer`."""
+    return Tracer.default().span(name, **args)
+
+
+def count(name, amount=1):
+    """Increment a counter of the default :class:`Tracer`."""
+    Tracer.default().count(name, amount)
+
+
 class Requirement(object):
     """Represents a single package requirement.
 
+    The version may consist of several comma separated specifiers (e.g.
+    ``>=1.0,<2.0``), or be a bower range (e.g. ``^1.2`` or ``1.0 - 2.0``).
+    A bare version is treated as ``==version``.
+
     .. note::
-        This class overrides `__hash__` in order to ensure that package
-        names remain unique when in a set.
+        Requirements compare equal, and hash, by their normalized package
+        name, in order to ensure that package names remain unique when in a
+        set.
 
     .. todo::
         Extend :class:`pkg_resources.Requirement` for Python requirements.
     """
-    # TODO: support multiple version specs (e.g. >=1.0,<=2.0)
-    spec_regex = r"(.+?)\s*(?:([<>~=]?=)\s*(.+?))?$"
+    __slots__ = ("package", "version")
 
-    def __init__(self, package, version):
+    spec_regex = re.compile(
+        r"^\s*([^\s<>=!~^,;#]+)\s*([^;#]*?)\s*(?:[;#].*)?$")
+    specifier_regex = re.compile(
+        r"^\s*(===|==|!=|~=|<=|>=|~>|<|>|=|~|\^)?\s*(.*?)\s*$")
+
+    def __init__(self, package, version=None):
         """Construct a new requirement.
 
         :param package: the package name.
         :param version: a semver compatible version specification.
         """
         self.package = package
-        self.version = version
-        if self.version and not re.match(r"[<=>~]", version[:2]):
-            self.version = "=={}".format(self.version)
+        self.version = self.normalize_version(version)
+
+    @classmethod
+    def normalize_version(cls, version):
+        """Normalize the whitespace in a version specification, and prefix
+        bare versions (but not ``latest`` or ``*``) with ``==``.
+
+        :raises InvalidRequirementSpecError: if a specifier has an operator
+            but no version.
+        """
+        if not version or not version.strip():
+            return None
+        if "||" in version or " - " in version:
+            # a bower range, which has its own syntax
+            return " ".join(version.split())
+        specifiers = []
+        for specifier in version.split(","):
+            op, value = cls.specifier_regex.match(specifier).groups()
+            if not value:
+                raise InvalidRequirementSpecError(
+                    "invalid version specifier: {}".format(specifier))
+            if op is None and " " not in value and \
+                    value.lower() not in ("latest", "*"):
+                op = "=="
+            specifiers.append((op or "") + value)
+        return ",".join(specifiers)
 
     @classmethod
     def coerce(cls, string):
         """Create a :class:`Requirement` object from a given package spec."""
-        match = re.match(cls.spec_regex, string)
+        match = cls.spec_regex.match(string)
         if not match:
-            raise InvalidRequirementSpecError("could not parse requirement")
-        package = match.group(1)
-        if all(match.group(2, 3)):
-            version = "".join(match.group(2, 3))
-        else:
-            version = None
-        return cls(package, version)
+            raise InvalidRequirementSpecError(
+                "could not parse requirement: {}".format(string))
+        return cls(*match.groups())
+
+    @property
+    def key(self):
+        """The normalized package name."""
+        return normalize_name(self.package)
+
+    @property
+    def specifiers(self):
+        """A list of ``(operator, version)`` tuples. Bower ranges which are
+        not simple comparators are returned whole, without an operator.
+        """
+        if not self.version:
+            return []
+        if " " in self.version or "||" in self.version:
+            return [(None, self.version)]
+        return [self.specifier_regex.match(specifier).groups()
+                for specifier in self.version.split(",")]
 
     def load_installed_version(self):
         installed_packages = get_installed_pypackages()
-        if self.package in installed_packages:
-            self.version = "=={}".format(
-                installed_packages[self.package].version)
+        if self.key in installed_packages:
+            self.version = "=={}".format(installed_packages[self.key])
 
     def __eq__(self, other):
         return (isinstance(other, self.__class__) and
-                other.package == self.package)
+                other.key == self.key)
+
+    def __ne__(self, other):
+        return not self == other
 
     def __hash__(self):
-        return hash(self.package)
+        return hash(self.key)
 
     def __str__(self):
+        if self.version and self.version[0] not in "<>=!~^":
+            # e.g. "1.2 - 2.0" or "latest", which would run into the name
+            return " ".join([self.package, self.version])
         return "".join([self.package, self.version or ""])
 
     def __repr__(self):
@@ -305,30 +1513,69 @@ class Requirement(object):
             package=self.package, version=self.version)
 
 
-class Requirements(set):
-    """Represents a set of requirements."""
+class Requirements(object):
+    """Represents a set of requirements, indexed by normalized package name.
+
+    Requirements are kept in the order they were added.
+    """
     def __init__(self, filename=None):
         self.filename = None
+        self._index = OrderedDict()
         if filename:
             self.load(filename)
 
+    @staticmethod
+    def _key(elem):
+        if isinstance(elem, Requirement):
+            return elem.key
+        return normalize_name(elem)
+
     def add(self, elem, replace=False):
         """Add a requirement.
 
         :param elem: a string or :class:`Requirement` instance.
-        :param replace: if `True`, packages in the set with the same name will
-            be removed first.
+        :param replace: if `True`, a requirement in the set with the same name
+            will be replaced, otherwise the existing requirement is kept.
         """
         if isinstance(elem, text_type):
             elem = Requirement.coerce(elem)
-        if replace and elem in self:
-            self.remove(elem)
-        super(Requirements, self).add(elem)
+        key = elem.key
+        if replace or key not in self._index:
+            self._index[key] = elem
 
-    def load(self, requirements_file=None):
-        """Load or reload requirements from a requirements.txt file.
+    def get(self, name, default=None):
+        """Return the requirement for a package, or `default`.
 
-        :param requirements_file: if not given, the filename used from
+        :param name: a package name or :class:`Requirement` instance.
+        """
+        return self._index.get(self._key(name), default)
+
+    def remove(self, elem):
+        """Remove a requirement.
+
+        :param elem: a package name or :class:`Requirement` instance.
+        :raises KeyError: if there is no such requirement.
+        """
+        del self._index[self._key(elem)]
+
+    def discard(self, elem):
+        """Remove a requirement if present.
+
+        :param elem: a package name or :class:`Requirement` instance.
+        """
+        self._index.pop(self._key(elem), None)
+
+    def clear(self):
+        self._index.clear()
+
+    def update(self, requirements, replace=False):
+        for requirement in requirements:
+            self.add(requirement, replace=replace)
+
+    def load(self, requirements_file=None):
+        """Load or reload requirements from a requirements.txt file.
+
+        :param requirements_file: if not given, the filename used from
             initialization will be read again.
         """
         if requirements_file is None:
@@ -345,28 +1592,44 @@ class Requirements(set):
             self.filename = requirements_file
 
     def loads(self, requirements_text):
-        lines = re.findall(Requirement.spec_regex,
-                           requirements_text,
-                           re.MULTILINE)
-        for line in lines:
-            self.add(Requirement(line[0], "".join(line[1:])))
-
-    def remove(self, elem):
-        """Remove a requirement.
+        """Add requirements from the text of a requirements.txt file.
 
-        :param elem: a string or :class:`Requirement` instance.
+        Blank lines, comments and options (e.g. ``-r other.txt``) are
+        skipped.
         """
-        if isinstance(elem, text_type):
-            for requirement in self:
-                if requirement.package == elem:
-                    return super(Requirements, self).remove(requirement)
-        return super(Requirements, self).remove(elem)
+        match = Requirement.spec_regex.match
+        index = self._index
+        for line in requirements_text.splitlines():
+            line = line.strip()
+            if not line or line[0] in "#-":
+                continue
+            parsed = match(line)
+            if parsed is None:
+                raise InvalidRequirementSpecError(
+                    "could not parse requirement: {}".format(line))
+            requirement = Requirement(*parsed.groups())
+            index.setdefault(requirement.key, requirement)
+
+    def __contains__(self, elem):
+        return self._key(elem) in self._index
+
+    def __iter__(self):
+        return iter(list(self._index.values()))
+
+    def __len__(self):
+        return len(self._index)
+
+    def __bool__(self):
+        return bool(self._index)
+
+    __nonzero__ = __bool__
 
     def __str__(self):
         return "\n".join([str(x) for x in self])
 
     def __repr__(self):
-        return "<Requirements({})>".format(self.filename.name or "")
+        return "<Requirements({})>".format(
+            self.filename.name if self.filename else "")
 
 
 class NamedRequirements(Requirements):
@@ -388,10 +1651,23 @@ class GroupedRequirements(defaultdict):
         "dev": "dev-requirements.txt"
     }
 
-    def __init__(self, groups=None):
+    #: where parsed requirements files are cached, defaults to a directory
+    #: in `app_dir`
+    cache_dir = None
+
+    def __init__(self, groups=None, cache=True):
+        """Construct a new set of requirement groups.
+
+        :param cache: if `True`, the parsed form of loaded files is cached,
+            keyed by their modification time and size.
+        """
         super(GroupedRequirements, self).__init__(NamedRequirements)
         self.groups = groups or self.default_groups
         self.filename = None
+        self.cache = cache
+        self._saved = None
+        self._batch_depth = 0
+        self._batch_pending = False
         self.create_default_groups()
 
     def clear(self):
@@ -409,30 +1685,104 @@ class GroupedRequirements(defaultdict):
         for group, requirements_txt in files_map.items():
             path = Path(requirements_txt)
             if not path.exists() and group.lower() == "all" and freeze:
-                cmd = envoy.run("pip freeze")
-                self[group].loads(cmd.std_out)
+                self[group].loads(InstalledPackageIndex.default().freeze())
             elif path.exists():
                 self[group].load(path)
 
     def load(self, filename, create_if_missing=True):
+        """Load requirements from a YAML file.
+
+        If the file has not changed since it was last parsed, its parsed
+        form is read from the cache instead.
+
+        :param create_if_missing: if `True` and the file does not exist, it
+            is created from the pip requirements files, or the installed
+            packages.
+        """
         filename = Path(filename)
         if not filename.exists() and create_if_missing:
             self.load_pip_requirements()
-            with filename.open("w") as f:
-                f.write(yaml.dump(self.serialized, default_flow_style=False,
-                                  encoding=None))
             self.filename = filename
             return self.save(filename)
-        with filename.open() as f:
-            for group, requirements in yaml.load(f.read()).items():
-                for requirement in requirements:
-                    self[group].add(Requirement.coerce(requirement))
+        data = self._load_cached(filename)
+        if data is None:
+            with filename.open() as f:
+                data = load_yaml(f.read()) or {}
+            self._cache_parsed(filename, data)
+        for group, requirements in data.items():
+            for requirement in requirements or []:
+                self[group].add(Requirement.coerce(requirement))
         self.filename = filename
+        self._saved = (filename, self.serialized)
 
     def save(self, filename=None):
+        """Save requirements to a YAML file.
+
+        Nothing is written if the requirements are unchanged since they
+        were last loaded or saved, or while in a :meth:`batch`.
+        """
         filename = Path(filename) if filename is not None else self.filename
-        with filename.open("w") as f:
-            f.write(self.yaml)
+        if self._batch_depth and filename == self.filename:
+            self._batch_pending = True
+            return
+        serialized = self.serialized
+        if self._saved == (filename, serialized) and filename.exists():
+            return
+        atomic_write(filename, dump_yaml(serialized).encode("utf-8"))
+        self._cache_parsed(filename, serialized)
+        self._saved = (filename, serialized)
+
+    @contextmanager
+    def batch(self):
+        """Defer saving to the end of the block, and then save at most
+        once.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            # saved even if the block fails, so that whatever it managed to
+            # do (such as installing some of the packages) is recorded
+            self._batch_depth -= 1
+            if not self._batch_depth and self._batch_pending:
+                self._batch_pending = False
+                self.save()
+
+    def _cache_path(self, filename):
+        key = hashlib.sha1(
+            str(filename.resolve()).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir or os.path.join(
+            app_dir, "cache", "requirements"), key + ".json")
+
+    @staticmethod
+    def _stat_key(filename):
+        stat = filename.stat()
+        return [getattr(stat, "st_mtime_ns", stat.st_mtime), stat.st_size]
+
+    def _load_cached(self, filename):
+        if not self.cache:
+            return None
+        try:
+            with open(self._cache_path(filename), "rb") as f:
+                cached = json.loads(f.read().decode("utf-8"))
+            if cached["stat"] == self._stat_key(filename):
+                return cached["data"]
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+        return None
+
+    def _cache_parsed(self, filename, data):
+        if not self.cache:
+            return
+        try:
+            path = self._cache_path(filename)
+            makedirs(os.path.dirname(path))
+            atomic_write(path, json.dumps({
+                "stat": self._stat_key(filename),
+                "data": data,
+            }).encode("utf-8"))
+        except (IOError, OSError, TypeError):
+            pass
 
     @property
     def serialized(self):
@@ -443,8 +1793,7 @@ class GroupedRequirements(defaultdict):
 
     @property
     def yaml(self):
-        return yaml.dump(self.serialized, default_flow_style=False,
-                         encoding=None)
+        return dump_yaml(self.serialized)
 
     def __missing__(self, key):
         if self.default_factory is None:
@@ -454,266 +1803,2997 @@ class GroupedRequirements(defaultdict):
             return ret
 
 
+class InstalledPackageIndex(Shared):
+    """An index of the Python distributions installed in this interpreter.
+
+    Scanning the working set is slow, so the index is built once and only
+    rebuilt when its fingerprint changes: the modification time and link
+    count of every directory on `sys.path`, which change whenever pip adds
+    or removes a distribution's metadata directory. The index is also
+    persisted to the application directory, so later processes can skip the
+    scan entirely while the fingerprint still matches.
+    """
+    #: projects which ``pip freeze`` leaves out
+    freeze_excludes = ("pip", "setuptools", "distribute", "wheel")
+
+    def __init__(self, path=None, persist=True):
+        """Construct a new index.
+
+        :param path: the file the index is persisted to. Defaults to a file
+            in the application directory specific to this interpreter.
+        :param persist: if `False`, the index is only kept in memory.
+        """
+        if path is None:
+            key = hashlib.sha1(
+                (sys.executable + sys.prefix).encode("utf-8")).hexdigest()
+            path = os.path.join(app_dir, "installed-{}.json".format(key[:16]))
+        self.path = Path(path)
+        self.persist = persist
+        self._fingerprint = None
+        self._packages = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint():
+        fingerprint = []
+        for entry in sys.path:
+            try:
+                stat = os.stat(entry or ".")
+            except OSError:
+                continue
+            fingerprint.append([entry, stat.st_mtime, stat.st_nlink])
+        return fingerprint
+
+    def packages(self):
+        """Return a mapping of normalized project names to tuples of the
+        project name and installed version.
+        """
+        fingerprint = self.fingerprint()
+        with self._lock:
+            if self._packages is None or fingerprint != self._fingerprint:
+                self._packages = self._load(fingerprint)
+                if self._packages is None:
+                    self._packages = self._scan()
+                    self._save(fingerprint)
+                self._fingerprint = fingerprint
+            return self._packages
+
+    def versions(self):
+        """Return a mapping of normalized project names to installed
+        versions.
+        """
+        return {key: version for key, (_, version)
+                in self.packages().items()}
+
+    def freeze(self):
+        """Return installed distributions in requirements.txt format, like
+        ``pip freeze``.
+        """
+        return "\n".join(
+            "{}=={}".format(name, version) for key, (name, version)
+            in sorted(self.packages().items())
+            if key not in self.freeze_excludes)
+
+    def invalidate(self):
+        """Forget the index, including the persisted copy: installing a
+        package need not change the fingerprint on a filesystem with a
+        coarse clock.
+        """
+        with self._lock:
+            self._packages = None
+            if self.persist:
+                try:
+                    remove_file(self.path)
+                except OSError:
+                    pass
+
+    def _scan(self):
+        return {normalize_name(dist.project_name):
+                (dist.project_name, dist.version)
+                for dist in pkg_resources.WorkingSet()}
+
+    def _load(self, fingerprint):
+        if not self.persist:
+            return None
+        try:
+            with self.path.open("rb") as f:
+                data = json.loads(f.read().decode("utf-8"))
+        except (IOError, OSError, ValueError):
+            return None
+        if data.get("fingerprint") != fingerprint:
+            return None
+        return {key: tuple(value) for key, value in data["packages"].items()}
+
+    def _save(self, fingerprint):
+        if not self.persist:
+            return
+        try:
+            makedirs(self.path.parent)
+            atomic_write(self.path, json.dumps({
+                "fingerprint": fingerprint,
+                "packages": self._packages,
+            }, sort_keys=True).encode("utf-8"))
+        except (IOError, OSError):
+            pass
+
+
+class MetadataCache(Shared):
+    """An on-disk cache of JSON API responses.
+
+    Responses are stored along with their ``ETag`` and ``Last-Modified``
+    headers. Within :attr:`ttl` seconds of being fetched, an entry is used as
+    is; after that it is revalidated with a conditional request, and a
+    ``304 Not Modified`` response (which does not count against GitHub's
+    rate limit) just refreshes it. In offline mode, entries are used
+    regardless of their age.
+    """
+
+    def __init__(self, path=None, ttl=None):
+        """Construct a new metadata cache.
+
+        :param path: the cache directory. Defaults to ``cache/http`` in the
+            application directory.
+        :param ttl: seconds an entry is used without revalidation. Defaults
+            to `metadata_ttl`.
+        """
+        self.path = Path(path or os.path.join(app_dir, "cache", "http"))
+        self.ttl = ttl
+
+    def entry_path(self, url):
+        return self.path / (hashlib.sha1(url.encode("utf-8")).hexdigest() +
+                            ".json")
+
+    def load(self, url):
+        """Return the cache entry for *url*, or `None`."""
+        try:
+            with self.entry_path(url).open("rb") as f:
+                return json.loads(f.read().decode("utf-8"))
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save(self, entry):
+        makedirs(self.path)
+        atomic_write(self.entry_path(entry["url"]),
+                     json.dumps(entry, sort_keys=True).encode("utf-8"))
+
+    def get(self, url, session=None, ttl=None):
+        """Return the decoded JSON document at *url*.
+
+        :param session: passed to :func:`get`.
+        :param ttl: overrides the cache's default time to live.
+        :raises OfflineError: if running in offline mode and *url* is not
+            cached.
+        :raises PackageNotFoundError: if the server responds with 404.
+        """
+        return json.loads(self.fetch(url, session=session, ttl=ttl)["body"])
+
+    def fetch(self, url, session=None, ttl=None):
+        """Return the cache entry for *url*, fetching or revalidating it
+        first if necessary.
+
+        Besides the ``body``, entries keep the response's ``link`` header,
+        which paginated APIs use to point to further pages.
+
+        Takes the same arguments as :meth:`get`.
+        """
+        entry = self.load(url)
+        if offline:
+            if entry is None:
+                raise OfflineError("{} is not cached".format(url))
+            count("metadata cache hits")
+            return entry
+        if ttl is None:
+            ttl = self.ttl if self.ttl is not None else metadata_ttl
+        if entry is not None and time.time() - entry["fetched"] < ttl:
+            count("metadata cache hits")
+            return entry
+
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        response = get(url, session=session, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            count("metadata revalidated")
+            entry["fetched"] = time.time()
+            self.save(entry)
+            return entry
+        if response.status_code == 404:
+            raise PackageNotFoundError(url)
+        response.raise_for_status()
+        count("metadata fetched")
+        entry = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "link": response.headers.get("Link"),
+            "fetched": time.time(),
+            "body": response.text,
+        }
+        self.save(entry)
+        return entry
+
+
+class RegistryMirror(Shared):
+    """A local snapshot of the bower registry's package URLs.
+
+    ``hydrogen mirror sync`` copies the registry (or some of its packages)
+    into an SQLite database in the application directory, and
+    :meth:`Bower.get_package_url` looks packages up there before asking the
+    registry, so installs of mirrored packages need no registry requests at
+    all, even when offline.
+    """
+
+    def __init__(self, path=None):
+        """Construct a new mirror.
+
+        :param path: the database file. Defaults to ``mirror.sqlite`` in the
+            application directory.
+        """
+        self.path = Path(path or os.path.join(app_dir, "mirror.sqlite"))
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def connect(self, create=False):
+        """Return the database connection, or `None` if the mirror does not
+        exist and *create* is `False`.
+        """
+        if self._connection is None:
+            if not create and not self.path.exists():
+                return None
+            makedirs(self.path.parent)
+            # lookups come from resolver threads, serialized by self._lock
+            connection = sqlite3.connect(str(self.path),
+                                         check_same_thread=False)
+            connection.execute("CREATE TABLE IF NOT EXISTS packages "
+                               "(name TEXT PRIMARY KEY, url TEXT NOT NULL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS meta "
+                               "(key TEXT PRIMARY KEY, value TEXT)")
+            self._connection = connection
+        return self._connection
+
+    def lookup(self, name):
+        """Return the URL of a package, or `None` if it is not mirrored."""
+        with self._lock:
+            connection = self.connect()
+            if connection is None:
+                return None
+            row = connection.execute(
+                "SELECT url FROM packages WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def update(self, packages, source, replace=False):
+        """Add packages to the mirror, in a single transaction.
+
+        :param packages: an iterable of ``(name, url)`` tuples.
+        :param source: where the packages came from, shown by
+            :meth:`status`.
+        :param replace: if `True`, packages which are not given are removed.
+        :param return: the number of packages added or updated.
+        """
+        packages = list(packages)
+        with self._lock:
+            connection = self.connect(create=True)
+            with connection:
+                if replace:
+                    connection.execute("DELETE FROM packages")
+                connection.executemany(
+                    "INSERT OR REPLACE INTO packages (name, url) "
+                    "VALUES (?, ?)", packages)
+                connection.executemany(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                    [("source", source), ("synced", str(time.time()))])
+        return len(packages)
+
+    def status(self):
+        """Return a dict of the package count, source and sync time of the
+        mirror, or `None` if it does not exist.
+        """
+        with self._lock:
+            connection = self.connect()
+            if connection is None:
+                return None
+            meta = dict(connection.execute("SELECT key, value FROM meta"))
+            packages = connection.execute(
+                "SELECT COUNT(*) FROM packages").fetchone()[0]
+        return {
+            "path": str(self.path),
+            "packages": packages,
+            "source": meta.get("source"),
+            "synced": float(meta["synced"]) if "synced" in meta else None,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def clean(self):
+        """Remove the mirror."""
+        self.close()
+        remove_file(self.path)
+
+    @staticmethod
+    def parse_packages(data):
+        """Return ``(name, url)`` tuples from a registry listing, which is
+        either a list of ``{"name": ..., "url": ...}`` objects (as served by
+        the registry's ``/packages``) or an object mapping names to URLs.
+        """
+        if isinstance(data, dict):
+            return sorted(data.items())
+        return [(package["name"], package["url"]) for package in data
+                if package.get("name") and package.get("url")]
+
+
 class Bower(object):
     bower_base_uri = "https://bower.herokuapp.com"
 
     @classmethod
     def get_package_url(cls, package, session=None, silent=False):
-        response = get("{}/packages/{}".format(cls.bower_base_uri, package))
-        return response.json().get("url", None)
+        url = RegistryMirror.default().lookup(package)
+        if url is not None:
+            count("mirror hits")
+            return url
+        with span("registry lookup", package=package):
+            try:
+                package_info = get_json(
+                    "{}/packages/{}".format(cls.bower_base_uri, package),
+                    session=session)
+            except OfflineError:
+                raise OfflineError(
+                    "{} is not cached; run once online or use 'hydrogen "
+                    "mirror sync'".format(package))
+        return package_info.get("url", None)
 
     @classmethod
     def clean_semver(cls, version_spec):
         return re.sub(r"([<>=~])\s+?v?", "\\1", version_spec, re.IGNORECASE)
 
+    version_regex = re.compile(
+        r"^v?(\d+)(?:\.(\d+))?(?:\.(\d+))?"
+        r"(-[0-9A-Za-z.-]+)?(\+[0-9A-Za-z.-]+)?$")
+    comparator_regex = re.compile(
+        r"^(<=|>=|<|>|==?|~>?|\^)?\s*v?(\d+|[xX*])?(?:\.(\d+|[xX*]))?"
+        r"(?:\.(\d+|[xX*]))?(-[0-9A-Za-z.-]+)?(?:\+[0-9A-Za-z.-]+)?$")
+    _ranges = {}
 
-class Hydrogen(object):
-    def __init__(self, assets_dir=None, requirements_file="requirements.yml"):
-        self.assets_dir = assets_dir or Path(".") / "assets"
-        self.requirements = GroupedRequirements()
-        self.requirements.load(requirements_file)
-        self.temp_dir = mkdtemp()
+    @classmethod
+    def parse_version(cls, tag):
+        """Normalize a tag name such as ``v1.2`` to a full semantic version
+        (``1.2.0``).
 
-    def extract_bower_zipfile(self, zip_file, dest, expected_version=None):
-        bower_json = None
-        root = None
-        deps_installed = []
-        for info in zip_file.infolist():
-            if PurePath(info.filename).name == "bower.json":
-                with zip_file.open(info) as f:
-                    bower_json = json.load(f)
-                    root = str(PurePath(info.filename).parent)
-                break
-        version = bower_json["version"]
-        if expected_version is not None:
-            expected_version = Bower.clean_semver(expected_version)
-            if not semver.match(version, expected_version):
-                click.secho("error: versions do not match ({} =/= {})".format(
-                    version, expected_version))
-                raise InvalidPackageError
-        if "dependencies" in bower_json:
-            for package, version in bower_json["dependencies"].items():
-                url = Bower.get_package_url(package)
-                deps_installed.extend(self.get_bower_package(
-                    url, dest=dest, version=version))
-        ignore_patterns = [GitIgnorePattern(ig) for ig in bower_json["ignore"]]
-        path_spec = PathSpec(ignore_patterns)
-        namelist = [path for path in zip_file.namelist()
-                    if PurePath(path).parts[0] == root]
-        ignored = list(path_spec.match_files(namelist))
-        for path in namelist:
-            dest_path = PurePath(
-                bower_json["name"],
-                *PurePath(path).parts[1:])
-
-            if path in ignored:
-                continue
+        :param return: the version, or `None` if *tag* is not a version.
+        """
+        match = cls.version_regex.match(tag.strip())
+        if not match:
+            return None
+        major, minor, patch, prerelease, build = match.groups()
+        return "{}.{}.{}{}{}".format(major, minor or 0, patch or 0,
+                                     prerelease or "", build or "")
 
-            for path in ignored:
-                for parent in PurePath(path):
-                    if parent in ignored:
-                        continue
+    @classmethod
+    def sort_versions(cls, versions, reverse=False):
+        return sorted(versions, key=cmp_to_key(semver.compare),
+                      reverse=reverse)
 
-            if path.endswith("/"):
-                if list(path_spec.match_files([str(dest_path)])):
-                    ignored.append(PurePath(path))
-                elif not (dest / dest_path).is_dir():
-                    (dest / dest_path).mkdir(parents=True)
+    @classmethod
+    def parse_range(cls, version_spec):
+        """Compile a version range into a list of alternatives, each a list of
+        ``(operator, version)`` comparators which must all hold.
+
+        Supports the range syntax used by bower: comparators (``>=1.2``),
+        tilde and caret ranges (``~1.2.3``, ``^1.2``), X-ranges (``1.x``),
+        hyphen ranges (``1.2 - 2.0``), and ``||``.
+
+        :raises InvalidRequirementSpecError: if the range cannot be parsed.
+        """
+        version_spec = (version_spec or "").strip()
+        if version_spec in cls._ranges:
+            return cls._ranges[version_spec]
+        alternatives = []
+        for alternative in version_spec.split("||"):
+            alternative = alternative.strip()
+            hyphen = re.match(r"^(\S+)\s+-\s+(\S+)$", alternative)
+            if hyphen:
+                tokens = [">=" + hyphen.group(1), "<=" + hyphen.group(2)]
             else:
-                target_path = dest / dest_path.parent / dest_path.name
-                source = zip_file.open(path)
-                target = target_path.open("wb")
-                with source, target:
-                    shutil.copyfileobj(source, target)
-        deps_installed.append((bower_json["name"], bower_json["version"]))
-        return deps_installed
+                tokens = re.sub(r"(<=|>=|<|>|==?|~>?|\^)\s+", "\\1",
+                                alternative.replace(",", " ")).split()
+            comparators = []
+            for token in tokens:
+                if token.lower() != "latest":
+                    comparators.extend(cls._parse_comparator(token))
+            alternatives.append(comparators)
+        cls._ranges[version_spec] = alternatives
+        return alternatives
 
-    def get_bower_package(self, url, dest=None, version=None,
-                          process_deps=True):
-        dest = dest or Path(".") / "assets"
-        parsed_url = urlparse(url)
-        if parsed_url.scheme == "git" or parsed_url.path.endswith(".git"):
-            if parsed_url.netloc == "github.com":
-                user, repo = parsed_url.path[1:-4].split("/")
-                response = get(github_api_uri +
-                               "/repos/{}/{}/tags".format(user, repo))
-                tags = response.json()
-                target = None
-                if not len(tags):
-                    click.secho("fatal: no tags exist for {}/{}".format(
-                        user, repo), fg="red")
-                    raise InvalidPackageError
-                if version is None:
-                    target = tags[0]
-                else:
-                    for tag in tags:
-                        if semver.match(tag["name"],
-                                        Bower.clean_semver(version)):
-                            target = tag
-                            break
-                if not target:
-                    click.secho(
-                        "fatal: failed to find matching tag for "
-                        "{user}/{repo} {version}".format(user, repo, version),
-                        fg="red")
-                    raise VersionNotFoundError
-                click.secho("installing {}/{}#{}".format(
-                    user, repo, tags[0]["name"]), fg="green")
-                return self.get_bower_package(
-                    url=target["zipball_url"],
-                    dest=dest,
-                    version=version)
-            raise NotImplementedError
-            click.echo("git clone {url}".format(url=url))
-            cmd = envoy.run('git clone {url} "{dest}"'.format(
-                url=url, dest=dest))
-        elif parsed_url.scheme in ("http", "https"):
-            zip_dest = download_file(url, dest=self.temp_dir,
-                                     label="{dest_basename}",
-                                     expected_extension="zip")
-            with zipfile.ZipFile(zip_dest, "r") as pkg:
-                return self.extract_bower_zipfile(pkg, dest,
-                                                  expected_version=version)
-                # pkg.extractall(str(dest))
-        else:
-            click.secho("protocol currently unsupported :(")
-            sys.exit(1)
+    @classmethod
+    def _parse_comparator(cls, token):
+        match = cls.comparator_regex.match(token)
+        if not match:
+            raise InvalidRequirementSpecError(
+                "invalid version range: {}".format(token))
+        op, major, minor, patch, prerelease = match.groups()
+        op = {None: "=", "==": "=", "~>": "~"}.get(op, op)
+        parts = [None if part is None or part in "xX*" else int(part)
+                 for part in (major, minor, patch)]
+        if parts[0] is None:
+            return [] if op in ("=", ">=", "<=", "~", "^") else \
+                [("<", "0.0.0")]
+        # a part after a wildcard is a wildcard too
+        if parts[1] is None:
+            parts[2] = None
+        major, minor, patch = parts
+        version = "{}.{}.{}{}".format(major, minor or 0, patch or 0,
+                                      prerelease or "")
 
-    def install_bower(self, package, save=True, save_dev=False):
-        """Installs a bower package.
+        def bump(major, minor=None):
+            if minor is None:
+                return "{}.0.0".format(major + 1)
+            return "{}.{}.0".format(major, minor + 1)
 
-        :param save: if `True`, pins the package to the Hydrogen requirements
-            YAML file.
-        :param save_dev: if `True`, pins the package as a development
-            dependency to the Hydrogen requirements YAML file.
-        :param return: a list of tuples, containing all installed package names
-            and versions, including any dependencies.
+        partial_upper = bump(major) if minor is None else bump(major, minor)
+        if op == "=":
+            if patch is None:
+                return [(">=", version), ("<", partial_upper)]
+            return [("=", version)]
+        if op == "~":
+            return [(">=", version), ("<", partial_upper if minor is None
+                                      else bump(major, minor))]
+        if op == "^":
+            if major > 0 or minor is None:
+                upper = bump(major)
+            elif minor > 0 or patch is None:
+                upper = bump(major, minor)
+            else:
+                upper = "0.0.{}".format(patch + 1)
+            return [(">=", version), ("<", upper)]
+        if op == ">" and patch is None:
+            return [(">=", partial_upper)]
+        if op == "<=" and patch is None:
+            return [("<", partial_upper)]
+        return [(op, version)]
+
+    @classmethod
+    def match_version(cls, version, version_spec):
+        """Return `True` if *version* satisfies the range *version_spec*.
+
+        Pre-release versions only match ranges which mention a pre-release.
+        An empty range, ``*`` and ``latest`` match any other version.
         """
-        requirement = Requirement.coerce(package)
-        url = Bower.get_package_url(requirement.package)
+        version = cls.parse_version(version) or version
+        for comparators in cls.parse_range(version_spec):
+            if "-" in version and not any("-" in v for _, v in comparators):
+                continue
+            if all(cls._compare(version, op, other)
+                   for op, other in comparators):
+                return True
+        return False
 
-        installed = []
-        for name, _ in self.get_bower_package(url):
-            installed.append(Requirement(name, requirement.version))
+    @staticmethod
+    def _compare(version, op, other):
+        result = semver.compare(version, other)
+        return {"<": result < 0, "<=": result <= 0, ">": result > 0,
+                ">=": result >= 0, "=": result == 0}[op]
 
-        for requirement in installed:
-            if save:
-                self.requirements["bower"].add(requirement, replace=True)
-            if save_dev:
-                self.requirements["bower-dev"].add(requirement, replace=True)
-            success("installed {}".format(str(requirement)))
-        if save or save_dev:
-            self.requirements.save()
-        return installed
 
-    def install_pip(self, package, save=True, save_dev=False):
-        """Installs a pip package.
+class TagIndex(object):
+    """The installable versions of a bower package, sorted once so the
+    highest version satisfying a set of ranges can be found by bisection.
 
-        :param save: if `True`, pins the package to the Hydrogen requirements
-            YAML file.
-        :param save_dev: if `True`, pins the package as a development
-            dependency to the Hydrogen requirements YAML file.
-        :param return: a **single** :class:`Requirement` object, representing
-            the installed version of the given package.
+    Iterating over an index yields ``(version, zipball_url)`` tuples,
+    highest version first.
+    """
+    #: tags requested per page of the GitHub API, which allows at most 100
+    per_page = 100
+    _indexes = {}
+    _indexes_lock = threading.Lock()
+    sort_key = staticmethod(cmp_to_key(lambda a, b: semver.compare(a, b)))
+
+    def __init__(self, zipballs=None, unversioned=None):
+        """Construct a new index.
+
+        :param zipballs: a mapping of versions to zipball URLs.
+        :param unversioned: the URL of a zipball whose version is unknown
+            until it is downloaded, which is then the only candidate.
         """
-        requirement = Requirement.coerce(package)
-        click.echo("pip install " + requirement.package)
-        cmd = envoy.run("pip install {}".format(str(requirement)))
-        if cmd.status_code == 0:
-            installed_packages = get_installed_pypackages()
-            package = installed_packages[requirement.package]
-            requirement.version = "=={}".format(package.version)
-            if save:
-                self.requirements["all"].add(requirement)
-            if save_dev:
-                self.requirements["dev"].add(requirement)
-            if save or save_dev:
-                self.requirements.save()
-            return requirement
-        else:
-            fatal(cmd.std_err)
+        zipballs = zipballs or {}
+        self.versions = Bower.sort_versions(zipballs)
+        self.zipballs = zipballs
+        self.unversioned = unversioned
+        self._keys = [self.sort_key(version) for version in self.versions]
 
+    @classmethod
+    def from_tags(cls, tags):
+        """Build an index from GitHub tag objects, skipping tags which are
+        not versions.
+        """
+        zipballs = {}
+        for tag in tags:
+            version = Bower.parse_version(tag["name"])
+            if version is not None:
+                zipballs.setdefault(version, tag["zipball_url"])
+        return cls(zipballs)
 
-def groups_option(f):
-    new_func = click.option("-g", "--groups",
-                            help="Comma-separated list of requirement groups "
-                            "to include.")(f)
-    return update_wrapper(new_func, f)
+    @classmethod
+    def for_github(cls, user, repo):
+        """Return the index of a GitHub repository's tags.
 
+        Every page of tags is fetched through the :class:`MetadataCache`, so
+        pages are revalidated rather than downloaded again. When the first
+        page links to the last one, the remaining pages are fetched
+        concurrently. Indexes are kept for the rest of the process.
+        """
+        key = (user, repo)
+        with cls._indexes_lock:
+            if key in cls._indexes:
+                return cls._indexes[key]
+        url = "{}/repos/{}/{}/tags?per_page={}".format(
+            github_api_uri, user, repo, cls.per_page)
+        with span("tags", repo="{}/{}".format(user, repo)):
+            cache = MetadataCache.default()
+            entry = cache.fetch(url)
+            tags = json.loads(entry["body"])
+            links = cls.parse_links(entry.get("link"))
+            last_page = cls.page_number(links.get("last"))
+            if last_page is not None:
+                urls = ["{}&page={}".format(url, page)
+                        for page in range(2, last_page + 1)]
+                for page in map_concurrently(cache.get, urls):
+                    tags.extend(page)
+            else:
+                while "next" in links:
+                    entry = cache.fetch(links["next"])
+                    tags.extend(json.loads(entry["body"]))
+                    links = cls.parse_links(entry.get("link"))
+        index = cls.from_tags(tags)
+        with cls._indexes_lock:
+            cls._indexes[key] = index
+        return index
 
-@click.group()
-@click.version_option(prog_name=prog_name)
-@click.pass_context
-def main(ctx):
-    which = "where" if sys.platform == "win32" else "which"
-    if envoy.run(which + " git").status_code != 0:
-        click.secho("fatal: git not found in PATH", fg="red")
-        sys.exit(1)
-    ctx.obj = Hydrogen()
+    @classmethod
+    def for_git(cls, url):
+        """Return the index of the tags of any git repository.
 
+        See :class:`GitCache`.
+        """
+        with cls._indexes_lock:
+            if url in cls._indexes:
+                return cls._indexes[url]
+        with span("tags", repo=url):
+            tags = GitCache.default().tags(url)
+        index = cls.from_tags({"name": tag,
+                               "zipball_url": GitCache.zipball_url(url, tag)}
+                              for tag in tags)
+        with cls._indexes_lock:
+            cls._indexes[url] = index
+        return index
 
-@main.command()
-@click.pass_obj
-@click.option("output_yaml", "--yaml", "-y", is_flag=True,
-              help="Show requirements in YAML format.")
-@click.option("--resolve", "-r", is_flag=True,
-              help="Resolve version numbers for ambiguous packages.")
-@groups_option
-def freeze(h, output_yaml, resolve, groups):
-    """Output installed packages."""
-    if not groups:
-        groups = filter(lambda group: not group.lower().startswith("bower"),
-                        h.requirements.keys())
-    else:
-        groups = [text_type.strip(group) for group in groups.split(",")]
+    @classmethod
+    def forget(cls):
+        """Forget the indexes kept so far, so they are fetched (or
+        revalidated) again.
+        """
+        with cls._indexes_lock:
+            cls._indexes.clear()
 
-    if output_yaml:
-        for requirements in h.requirements.values():
-            for requirement in requirements:
-                if resolve and not requirement.version:
-                    requirement.load_installed_version()
-        click.echo(h.requirements.yaml)
-    else:
-        for group in groups:
-            if not h.requirements[group]:
-                continue
-            click.echo("# {}".format(group))
-            for requirement in h.requirements[group]:
-                if resolve and not requirement.version:
-                    requirement.load_installed_version()
-                click.echo(str(requirement))
+    @staticmethod
+    def parse_links(header):
+        """Parse a ``Link`` header into a mapping of relations to URLs."""
+        if not header:
+            return {}
+        return dict((link["rel"], link["url"]) for link
+                    in requests.utils.parse_header_links(header)
+                    if "rel" in link)
 
+    @staticmethod
+    def page_number(url):
+        match = re.search(r"[?&]page=(\d+)", url or "")
+        return int(match.group(1)) if match else None
 
-@main.command()
-@click.pass_obj
-@click.option("--pip/--bower", default=True)
-@groups_option
-@click.option("--save", is_flag=True)
-@click.option("--save-dev", is_flag=True)
-@click.argument("packages", nargs=-1)
-def install(h, pip, groups, save, save_dev, packages):
-    """Install a pip or bower package."""
-    if groups:
-        groups = [text_type.strip(group) for group in groups.split(",")]
-    else:
-        groups = h.requirements.keys()
+    def __iter__(self):
+        if self.unversioned is not None:
+            return iter([(None, self.unversioned)])
+        return iter([(version, self.zipballs[version])
+                     for version in reversed(self.versions)])
 
-    if not packages:
-        for group in groups:
-            if group not in h.requirements:
-                warning("{} not in requirements".format(group))
-                continue
-            install = (h.install_bower if group.startswith("bower")
-                       else h.install_pip)
-            for requirement in h.requirements[group]:
-                install(str(requirement), save=False, save_dev=False)
-    if pip:
-        for package in packages:
-            h.install_pip(package, save=save, save_dev=save_dev)
-    else:
-        for package in packages:
-            h.install_bower(package, save=save, save_dev=save_dev)
+    def __len__(self):
+        return len(self.versions) + (self.unversioned is not None)
 
+    def select(self, specs):
+        """Return the highest version satisfying every range in *specs*.
 
-if __name__ == "__main__":
-    main()
+        The versions above the tightest upper bound of the ranges are
+        skipped by bisection, and the remaining ones are checked from the
+        highest down, stopping at the highest lower bound.
+
+        :param specs: an iterable of version ranges. Empty ranges match any
+            version.
+        :param return: a tuple of the version and its zipball URL, or `None`
+            if no version matches. For an unversioned zipball, the version
+            is `None`.
+        """
+        if self.unversioned is not None:
+            return None, self.unversioned
+        specs = [spec for spec in specs if spec]
+        high, low = len(self.versions), 0
+        for spec in specs:
+            upper, lower = self._bounds(Bower.parse_range(spec))
+            high, low = min(high, upper), max(low, lower)
+        for index in range(high - 1, low - 1, -1):
+            version = self.versions[index]
+            if all(Bower.match_version(version, spec) for spec in specs):
+                return version, self.zipballs[version]
+        return None
+
+    def _bounds(self, alternatives):
+        """Return the range of indexes of :attr:`versions` which may match
+        any of the alternatives of a parsed range.
+        """
+        high, low = 0, len(self.versions)
+        for comparators in alternatives:
+            upper, lower = len(self.versions), 0
+            for op, version in comparators:
+                key = self.sort_key(version)
+                if op == "<":
+                    upper = min(upper, bisect_left(self._keys, key))
+                elif op in ("<=", "="):
+                    upper = min(upper, bisect_right(self._keys, key))
+                if op in (">=", "="):
+                    lower = max(lower, bisect_left(self._keys, key))
+                elif op == ">":
+                    lower = max(lower, bisect_right(self._keys, key))
+            high, low = max(high, upper), min(low, lower)
+        return high, low
+
+
+class GitCache(Shared):
+    """A shared cache of bare git repositories, for bower packages hosted
+    outside GitHub.
+
+    Each repository is cloned once into the application directory, and each
+    tag is fetched into it on its own with ``--depth 1``, so installing
+    another version of a package only fetches the objects that are new to
+    the cache. Packages are exported with ``git archive`` as zipballs, so
+    they are installed just like packages downloaded from GitHub.
+    """
+
+    def __init__(self, path=None):
+        """Construct a new git cache.
+
+        :param path: the cache directory. Defaults to ``cache/git`` in the
+            application directory.
+        """
+        self.path = Path(path or os.path.join(app_dir, "cache", "git"))
+
+    def repository_path(self, url):
+        return self.path / (hashlib.sha1(url.encode("utf-8")).hexdigest() +
+                            ".git")
+
+    @staticmethod
+    def git(*args):
+        """Run git, and return its output.
+
+        :raises InvalidPackageError: if git fails.
+        """
+        require_git()
+        cmd = envoy.run([["git"] + [str(arg) for arg in args]])
+        if cmd.status_code != 0:
+            raise InvalidPackageError("git {} failed: {}".format(
+                args[0] if args[0] != "--git-dir" else args[2],
+                cmd.std_err.strip()))
+        return cmd.std_out
+
+    def tags(self, url):
+        """Return the names of the tags of the repository at *url*.
+
+        In offline mode, only the tags already fetched into the cache are
+        returned.
+        """
+        if offline:
+            repository = self.repository_path(url)
+            if not repository.exists():
+                raise OfflineError("{} is not cached".format(url))
+            output = self.git("--git-dir", repository, "for-each-ref",
+                              "--format=%(refname)", "refs/tags")
+            return [line[len("refs/tags/"):]
+                    for line in output.splitlines() if line]
+        output = self.git("ls-remote", "--tags", "--refs", url)
+        return [line.split("\t", 1)[1][len("refs/tags/"):]
+                for line in output.splitlines() if "\t" in line]
+
+    def archive(self, url, tag, dest):
+        """Export a tag of the repository at *url* as a zipball.
+
+        The tag is fetched into the cached repository unless it is already
+        there.
+
+        :param dest: the path of the zipball to write.
+        :raises OfflineError: if running in offline mode and the tag has not
+            been fetched before.
+        """
+        repository = self.repository_path(url)
+        ref = "refs/tags/" + tag
+        with file_lock(str(repository) + ".lock"):
+            if not repository.exists():
+                makedirs(self.path)
+                self.git("init", "--bare", "--quiet", repository)
+            cmd = envoy.run([["git", "--git-dir", str(repository),
+                              "rev-parse", "--verify", "--quiet",
+                              ref + "^{commit}"]])
+            if cmd.status_code != 0:
+                if offline:
+                    raise OfflineError("{}#{} is not cached".format(url, tag))
+                with span("git fetch", url=url, tag=tag):
+                    self.git("--git-dir", repository, "fetch", "--quiet",
+                             "--depth", "1", "--no-tags", url,
+                             "+{0}:{0}".format(ref))
+            name = urlparse(url).path.rstrip("/").rsplit("/", 1)[-1]
+            if name.endswith(".git"):
+                name = name[:-4]
+            self.git("--git-dir", repository, "archive", "--format=zip",
+                     "--prefix={}-{}/".format(name, tag), "-o", dest, ref)
+
+    @staticmethod
+    def zipball_url(url, tag):
+        """Return the pseudo URL a tag of a repository is installed from,
+        which :meth:`Hydrogen.fetch_zipball` understands.
+        """
+        return "git+{}#{}".format(url, tag)
+
+    @staticmethod
+    def parse_zipball_url(url):
+        """Split a pseudo URL from :meth:`zipball_url` into the repository
+        URL and tag, or return `None` if it is not one.
+        """
+        if not url.startswith("git+") or "#" not in url:
+            return None
+        return tuple(url[len("git+"):].rsplit("#", 1))
+
+
+class PackageStore(object):
+    """A global store of extracted bower packages, shared by every project.
+
+    Each zipball is extracted once, into a directory named after its
+    SHA-256, and projects' assets are populated from there with hardlinks
+    (see :func:`link_file`), so installing a package another project
+    already uses costs no extraction and no extra disk space.
+
+    .. note::
+        As with pnpm, files hardlinked from the store must not be edited in
+        place. Hydrogen itself always replaces files rather than writing
+        into them.
+    """
+
+    def __init__(self, path=None):
+        """Construct a new store.
+
+        :param path: the store directory. Defaults to ``store`` in the
+            application directory.
+        """
+        self.path = Path(path or os.path.join(app_dir, "store"))
+
+    def package_path(self, digest):
+        return self.path / digest[:2] / digest
+
+    def add(self, zip_file, digest, directories, members):
+        """Extract a zipball into the store, unless it is already there.
+
+        :param digest: the SHA-256 of the zipball.
+        :param directories: the directories to create, relative to the
+            package.
+        :param members: a list of ``(member name, path)`` tuples of the
+            files to extract.
+        :param return: the path of the package in the store.
+        """
+        package_path = self.package_path(digest)
+        if package_path.exists():
+            return str(package_path)
+        makedirs(package_path.parent)
+        with file_lock(str(package_path) + ".lock"):
+            if package_path.exists():
+                return str(package_path)
+            temp_path = tempfile.mkdtemp(dir=str(package_path.parent),
+                                         prefix=".tmp-")
+            try:
+                for directory in directories:
+                    makedirs(os.path.join(temp_path, directory))
+                extract_members(zip_file, temp_path, members)
+                # only complete packages ever appear under their digest
+                os.rename(temp_path, str(package_path))
+            except BaseException:
+                shutil.rmtree(temp_path, ignore_errors=True)
+                raise
+        return str(package_path)
+
+    def clean(self):
+        """Remove the entire store. Installed projects keep their files."""
+        if self.path.exists():
+            shutil.rmtree(str(self.path), ignore_errors=True)
+
+
+class DownloadCache(object):
+    """A persistent, content-addressed cache of downloaded files.
+
+    Every file is stored once under ``blobs/``, named after the SHA-256 of its
+    contents, and ``urls/`` maps the SHA-1 of each source URL to a blob. All
+    writes go through a temporary file and an atomic rename, so the cache can
+    be shared by several processes on the same host. When the cache grows
+    beyond :attr:`max_size`, the least recently used blobs are evicted.
+
+    .. note::
+        A URL's entry is only trusted as is for URLs which always serve the
+        same content (see :meth:`is_immutable`). Other entries keep the
+        response's ``ETag``/``Last-Modified`` so they can be revalidated.
+    """
+    default_max_size = 512 * 1024 * 1024
+
+    def __init__(self, path=None, max_size=None):
+        """Construct a new download cache.
+
+        :param path: the cache directory. Defaults to ``cache/downloads``
+            in the application directory.
+        :param max_size: the size in bytes above which blobs are evicted.
+        """
+        self.path = Path(path or os.path.join(app_dir, "cache", "downloads"))
+        self.max_size = max_size or self.default_max_size
+
+    @staticmethod
+    def url_key(url):
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    def blob_path(self, digest):
+        return self.path / "blobs" / digest[:2] / digest
+
+    def url_path(self, url):
+        return self.path / "urls" / (self.url_key(url) + ".json")
+
+    @staticmethod
+    def is_immutable(url):
+        """Tell whether *url* always serves the same content: a tag exported
+        from a git repository (see :meth:`GitCache.zipball_url`), or a
+        GitHub zipball of a tag.
+        """
+        if GitCache.parse_zipball_url(url) is not None:
+            return True
+        parsed_url = urlparse(url)
+        parts = parsed_url.path.strip("/").split("/")
+        if url.startswith(github_api_uri + "/repos/"):
+            ref = parts[parts.index("zipball") + 1:] \
+                if "zipball" in parts else None
+        elif parsed_url.netloc == "codeload.github.com":
+            ref = parts[3:] if parts[2:3] == ["zip"] else None
+        else:
+            return False
+        if not ref:
+            return False
+        if ref[:2] == ["refs", "tags"]:
+            return len(ref) > 2
+        return len(ref) == 1 and Bower.parse_version(ref[0]) is not None
+
+    def entry(self, url):
+        """Return the cache index entry of *url*, or `None`."""
+        try:
+            with self.url_path(url).open("rb") as f:
+                return json.loads(f.read().decode("utf-8"))
+        except (IOError, OSError, ValueError):
+            return None
+
+    def lookup(self, url):
+        """Return the path of the cached copy of *url*, or `None`.
+
+        A hit marks the blob as recently used.
+        """
+        entry = self.entry(url)
+        if entry is None:
+            return None
+        return self.lookup_digest(entry["sha256"])
+
+    def lookup_digest(self, digest):
+        """Return the path of the cached blob with the given SHA-256, or
+        `None`.
+        """
+        blob = self.blob_path(digest)
+        try:
+            os.utime(str(blob), None)
+        except OSError:
+            return None
+        return str(blob)
+
+    def download(self, url, sha256=None, progress=False, label=None,
+                 revalidate=False):
+        """Download *url* into the cache, unless it is already cached.
+
+        The download goes to ``partial/``, where an interrupted download is
+        resumed by the next attempt (see :func:`fetch_resumable`), and a
+        lock file makes processes downloading the same URL wait for each
+        other rather than fetch it twice.
+
+        :param sha256: the expected SHA-256 of the file.
+        :param revalidate: if `True`, a copy cached by URL is only used if
+            the server answers a conditional request with ``304 Not
+            Modified``.
+        :raises InvalidPackageError: if the download is corrupt.
+        :param return: a tuple of the path of the cached blob and its SHA-256.
+        """
+        key = self.url_key(url)
+        partial = self.path / "partial"
+        with file_lock(partial / (key + ".lock")):
+            blob = sha256 and self.lookup_digest(sha256)
+            if blob:
+                return blob, sha256
+            entry = self.entry(url)
+            blob = entry and self.lookup_digest(entry["sha256"])
+            headers = {}
+            if blob and revalidate:
+                if entry.get("etag"):
+                    headers["If-None-Match"] = entry["etag"]
+                if entry.get("last_modified"):
+                    headers["If-Modified-Since"] = entry["last_modified"]
+            if blob and not headers:
+                if not revalidate:
+                    return blob, entry["sha256"]
+                blob = None
+            response = get(url, stream=True, headers=headers)
+            if blob and response.status_code == 304:
+                response.close()
+                count("download cache revalidations")
+                return blob, entry["sha256"]
+            validators = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+            digest, _ = fetch_resumable(url, partial / (key + ".part"),
+                                        sha256=sha256, progress=progress,
+                                        label=label, response=response)
+            return self.add(url, str(partial / (key + ".part")), digest,
+                            validators), digest
+
+    def add(self, url, temp_path, digest, validators=None):
+        """Move a file with a known SHA-256 into the cache.
+
+        :param temp_path: a temporary file on the same filesystem as the
+            cache, which is renamed into place.
+        :param validators: the ``etag`` and ``last_modified`` of the
+            response, which are kept to revalidate the entry.
+        :param return: the path of the cached blob.
+        """
+        blob = self.blob_path(digest)
+        makedirs(blob.parent)
+        if blob.exists():
+            remove_file(temp_path)
+            os.utime(str(blob), None)
+        else:
+            replace_file(temp_path, str(blob))
+        entry = {"url": url, "sha256": digest,
+                 "size": os.path.getsize(str(blob))}
+        entry.update((name, value) for name, value
+                     in (validators or {}).items() if value)
+        makedirs(self.url_path(url).parent)
+        atomic_write(self.url_path(url),
+                     json.dumps(entry, sort_keys=True).encode("utf-8"))
+        self.evict(keep=blob)
+        return str(blob)
+
+    def blobs(self):
+        """Yield ``(path, size, last_used)`` for every cached blob."""
+        blobs_dir = self.path / "blobs"
+        if not blobs_dir.is_dir():
+            return
+        for directory in blobs_dir.iterdir():
+            if not directory.is_dir():
+                continue
+            for blob in directory.iterdir():
+                if blob.name.startswith("."):
+                    continue
+                try:
+                    stat = blob.stat()
+                except OSError:
+                    continue
+                yield blob, stat.st_size, stat.st_mtime
+
+    def url_entries(self):
+        """Yield ``(path, entry)`` for every URL mapping."""
+        urls_dir = self.path / "urls"
+        if not urls_dir.is_dir():
+            return
+        for path in urls_dir.iterdir():
+            try:
+                with path.open("rb") as f:
+                    yield path, json.loads(f.read().decode("utf-8"))
+            except (IOError, OSError, ValueError):
+                yield path, None
+
+    def stats(self):
+        blobs = list(self.blobs())
+        return {
+            "path": str(self.path),
+            "blobs": len(blobs),
+            "urls": len(list(self.url_entries())),
+            "size": sum(size for _, size, _ in blobs),
+            "max_size": self.max_size,
+        }
+
+    def evict(self, max_size=None, keep=None):
+        """Remove least recently used blobs until the cache fits.
+
+        :param max_size: the target size in bytes. Defaults to
+            :attr:`max_size`.
+        :param keep: the path of a blob which must not be evicted, such as
+            one which was just stored.
+        :param return: the number of blobs removed.
+        """
+        max_size = self.max_size if max_size is None else max_size
+        blobs = sorted(self.blobs(), key=lambda blob: blob[2])
+        total = sum(size for _, size, _ in blobs)
+        removed = 0
+        for blob, size, _ in blobs:
+            if total <= max_size:
+                break
+            if keep is not None and blob == Path(keep):
+                continue
+            remove_file(blob)
+            total -= size
+            removed += 1
+        return removed
+
+    def clean(self):
+        """Remove the entire cache."""
+        if self.path.exists():
+            shutil.rmtree(str(self.path), ignore_errors=True)
+
+    def verify(self):
+        """Check every blob against its digest.
+
+        Corrupt blobs, and URL mappings which point to missing blobs, are
+        removed.
+
+        :param return: a tuple of the number of valid blobs and the number of
+            removed files.
+        """
+        valid = removed = 0
+        for blob, _, _ in list(self.blobs()):
+            if file_digest(blob) == blob.name:
+                valid += 1
+            else:
+                remove_file(blob)
+                removed += 1
+        for path, entry in list(self.url_entries()):
+            if entry is None or not self.blob_path(entry["sha256"]).exists():
+                remove_file(path)
+                removed += 1
+        return valid, removed
+
+
+class BowerResolver(object):
+    """Resolves a whole bower dependency graph before anything is installed.
+
+    The graph is built breadth first from ``bower.json`` metadata, fetching
+    each level concurrently. Every package collects the version ranges its
+    dependents require, and the highest version satisfying all of them is
+    selected. When a selection changes, the ranges it imposed on its own
+    dependencies are replaced and those dependencies are revisited. A
+    package which nothing requires any more is dropped, along with the
+    ranges it imposed, recursively.
+
+    Once resolved, :meth:`packages` lists every unique package exactly once,
+    dependencies before their dependents.
+    """
+    max_rounds = 100
+
+    def __init__(self, hydrogen, dest=None):
+        """Construct a new resolver.
+
+        :param dest: the directory packages will be installed into. Packages
+            already installed there, from the zipball which would be
+            selected, are not downloaded again.
+        """
+        self.hydrogen = hydrogen
+        self.installed = load_manifests(dest) if dest else {}
+        self.roots = set()
+        self.urls = {}
+        self.constraints = defaultdict(dict)
+        self.candidates = {}
+        self.selected = {}
+
+    def add(self, name, version=None, url=None):
+        """Add a top-level requirement.
+
+        :param name: the package name.
+        :param version: a version range, or `None` for any version.
+        :param url: the package URL. If not given, it is looked up in the
+            bower registry.
+        """
+        self.roots.add(name)
+        if url is not None:
+            self.urls[name] = url
+        self.constraints[name][None] = version
+
+    def resolve(self):
+        """Resolve all requirements added so far.
+
+        :raises VersionConflictError: if no version of a package satisfies
+            all of its dependents.
+        :param return: the list returned by :meth:`packages`.
+        """
+        with span("resolve"):
+            pending = set(self.constraints)
+            rounds = 0
+            while pending:
+                rounds += 1
+                if rounds > self.max_rounds:
+                    raise VersionConflictError(
+                        "could not settle versions of {}".format(
+                            ", ".join(sorted(pending))))
+                for name in list(pending):
+                    if not self.constraints[name]:
+                        pending |= self.unselect(name)
+                names = sorted(name for name in pending
+                               if self.constraints[name])
+                pending = set()
+                selections = map_concurrently(self.select, names,
+                                              self.hydrogen.workers)
+                for name, package in zip(names, selections):
+                    if package is None:
+                        continue
+                    previous = self.selected.get(name)
+                    self.selected[name] = package
+                    dependencies = package["dependencies"]
+                    for dependency in (previous or {}).get("dependencies", {}):
+                        if dependency not in dependencies:
+                            self.constraints[dependency].pop(name, None)
+                            pending.add(dependency)
+                    for dependency, version in dependencies.items():
+                        constraints = self.constraints[dependency]
+                        if name not in constraints or \
+                                constraints[name] != version:
+                            constraints[name] = version
+                            pending.add(dependency)
+            return self.packages()
+
+    def unselect(self, name):
+        """Drop the selection of a package which is no longer required, and
+        the ranges it imposed on its dependencies, recursively.
+
+        :param return: the names of the packages whose ranges changed.
+        """
+        package = self.selected.pop(name, None)
+        if package is None:
+            return set()
+        changed = set()
+        for dependency in package["dependencies"]:
+            self.constraints[dependency].pop(name, None)
+            changed.add(dependency)
+            if not self.constraints[dependency]:
+                changed |= self.unselect(dependency)
+        return changed
+
+    def select(self, name):
+        """Select the highest version of *name* satisfying every range
+        required of it.
+
+        :param return: the selected package, or `None` if the current
+            selection still stands.
+        """
+        constraints = self.constraints[name]
+        if not constraints:
+            return None
+        if name not in self.candidates:
+            if name not in self.urls:
+                self.urls[name] = Bower.get_package_url(name)
+            self.candidates[name] = self.hydrogen.get_bower_candidates(
+                self.urls[name])
+        selected = self.candidates[name].select(constraints.values())
+        if selected is None:
+            raise VersionConflictError(self.describe_conflict(name))
+        version, zipball_url = selected
+        current = self.selected.get(name)
+        if current is not None and current["url"] == zipball_url:
+            return None
+
+        manifest = self.installed.get(zipball_url)
+        if manifest is not None:
+            return {
+                "name": name,
+                "version": version or manifest["version"],
+                "url": zipball_url,
+                "zip": None,
+                "sha256": manifest["sha256"],
+                "dependencies": manifest.get("dependencies", {}),
+            }
+        zip_dest, sha256 = self.hydrogen.fetch_zipball(zipball_url)
+        with zipfile.ZipFile(zip_dest, "r") as pkg:
+            bower_json, _ = read_bower_json(pkg)
+        if version is None:
+            version = bower_json.get("version")
+            if not all(Bower.match_version(version, spec)
+                       for spec in constraints.values() if spec):
+                raise VersionConflictError(self.describe_conflict(name))
+        return {
+            "name": name,
+            "version": version,
+            "url": zipball_url,
+            "zip": zip_dest,
+            "sha256": sha256,
+            "dependencies": bower_json.get("dependencies", {}),
+        }
+
+    def describe_conflict(self, name):
+        required = ", ".join(
+            "{} (required by {})".format(version or "*", dependent or "you")
+            for dependent, version in sorted(
+                self.constraints[name].items(),
+                key=lambda item: item[0] or ""))
+        return "no version of {} satisfies {}".format(name, required)
+
+    def packages(self):
+        """Return resolved packages reachable from the top-level
+        requirements, dependencies first.
+
+        Dependency cycles are reported, and broken at the package which
+        closes the cycle.
+        """
+        ordered = []
+        state = {}
+
+        def visit(name, path):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                cycle = path[path.index(name):] + [name]
+                warning("dependency cycle: {}".format(" -> ".join(cycle)))
+                return
+            state[name] = "visiting"
+            for dependency in sorted(self.selected[name]["dependencies"]):
+                visit(dependency, path + [name])
+            state[name] = "done"
+            ordered.append(self.selected[name])
+
+        for root in sorted(self.roots):
+            visit(root, [])
+        return ordered
+
+
+class Hydrogen(object):
+    #: zipballs up to this size are kept in memory when caching is disabled
+    spool_max_size = 32 * 1024 * 1024
+
+    def __init__(self, assets_dir=None, requirements_file="requirements.yml",
+                 workers=None, cache=True, store=True, wheelhouse=None):
+        """Construct a new Hydrogen instance.
+
+        :param workers: maximum number of bower dependencies fetched at
+            once. Defaults to `default_workers`.
+        :param cache: if `True`, downloaded zipballs are kept in a
+            :class:`DownloadCache`. A :class:`DownloadCache` instance may
+            also be given.
+        :param store: if `True`, packages are extracted into the global
+            :class:`PackageStore` and linked into the assets directory. A
+            :class:`PackageStore` instance may also be given.
+        :param wheelhouse: a directory of wheels (see
+            :meth:`build_wheelhouse`). If given, pip packages are installed
+            from it alone, without accessing the package index.
+
+        Construction is cheap: the requirements file is only loaded, and the
+        temporary directory only created, once they are first needed.
+        """
+        self.assets_dir = assets_dir or Path(".") / "assets"
+        self.requirements_file = requirements_file
+        self.workers = workers or default_workers
+        reserve_connections(self.workers)
+        if cache is True:
+            cache = DownloadCache()
+        self.cache = cache or None
+        if store is True:
+            store = PackageStore()
+        self.store = store or None
+        self.wheelhouse = wheelhouse
+        self._requirements = None
+        self._temp_dir = None
+        self._lock = threading.Lock()
+        self._package_locks = {}
+
+    def close(self):
+        """Remove the temporary directory, if one was created.
+
+        It is otherwise only removed when the process exits, so long-lived
+        processes such as the :class:`Daemon` call this after each command.
+        """
+        with self._lock:
+            if self._temp_dir is not None:
+                shutil.rmtree(self._temp_dir, ignore_errors=True)
+                self._temp_dir = None
+
+    @property
+    def requirements(self):
+        """The :class:`GroupedRequirements` loaded from the requirements
+        file, which is created if it does not exist yet.
+        """
+        if self._requirements is None:
+            requirements = GroupedRequirements(cache=self.cache is not None)
+            requirements.load(self.requirements_file)
+            self._requirements = requirements
+        return self._requirements
+
+    @property
+    def temp_dir(self):
+        """A temporary directory, removed on exit."""
+        with self._lock:
+            if self._temp_dir is None:
+                self._temp_dir = mkdtemp()
+        return self._temp_dir
+
+    def package_lock(self, name):
+        """Return the lock guarding writes to the assets of *name*.
+
+        Two dependents may require the same package concurrently, in which
+        case both workers extract it into the same directory; the lock
+        keeps them from interleaving writes.
+        """
+        with self._lock:
+            return self._package_locks.setdefault(name, threading.Lock())
+
+    def get_bower_dependencies(self, dependencies, dest):
+        """Resolve, fetch and extract a set of dependencies.
+
+        :param dependencies: a mapping of package names to version specs, as
+            found in the ``dependencies`` section of a ``bower.json`` file.
+        :param dest: the directory packages are extracted into.
+        :param return: a list of tuples, containing the names and versions of
+            all installed packages, in dependency order.
+        """
+        resolver = BowerResolver(self, dest)
+        for package, version in dependencies.items():
+            resolver.add(package, version)
+        return self.install_resolved(resolver.resolve(), dest)
+
+    def install_resolved(self, packages, dest):
+        """Extract packages selected by a :class:`BowerResolver`.
+
+        Packages are extracted concurrently. As each of them appears only
+        once, no package directory is written by more than one worker.
+        Packages which are already installed from the same zipball are
+        skipped, unless some of their files have gone missing.
+        """
+        manifests = load_manifests(dest)
+
+        def install(package):
+            manifest = manifests.get(package["url"])
+            if manifest is not None and manifest_is_intact(dest, manifest):
+                return manifest["name"], package["version"]
+            zip_dest = package["zip"]
+            if zip_dest is None:
+                zip_dest, _ = self.fetch_zipball(package["url"],
+                                                 sha256=package["sha256"])
+            source = {"url": package["url"], "sha256": package["sha256"]}
+            with zipfile.ZipFile(zip_dest, "r") as pkg:
+                [(name, _)] = self.extract_bower_zipfile(pkg, dest,
+                                                         process_deps=False,
+                                                         source=source)
+            return name, package["version"]
+
+        return map_concurrently(install, packages, self.workers)
+
+    def extract_bower_zipfile(self, zip_file, dest, expected_version=None,
+                              process_deps=True, source=None):
+        """Extract a zipped bower package into *dest*.
+
+        A manifest of the installed version and the CRC and size of every
+        file is kept in *dest*. When a package is reinstalled, only files
+        whose CRC or size changed are written, and files which are no
+        longer part of the package are removed.
+
+        :param source: a dict with the ``url`` and ``sha256`` of the zipball,
+            recorded in the manifest so an unchanged package can be skipped
+            entirely next time. If the SHA-256 is known and the
+            :class:`PackageStore` is enabled, files are linked from the
+            store instead of being extracted into *dest*.
+        :param return: a list of tuples, containing the names and versions of
+            the package and any dependencies installed.
+        """
+        deps_installed = []
+        bower_json, root = read_bower_json(zip_file)
+        version = bower_json.get("version")
+        if expected_version is not None:
+            if not Bower.match_version(version, expected_version):
+                echo("error: versions do not match ({} =/= {})".format(
+                    version, expected_version))
+                raise InvalidPackageError
+        if "dependencies" in bower_json and process_deps:
+            deps_installed.extend(self.get_bower_dependencies(
+                bower_json["dependencies"], dest))
+        path_spec = compile_ignore_patterns(bower_json.get("ignore", []))
+        directories, members = select_package_members(
+            zip_file.namelist(), root, path_spec)
+        package_dir = dest / bower_json["name"]
+        manifest_file = manifest_path(dest, bower_json["name"])
+        # the same package may be required by several dependents at once
+        with self.package_lock(bower_json["name"]), \
+                span("extract", package=bower_json["name"]):
+            previous = (read_manifest(manifest_file) or {}).get("files", {})
+            files = {}
+            store_path = None
+            if self.store is not None and (source or {}).get("sha256"):
+                store_path = self.store.add(zip_file, source["sha256"],
+                                            directories, members)
+            makedirs(package_dir)
+            for directory in directories:
+                makedirs(package_dir / directory)
+            pending = []
+            for name, path in members:
+                info = zip_file.getinfo(name)
+                files[path] = [info.CRC, info.file_size]
+                target_path = package_dir / path
+                if store_path is not None:
+                    stored = os.path.join(store_path, path)
+                    try:
+                        if (previous.get(path) == files[path] and
+                                os.path.samefile(stored, str(target_path))):
+                            continue
+                    except OSError:
+                        pass
+                    remove_file(target_path)
+                    count("files " + link_file(stored, str(target_path)))
+                    continue
+                if previous.get(path) == files[path]:
+                    try:
+                        if os.path.getsize(str(target_path)) == \
+                                info.file_size:
+                            continue
+                    except OSError:
+                        pass
+                # never write into a file which may be linked to the store
+                remove_file(target_path)
+                pending.append((name, path))
+            extract_members(zip_file, package_dir, pending)
+            for path in set(previous) - set(files):
+                remove_file(package_dir / path)
+                remove_empty_dirs(package_dir / path, package_dir)
+            makedirs(manifest_file.parent)
+            atomic_write(manifest_file, json.dumps({
+                "name": bower_json["name"],
+                "version": version,
+                "url": (source or {}).get("url"),
+                "sha256": (source or {}).get("sha256"),
+                "dependencies": bower_json.get("dependencies", {}),
+                "files": files,
+            }, sort_keys=True).encode("utf-8"))
+        deps_installed.append((bower_json["name"], version))
+        return deps_installed
+
+    def get_bower_candidates(self, url):
+        """List the versions of a bower package which can be installed.
+
+        :param return: a :class:`TagIndex`, which yields ``(version,
+            zipball_url)`` tuples, highest version first. For plain zipball
+            URLs, the only candidate's version is `None`, as it is only
+            known once downloaded.
+        """
+        parsed_url = urlparse(url)
+        if (parsed_url.scheme in ("git", "file", "ssh")
+                or parsed_url.path.endswith(".git")):
+            if parsed_url.netloc == "github.com":
+                user, repo = parsed_url.path[1:-4].split("/")
+                index = TagIndex.for_github(user, repo)
+                if not len(index):
+                    echo("fatal: no tags exist for {}/{}".format(
+                        user, repo), fg="red")
+                    raise InvalidPackageError
+                return index
+            index = TagIndex.for_git(url)
+            if not len(index):
+                echo("fatal: no tags exist for {}".format(url), fg="red")
+                raise InvalidPackageError
+            return index
+        elif parsed_url.scheme in ("http", "https"):
+            return TagIndex(unversioned=url)
+        else:
+            echo("protocol currently unsupported :(")
+            sys.exit(1)
+
+    def resolve_bower_package(self, url, version=None):
+        """Resolve a bower package URL to the URL of its zipball.
+
+        Git URLs hosted on GitHub are resolved to the zipball of the highest
+        tag matching *version*, while http(s) URLs are returned as is.
+
+        :param return: a tuple of the zipball URL and the resolved version,
+            which is `None` unless *url* points to a git repository.
+        """
+        selected = self.get_bower_candidates(url).select([version])
+        if selected is None:
+            echo("fatal: failed to find matching tag for "
+                 "{url} {version}".format(url=url, version=version),
+                 fg="red")
+            raise VersionNotFoundError
+        candidate, zipball_url = selected
+        if candidate is not None:
+            echo("installing {}#{}".format(url, candidate), fg="green")
+        return zipball_url, candidate
+
+    def fetch_zipball(self, url, sha256=None, progress=True):
+        """Return a local copy of the zipball at *url*, and its SHA-256.
+
+        The download cache is consulted first: by content digest if *sha256*
+        is given, and otherwise by URL. A copy cached by URL is used as is
+        only for tagged zipballs (see :meth:`DownloadCache.is_immutable`)
+        or when offline; others are revalidated with the server. Downloads
+        are hashed while they stream, either into the cache, where
+        interrupted downloads are resumed and large ones are fetched in
+        parallel segments (see :meth:`DownloadCache.download`), or, if
+        caching is disabled, into a buffer which is kept in memory up to
+        :attr:`spool_max_size` bytes and spills to disk beyond that. Either
+        way, the returned copy (a path or a file object) can be passed to
+        :class:`zipfile.ZipFile` without another round trip through a
+        temporary file.
+
+        :raises OfflineError: if running in offline mode and the zipball is
+            not cached.
+        """
+        if self.cache:
+            zip_dest = sha256 and self.cache.lookup_digest(sha256)
+            if not zip_dest and (offline or
+                                 self.cache.is_immutable(url)):
+                zip_dest = self.cache.lookup(url)
+            if zip_dest:
+                count("download cache hits")
+                return zip_dest, os.path.basename(zip_dest)
+        git_source = GitCache.parse_zipball_url(url)
+        if git_source is not None:
+            return self.fetch_git_archive(url, *git_source)
+        if offline:
+            raise OfflineError("{} is not cached".format(url))
+        label = "/".join(part for part in urlparse(url).path.split("/")[-3:]
+                         if part and part != "zipball")
+        with span("download", url=url):
+            if self.cache:
+                return self.cache.download(url, sha256=sha256,
+                                           progress=progress, label=label,
+                                           revalidate=True)
+            response = get(url, stream=True)
+            try:
+                buf = tempfile.SpooledTemporaryFile(
+                    max_size=self.spool_max_size, dir=self.temp_dir)
+                digest, _ = stream_response(response, buf,
+                                            progress=progress, label=label)
+                buf.seek(0)
+                return buf, digest
+            finally:
+                response.close()
+
+    def fetch_git_archive(self, url, repository_url, tag):
+        """Export a tag of a git repository as a zipball, adding it to the
+        download cache under its pseudo URL (see :class:`GitCache`).
+
+        :param return: a tuple of the path of the zipball and its SHA-256.
+        """
+        temp_dir = (str(self.cache.path / "partial") if self.cache
+                    else self.temp_dir)
+        makedirs(temp_dir)
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir, suffix=".zip")
+        os.close(fd)
+        try:
+            GitCache.default().archive(repository_url, tag, temp_path)
+            digest = file_digest(temp_path)
+            if self.cache:
+                return self.cache.add(url, temp_path, digest), digest
+            return temp_path, digest
+        except BaseException:
+            remove_file(temp_path)
+            raise
+
+    def get_bower_package(self, url, dest=None, version=None,
+                          process_deps=True, progress=True, name=None):
+        dest = dest or Path(".") / "assets"
+        if process_deps:
+            resolver = BowerResolver(self, dest)
+            resolver.add(name or url, version, url=url)
+            return self.install_resolved(resolver.resolve(), dest)
+        zipball_url, _ = self.resolve_bower_package(url, version)
+        zip_dest, sha256 = self.fetch_zipball(zipball_url, progress=progress)
+        with zipfile.ZipFile(zip_dest, "r") as pkg:
+            return self.extract_bower_zipfile(
+                pkg, dest, expected_version=version,
+                process_deps=process_deps,
+                source={"url": zipball_url, "sha256": sha256})
+
+    def install_bower(self, package, save=True, save_dev=False):
+        """Installs a bower package.
+
+        :param save: if `True`, pins the package to the Hydrogen requirements
+            YAML file.
+        :param save_dev: if `True`, pins the package as a development
+            dependency to the Hydrogen requirements YAML file.
+        :param return: a list of :class:`Requirement` objects, pinning all
+            installed packages, including any dependencies.
+        """
+        requirement = Requirement.coerce(package)
+        url = Bower.get_package_url(requirement.package)
+
+        installed = []
+        for name, version in self.get_bower_package(
+                url, dest=self.assets_dir, version=requirement.version,
+                name=requirement.package):
+            installed.append(Requirement(name, version))
+            success("installed {}=={}".format(name, version))
+
+        # only the requested package is saved, with the requested range
+        if save:
+            self.requirements["bower"].add(requirement, replace=True)
+        if save_dev:
+            self.requirements["bower-dev"].add(requirement, replace=True)
+        if save or save_dev:
+            self.requirements.save()
+        return installed
+
+    def install_bower_batch(self, requirements, dest=None):
+        """Installs several bower packages, resolving their dependencies
+        together so shared dependencies are only fetched once.
+
+        :param requirements: an iterable of strings or :class:`Requirement`
+            objects.
+        :param return: a list of tuples, containing all installed package
+            names and versions, including any dependencies.
+        """
+        dest = dest or self.assets_dir
+        resolver = BowerResolver(self, dest)
+        for requirement in requirements:
+            requirement = Requirement.coerce(str(requirement))
+            resolver.add(requirement.package, requirement.version)
+        installed = self.install_resolved(resolver.resolve(), dest)
+        for name, version in installed:
+            success("installed {}=={}".format(name, version))
+        return installed
+
+    def install_pip(self, package, save=True, save_dev=False):
+        """Installs a pip package.
+
+        :param save: if `True`, pins the package to the Hydrogen requirements
+            YAML file.
+        :param save_dev: if `True`, pins the package as a development
+            dependency to the Hydrogen requirements YAML file.
+        :param return: a **single** :class:`Requirement` object, representing
+            the installed version of the given package.
+        """
+        requirement = Requirement.coerce(package)
+        echo("pip install " + requirement.package)
+        with span("pip install"):
+            cmd = envoy.run("pip install {}{}".format(
+                self.pip_index_options, str(requirement)))
+        InstalledPackageIndex.default().invalidate()
+        if cmd.status_code == 0:
+            installed_packages = get_installed_pypackages()
+            requirement.version = "=={}".format(
+                installed_packages[requirement.key])
+            if save:
+                self.requirements["all"].add(requirement)
+            if save_dev:
+                self.requirements["dev"].add(requirement)
+            if save or save_dev:
+                self.requirements.save()
+            return requirement
+        else:
+            fatal(cmd.std_err)
+
+    @property
+    def pip_index_options(self):
+        """Options making pip install from the wheelhouse, if any."""
+        if self.wheelhouse is None:
+            return ""
+        return '--no-index --find-links "{}" '.format(self.wheelhouse)
+
+    def install_pip_batch(self, requirements, save=False, save_dev=False,
+                          hashes=None, no_deps=False):
+        """Installs several pip packages with a single pip invocation.
+
+        The requirements are written to a temporary requirements file passed
+        to ``pip install -r``, and installed versions are looked up with a
+        single scan of the working set once pip has finished.
+
+        :param requirements: an iterable of strings or :class:`Requirement`
+            objects.
+        :param save: if `True`, pins the packages to the Hydrogen requirements
+            YAML file.
+        :param save_dev: if `True`, pins the packages as development
+            dependencies to the Hydrogen requirements YAML file.
+        :param hashes: an optional mapping of package names to lists of
+            allowed archive hashes (such as ``sha256:...``). When given, pip
+            runs in hash-checking mode and does not install dependencies.
+        :param no_deps: if `True`, dependencies are not installed.
+        :param return: a list of :class:`Requirement` objects, representing
+            the installed versions of the given packages.
+        """
+        requirements = [Requirement.coerce(str(requirement))
+                        for requirement in requirements]
+        if not requirements:
+            return []
+        lines = []
+        for requirement in requirements:
+            line = str(requirement)
+            if hashes:
+                line += "".join(" --hash={}".format(digest) for digest
+                                in hashes.get(requirement.package, []))
+            lines.append(line)
+        fd, requirements_txt = tempfile.mkstemp(suffix=".txt",
+                                                dir=self.temp_dir)
+        with os.fdopen(fd, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        echo("pip install " + " ".join(r.package for r in requirements))
+        with span("pip install", packages=len(requirements)):
+            cmd = envoy.run('pip install {}{}-r "{}"'.format(
+                "--no-deps " if hashes or no_deps else "",
+                self.pip_index_options, requirements_txt))
+        InstalledPackageIndex.default().invalidate()
+
+        installed_packages = get_installed_pypackages()
+        installed = []
+        for requirement in requirements:
+            version = installed_packages.get(requirement.key)
+            if version is None:
+                warning("{} was not installed".format(requirement.package))
+                continue
+            requirement.version = "=={}".format(version)
+            installed.append(requirement)
+            success("installed {}".format(str(requirement)))
+        if cmd.status_code != 0:
+            fatal(cmd.std_err)
+
+        for requirement in installed:
+            if save:
+                self.requirements["all"].add(requirement, replace=True)
+            if save_dev:
+                self.requirements["dev"].add(requirement, replace=True)
+        if save or save_dev:
+            self.requirements.save()
+        return installed
+
+    def install_groups(self, groups, lock=None):
+        """Install requirement groups, overlapping pip and bower work.
+
+        pip groups are installed one after another, since concurrent pip
+        runs would race on the same environment, and so are bower groups;
+        but the two run side by side, so bower downloads are not held up
+        by pip installs (and vice versa). A summary of the wall time of
+        each group is printed at the end.
+
+        :param lock: the contents of the lockfile. If given, groups are
+            installed from it instead of the requirements file.
+        :param return: a list of tuples of group names and the seconds they
+            took.
+        """
+        frozen = lock is not None
+
+        def install_group(group):
+            start = time.time()
+            with span("install group", group=group):
+                if group.startswith("bower"):
+                    if frozen:
+                        self.install_locked_bower(
+                            lock.get("bower", {}).get(group, []))
+                    else:
+                        self.install_bower_batch(self.requirements[group])
+                elif frozen:
+                    self.install_locked_pip(
+                        lock.get("pip", {}).get(group, []))
+                else:
+                    self.install_pip_batch(self.requirements[group])
+            return group, time.time() - start
+
+        if not frozen:
+            for group in groups:
+                if group not in self.requirements:
+                    warning("{} not in requirements".format(group))
+            groups = [group for group in groups if group in self.requirements
+                      and self.requirements[group]]
+        lanes = [[group for group in groups if not group.startswith("bower")],
+                 [group for group in groups if group.startswith("bower")]]
+        start = time.time()
+        timings = map_concurrently(
+            lambda lane: [install_group(group) for group in lane],
+            [lane for lane in lanes if lane], workers=2)
+        timings = [timing for lane in timings for timing in lane]
+        for group, elapsed in timings:
+            echo("{:<16} {:>8.2f}s".format(group, elapsed))
+        echo("{:<16} {:>8.2f}s".format("total", time.time() - start))
+        return timings
+
+    @property
+    def lockfile(self):
+        """The path of the lockfile, next to the requirements file."""
+        return Path(str(self.requirements.filename)).parent / lockfile_name
+
+    def load_lockfile(self):
+        """Return the contents of the lockfile.
+
+        :raises IOError: if there is no lockfile.
+        """
+        with self.lockfile.open() as f:
+            return load_yaml(f.read()) or {}
+
+    def save_lockfile(self, lock):
+        atomic_write(self.lockfile, dump_yaml(lock).encode("utf-8"))
+
+    def lock(self, groups=None):
+        """Resolve requirement groups to exact versions and archive hashes.
+
+        Groups which are not given keep their entries from the existing
+        lockfile, if any.
+
+        :param groups: names of the groups to lock. Defaults to all groups.
+        :param return: the lockfile contents, a mapping of ``pip`` and
+            ``bower`` to mappings of group names to lists of locked packages.
+        """
+        try:
+            lock = self.load_lockfile()
+        except (IOError, OSError):
+            lock = {}
+        lock.setdefault("pip", {})
+        lock.setdefault("bower", {})
+        for group in groups or list(self.requirements.keys()):
+            if group.startswith("bower"):
+                lock["bower"][group] = self.lock_bower_requirements(
+                    self.requirements[group])
+            else:
+                lock["pip"][group] = self.lock_pip_requirements(
+                    self.requirements[group])
+        return lock
+
+    def lock_pip_requirements(self, requirements):
+        """Resolve pip requirements and their dependencies to exact versions
+        and archive hashes.
+
+        The versions are those pip's resolver picks for a fresh install,
+        asked for with ``pip install --dry-run --ignore-installed --report``
+        (which needs pip 22.2 or later), so every one of them satisfies the
+        requirements. The hashes of every file of each release are taken
+        from PyPI, or failing that from the archive pip would install.
+
+        :param return: a list of locked packages, sorted by name. Packages
+            only locked as dependencies have ``requested`` set to `False`.
+        """
+        requirements = [Requirement.coerce(str(requirement))
+                        for requirement in requirements]
+        if not requirements:
+            return []
+        work_dir = tempfile.mkdtemp(dir=self.temp_dir)
+        try:
+            requirements_txt = os.path.join(work_dir, "requirements.txt")
+            report_json = os.path.join(work_dir, "report.json")
+            with open(requirements_txt, "w") as f:
+                f.write("\n".join(str(requirement)
+                                  for requirement in requirements) + "\n")
+            with span("pip resolve", packages=len(requirements)):
+                cmd = envoy.run(
+                    'pip install --dry-run --ignore-installed --quiet {}'
+                    '--report "{}" -r "{}"'.format(
+                        self.pip_index_options, report_json,
+                        requirements_txt))
+            if cmd.status_code != 0:
+                fatal(cmd.std_err)
+            with open(report_json, "rb") as f:
+                report = json.loads(f.read().decode("utf-8"))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        resolved = {normalize_name(item["metadata"]["name"]): item
+                    for item in report.get("install", [])}
+        for requirement in requirements:
+            item = resolved.get(requirement.key)
+            version = item and item["metadata"]["version"]
+            if not (version and self._satisfies_pip(version,
+                                                    requirement.version)):
+                fatal("{} resolved to {}".format(requirement,
+                                                 version or "nothing"))
+        requested = set(requirement.key for requirement in requirements)
+
+        def lock_release(item):
+            name = item["metadata"]["name"]
+            version = item["metadata"]["version"]
+            try:
+                release = get_json("{}/{}/{}/json".format(pypi_uri, name,
+                                                          version))
+                hashes = ["sha256:" + dist["digests"]["sha256"]
+                          for dist in release.get("urls", [])
+                          if "sha256" in dist.get("digests", {})]
+            except PackageNotFoundError:
+                archive = item.get("download_info", {}).get(
+                    "archive_info", {})
+                hashes = ["sha256:" + archive["hashes"]["sha256"]] \
+                    if "sha256" in archive.get("hashes", {}) else []
+            if not hashes:
+                warning("{} is not on PyPI, hashes will not be "
+                        "checked".format(name))
+            return {
+                "name": name,
+                "version": version,
+                "hashes": sorted(hashes),
+                "requested": normalize_name(name) in requested,
+            }
+
+        return map_concurrently(lock_release, [resolved[key] for key
+                                               in sorted(resolved)],
+                                self.workers)
+
+    def lock_bower_requirements(self, requirements):
+        """Resolve bower requirements and their dependencies to zipballs.
+
+        :param return: a list of locked packages, each dependency listed
+            once and before its dependents.
+        """
+        resolver = BowerResolver(self, self.assets_dir)
+        for requirement in requirements:
+            resolver.add(requirement.package, requirement.version)
+        return [{
+            "name": package["name"],
+            "version": package["version"],
+            "url": package["url"],
+            "sha256": package["sha256"],
+        } for package in resolver.resolve()]
+
+    @staticmethod
+    def pip_lock_is_complete(entries):
+        """Tell whether locked pip packages include all their dependencies,
+        which lockfiles written before dependencies were locked do not.
+        """
+        return all("requested" in entry for entry in entries)
+
+    def install_locked_pip(self, entries):
+        """Install pip packages from lockfile entries in one batch.
+
+        Dependencies are locked too, so pip is told not to look for any,
+        unless the lockfile predates that; then they are installed (and
+        hashes are not checked) as pip sees fit.
+        """
+        complete = self.pip_lock_is_complete(entries)
+        if not complete:
+            warning("the lockfile does not include pip dependencies, run "
+                    "'hydrogen lock' again")
+        hashes = {entry["name"]: entry["hashes"] for entry in entries}
+        if (not complete or not all(hashes.values())
+                or self.wheelhouse is not None):
+            # pip requires a hash for every requirement once any is given;
+            # and wheels built from sdists never match PyPI's hashes, so
+            # wheelhouses are checked when they are built instead
+            hashes = None
+        return self.install_pip_batch(
+            ["{name}=={version}".format(**entry) for entry in entries],
+            hashes=hashes, no_deps=complete)
+
+    def build_wheelhouse(self, groups, dest, lock=None):
+        """Build wheels for pip requirement groups into *dest*.
+
+        Each requirement is built by its own ``pip wheel`` process, several
+        at once, into a private directory, and its wheels then moved into
+        *dest*, so that concurrent builds never write the same file. Wheels
+        already in *dest* are reused by later builds rather than rebuilt.
+
+        :param groups: names of the requirement groups to build. bower
+            groups are ignored.
+        :param lock: the contents of the lockfile. If given, exactly the
+            locked versions are built, without their dependencies (which
+            are locked too, unless the lockfile predates that), and
+            downloads are checked against the locked hashes.
+        :param return: a list of the file names of the wheels in *dest*
+            afterwards.
+        """
+        groups = [group for group in groups if not group.startswith("bower")]
+        lines = OrderedDict()
+        if lock is not None:
+            entries = [entry for group in groups
+                       for entry in lock.get("pip", {}).get(group, [])]
+            complete = self.pip_lock_is_complete(entries)
+            check_hashes = complete and all(entry["hashes"]
+                                            for entry in entries)
+            for entry in entries:
+                line = "{name}=={version}".format(**entry)
+                if check_hashes:
+                    line += "".join(" --hash={}".format(digest)
+                                    for digest in entry["hashes"])
+                lines[normalize_name(entry["name"])] = line
+        else:
+            for group in groups:
+                for requirement in self.requirements.get(group, []):
+                    lines.setdefault(requirement.key, str(requirement))
+        dest = Path(str(dest))
+        makedirs(dest)
+
+        def build(line):
+            wheel_dir = tempfile.mkdtemp(dir=self.temp_dir)
+            requirements_txt = os.path.join(wheel_dir, "requirements.txt")
+            with open(requirements_txt, "w") as f:
+                f.write(line + "\n")
+            echo("pip wheel " + line.split(" ", 1)[0])
+            with span("pip wheel", requirement=line):
+                # locally built wheels never match locked hashes, so only
+                # unlocked builds may pick them up
+                cmd = envoy.run('pip wheel {}--wheel-dir "{}" -r "{}"'.format(
+                    "--no-deps " if lock is not None and complete else
+                    '--find-links "{}" '.format(dest),
+                    os.path.join(wheel_dir, "wheels"), requirements_txt))
+            if cmd.status_code != 0:
+                shutil.rmtree(wheel_dir, ignore_errors=True)
+                return line, cmd.std_err
+            built = os.path.join(wheel_dir, "wheels")
+            for name in os.listdir(built):
+                target = dest / name
+                if not target.exists():
+                    shutil.move(os.path.join(built, name), str(target))
+            shutil.rmtree(wheel_dir, ignore_errors=True)
+            return line, None
+
+        failed = []
+        for line, std_err in map_concurrently(build, lines.values(),
+                                              self.workers):
+            name = line.split(" ", 1)[0]
+            if std_err is None:
+                success("built " + name)
+            else:
+                failed.append(name)
+                warning("could not build {}:\n{}".format(name, std_err))
+        if failed:
+            fatal("failed to build " + ", ".join(failed))
+        return sorted(name for name in os.listdir(str(dest))
+                      if name.endswith(".whl"))
+
+    def install_locked_bower(self, entries, dest=None):
+        """Install bower packages from lockfile entries.
+
+        No registry or GitHub requests are made; zipballs are fetched from
+        their locked URLs (or the download cache) and checked against their
+        locked hashes.
+        """
+        dest = dest or self.assets_dir
+        manifests = load_manifests(dest)
+
+        def install(entry):
+            manifest = manifests.get(entry["url"])
+            if (manifest is not None
+                    and manifest["sha256"] == entry["sha256"]
+                    and manifest_is_intact(dest, manifest)):
+                return [(manifest["name"], manifest["version"])]
+            zip_dest, sha256 = self.fetch_zipball(entry["url"],
+                                                  sha256=entry["sha256"])
+            if sha256 != entry["sha256"]:
+                echo("fatal: hash mismatch for {}".format(
+                    entry["url"]), fg="red")
+                raise InvalidPackageError
+            with zipfile.ZipFile(zip_dest, "r") as pkg:
+                installed = self.extract_bower_zipfile(
+                    pkg, dest, process_deps=False,
+                    source={"url": entry["url"], "sha256": sha256})
+            success("installed {name}=={version}".format(**entry))
+            return installed
+
+        installed = []
+        for result in map_concurrently(install, entries, self.workers):
+            installed.extend(result)
+        return installed
+
+    def state_fingerprint(self, groups=None, frozen=False):
+        """Return a fingerprint of everything :meth:`check` looks at: the
+        requirements file (or lockfile), the directories on `sys.path` (see
+        :class:`InstalledPackageIndex`), the bower manifests and the assets
+        directory.
+
+        Only files are stat'ed, so computing it takes well under a
+        millisecond.
+        """
+        def stat_key(path):
+            try:
+                stat = os.stat(str(path))
+            except OSError:
+                return None
+            return [getattr(stat, "st_mtime_ns", stat.st_mtime), stat.st_size]
+
+        requirements_file = Path(str(self.requirements_file))
+        manifests = Path(str(self.assets_dir)) / manifest_dir
+        try:
+            names = sorted(os.listdir(str(manifests)))
+        except OSError:
+            names = []
+        return {
+            "groups": sorted(groups) if groups else None,
+            "requirements": stat_key(requirements_file),
+            "lockfile": stat_key(requirements_file.parent / lockfile_name)
+            if frozen else None,
+            "python": InstalledPackageIndex.fingerprint(),
+            "assets": [[name, stat_key(manifests / name)] for name in names],
+            # changes when a package directory is added or removed
+            "assets_dir": stat_key(self.assets_dir),
+        }
+
+    def check(self, groups=None, frozen=False):
+        """Compare requirement groups with the installed pip packages and
+        bower manifests, without accessing the network.
+
+        The result is kept in the application directory along with a
+        :meth:`state_fingerprint`, and reused for as long as the fingerprint
+        matches, so checking an unchanged environment only stats a few
+        files.
+
+        Bower packages are checked along with the dependencies recorded in
+        their manifests, recursively.
+
+        :param groups: names of the groups to check. Defaults to all groups.
+        :param frozen: if `True`, compare with the exact versions (and, for
+            bower packages, zipballs) in the lockfile instead.
+        :raises IOError: if the requirements file or lockfile does not
+            exist.
+        :raises GroupNotFoundError: if any of *groups* is not in the
+            requirements file (or the lockfile).
+        :param return: a list of ``(group, wanted, installed)`` tuples, one
+            for every requirement which is not satisfied. *installed* is
+            `None` if the package is not installed at all.
+        """
+        if groups:
+            known = self._group_names(frozen)
+            unknown = [group for group in groups if group not in known]
+            if unknown:
+                raise GroupNotFoundError(", ".join(unknown))
+        fingerprint = self.state_fingerprint(groups, frozen)
+        key = hashlib.sha1(json.dumps([
+            os.path.abspath(str(self.requirements_file)),
+            os.path.abspath(str(self.assets_dir)), sys.executable, frozen,
+        ]).encode("utf-8")).hexdigest()
+        cache_path = os.path.join(app_dir, "cache", "check", key + ".json")
+        if self.cache is not None:
+            try:
+                with open(cache_path, "rb") as f:
+                    cached = json.loads(f.read().decode("utf-8"))
+                if cached["fingerprint"] == fingerprint:
+                    count("check cache hits")
+                    return [tuple(entry) for entry in cached["drift"]]
+            except (IOError, OSError, ValueError, KeyError):
+                pass
+        with span("check"):
+            drift = self._find_drift(groups, frozen)
+        if self.cache is not None:
+            try:
+                makedirs(os.path.dirname(cache_path))
+                atomic_write(cache_path, json.dumps({
+                    "fingerprint": fingerprint,
+                    "drift": drift,
+                }).encode("utf-8"))
+            except (IOError, OSError):
+                pass
+        return drift
+
+    def _load_check_requirements(self, frozen):
+        requirements_file = Path(str(self.requirements_file))
+        if frozen:
+            with (requirements_file.parent / lockfile_name).open() as f:
+                return load_yaml(f.read()) or {}
+        requirements = GroupedRequirements(cache=self.cache is not None)
+        requirements.load(str(requirements_file), create_if_missing=False)
+        return requirements
+
+    def _group_names(self, frozen):
+        requirements = self._load_check_requirements(frozen)
+        if frozen:
+            return (set(requirements.get("pip", {})) |
+                    set(requirements.get("bower", {})))
+        return set(requirements.keys())
+
+    def _find_drift(self, groups, frozen):
+        pip_packages = InstalledPackageIndex.default().packages()
+        manifests = dict((manifest["name"], manifest) for manifest
+                         in load_manifests(self.assets_dir).values())
+
+        def installed_pip(name):
+            name, version = pip_packages.get(normalize_name(name),
+                                             (None, None))
+            return version, version and "{}=={}".format(name, version)
+
+        def installed_bower(name):
+            """Return the manifest of an intact installed package, and a
+            description of what is installed.
+            """
+            manifest = manifests.get(name)
+            if manifest is None:
+                return None, None
+            installed = "{name}=={version}".format(**manifest)
+            if not manifest_is_intact(self.assets_dir, manifest):
+                return None, installed + " (modified)"
+            return manifest, installed
+
+        drift = []
+        if frozen:
+            lock = self._load_check_requirements(frozen)
+            for kind in ("pip", "bower"):
+                for group, entries in lock.get(kind, {}).items():
+                    if groups and group not in groups:
+                        continue
+                    for entry in entries:
+                        wanted = "{name}=={version}".format(**entry)
+                        if kind == "pip":
+                            version, installed = installed_pip(entry["name"])
+                            ok = version == entry["version"]
+                        else:
+                            manifest, installed = installed_bower(
+                                entry["name"])
+                            ok = manifest is not None
+                            if ok and manifest.get("sha256") != \
+                                    entry["sha256"]:
+                                ok = False
+                                installed += " (different zipball)"
+                        if not ok:
+                            drift.append((group, wanted, installed))
+            return drift
+
+        def check_bower(group, requirement, seen, dependent=None):
+            manifest, installed = installed_bower(requirement.package)
+            if (manifest is None or not self._satisfies_bower(
+                    manifest["version"], requirement.version)):
+                wanted = str(requirement)
+                if dependent is not None:
+                    wanted += " (required by {})".format(dependent)
+                drift.append((group, wanted, installed))
+                return
+            for name, version in sorted(
+                    manifest.get("dependencies", {}).items()):
+                if name in seen:
+                    continue
+                seen.add(name)
+                try:
+                    dependency = Requirement(name, version)
+                except InvalidRequirementSpecError:
+                    dependency = Requirement(name)
+                check_bower(group, dependency, seen, manifest["name"])
+
+        requirements = self._load_check_requirements(frozen)
+        for group in groups or list(requirements.keys()):
+            if group.startswith("bower"):
+                seen = set(requirement.package
+                           for requirement in requirements.get(group, []))
+                for requirement in requirements.get(group, []):
+                    check_bower(group, requirement, seen)
+                continue
+            for requirement in requirements.get(group, []):
+                version, installed = installed_pip(requirement.package)
+                if not (version is not None and
+                        self._satisfies_pip(version, requirement.version)):
+                    drift.append((group, str(requirement), installed))
+        return drift
+
+    @staticmethod
+    def _satisfies_pip(version, spec):
+        if not spec:
+            return True
+        try:
+            return specifiers.SpecifierSet(spec).contains(
+                version, prereleases=True)
+        except specifiers.InvalidSpecifier:
+            return True
+
+    @staticmethod
+    def _satisfies_bower(version, spec):
+        if not spec:
+            return True
+        try:
+            return Bower.match_version(version, spec)
+        except (InvalidRequirementSpecError, ValueError):
+            return True
+
+
+def daemon_socket_path():
+    """Return the path of the socket the :class:`Daemon` listens on."""
+    return os.path.join(app_dir, "daemon.sock")
+
+
+class _ClientStream(io.RawIOBase):
+    """A stream which forwards everything written to it to a daemon client,
+    as JSON messages of the form ``{"stream": name, "data": text}``.
+    """
+
+    def __init__(self, send, name, tty=False):
+        super(_ClientStream, self).__init__()
+        self.send = send
+        self.name = name
+        self.tty = tty
+
+    def writable(self):
+        return True
+
+    def isatty(self):
+        return self.tty
+
+    def write(self, data):
+        self.send({"stream": self.name,
+                   "data": bytes(data).decode("utf-8", "replace")})
+        return len(data)
+
+
+class Daemon(object):
+    """Runs hydrogen commands sent over a Unix socket, so that repeated
+    invocations skip interpreter startup and imports, and share warm state:
+    HTTP connections (see :func:`get_session`), the
+    :class:`InstalledPackageIndex`, :class:`MetadataCache` and
+    :class:`RegistryMirror`.
+
+    Each connection sends one JSON request line. ``{"action": "run"}``
+    requests carry the arguments, working directory and environment of the
+    client, and are answered with the command's output as it is written
+    (see :class:`_ClientStream`) and finally ``{"exit": status}``. Commands
+    run one at a time, since they change the working directory and the
+    environment of the whole process; ``status`` and ``stop`` requests are
+    answered right away.
+    """
+
+    def __init__(self, path=None, idle_timeout=None):
+        """Construct a new daemon.
+
+        :param path: the socket path. Defaults to
+            :func:`daemon_socket_path`.
+        :param idle_timeout: seconds without a command after which the
+            daemon exits. Defaults to `daemon_idle_timeout`.
+        """
+        self.path = path or daemon_socket_path()
+        self.idle_timeout = idle_timeout or daemon_idle_timeout
+        self.started = self.last_active = time.time()
+        self.commands = 0
+        self.running = False
+        self._command_lock = threading.Lock()
+
+    def serve(self):
+        """Accept connections until stopped, or idle for too long."""
+        if is_daemon_running(self.path):
+            raise RuntimeError("a daemon is already listening on " +
+                               self.path)
+        makedirs(os.path.dirname(self.path))
+        remove_file(self.path)  # left over by a daemon which was killed
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        os.chmod(self.path, 0o600)
+        server.listen(16)
+        server.settimeout(1)
+        self.running = True
+        try:
+            while self.running:
+                try:
+                    connection, _ = server.accept()
+                except socket.timeout:
+                    if (not self._command_lock.locked() and time.time() -
+                            self.last_active > self.idle_timeout):
+                        break
+                    continue
+                thread = threading.Thread(target=self.handle,
+                                          args=(connection,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            server.close()
+            remove_file(self.path)
+            # let a command in progress finish
+            with self._command_lock:
+                pass
+
+    def handle(self, connection):
+        connection.settimeout(None)
+        f = connection.makefile("rwb")
+        send_lock = threading.Lock()
+
+        def send(message):
+            with send_lock:
+                f.write(json.dumps(message).encode("utf-8") + b"\n")
+                f.flush()
+
+        try:
+            request = json.loads(f.readline().decode("utf-8"))
+            action = request.get("action")
+            if action == "status":
+                send({"pid": os.getpid(), "started": self.started,
+                      "commands": self.commands,
+                      "executable": sys.executable})
+            elif action == "stop":
+                self.running = False
+                send({"stopping": True})
+            elif action == "run":
+                self.run(request, send)
+            else:
+                send({"error": "unknown action: {}".format(action)})
+        except (IOError, OSError, ValueError):
+            pass  # the client went away
+        finally:
+            try:
+                f.close()
+                connection.close()
+            except (IOError, OSError):
+                pass
+
+    def run(self, request, send):
+        if request.get("executable") != sys.executable:
+            # pip would install into the wrong environment
+            send({"rejected": "the daemon runs {}".format(sys.executable)})
+            return
+        if not os.path.isdir(request.get("cwd", "")):
+            send({"rejected": "no such directory"})
+            return
+        with self._command_lock:
+            send({"accepted": True})
+            cwd = os.getcwd()
+            environ = dict(os.environ)
+            streams = sys.stdin, sys.stdout, sys.stderr
+            tty = request.get("tty", {})
+            try:
+                os.chdir(request["cwd"])
+                os.environ.clear()
+                os.environ.update(request.get("env", {}))
+                sys.stdin = io.StringIO()
+                sys.stdout, sys.stderr = [io.TextIOWrapper(
+                    io.BufferedWriter(_ClientStream(send, name,
+                                                    tty.get(name))),
+                    encoding="utf-8", line_buffering=True)
+                    for name in ("stdout", "stderr")]
+                status = self.invoke(request["args"])
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                sys.stdin, sys.stdout, sys.stderr = streams
+                os.environ.clear()
+                os.environ.update(environ)
+                os.chdir(cwd)
+                self.commands += 1
+                self.last_active = time.time()
+            send({"exit": status})
+
+    def invoke(self, args):
+        """Run a command as :func:`main` would, and return its exit status.
+        """
+        # per-command state; everything else is kept warm
+        ProgressReporter.reset_default()
+        Tracer.reset_default()
+        TagIndex.forget()
+        try:
+            with main.make_context(prog_name, list(args)) as ctx:
+                try:
+                    main.invoke(ctx)
+                finally:
+                    if isinstance(ctx.obj, Hydrogen):
+                        ctx.obj.close()
+            return 0
+        except click.exceptions.Exit as e:
+            return e.exit_code
+        except click.ClickException as e:
+            e.show()
+            return e.exit_code
+        except click.Abort:
+            click.echo("Aborted!", err=True)
+            return 1
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            click.echo(e.code, err=True)
+            return 1
+        except Exception:
+            traceback.print_exc()
+            return 1
+
+
+def connect_to_daemon(request, path=None, timeout=None):
+    """Send a request to the :class:`Daemon`.
+
+    :param return: a file to read the JSON reply lines from, or `None` if no
+        daemon is listening.
+    """
+    path = path or daemon_socket_path()
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(path):
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(timeout)
+    try:
+        connection.connect(path)
+        f = connection.makefile("rwb")
+        connection.close()  # the file keeps the socket open
+        f.write(json.dumps(request).encode("utf-8") + b"\n")
+        f.flush()
+        return f
+    except (IOError, OSError):
+        connection.close()
+        return None
+
+
+def is_daemon_running(path=None):
+    return daemon_status(path) is not None
+
+
+def daemon_status(path=None):
+    """Return the status reported by the daemon, or `None`."""
+    f = connect_to_daemon({"action": "status"}, path, timeout=5)
+    if f is None:
+        return None
+    with f:
+        try:
+            return json.loads(f.readline().decode("utf-8"))
+        except (IOError, OSError, ValueError):
+            return None
+
+
+def forward_to_daemon(args):
+    """Run a command in the daemon, if one is running and accepts it,
+    copying its output to this process's.
+
+    :param return: the exit status of the command, or `None` if it was not
+        run.
+    """
+    tty = {}
+    for name in ("stdout", "stderr"):
+        stream = getattr(sys, name)
+        tty[name] = bool(getattr(stream, "isatty", None) and stream.isatty())
+    env = dict(os.environ)
+    # the daemon has no terminal to measure the progress display against
+    env.setdefault("COLUMNS", str(terminal_width()))
+    f = connect_to_daemon({
+        "action": "run",
+        "args": list(args),
+        "cwd": os.getcwd(),
+        "env": env,
+        "executable": sys.executable,
+        "tty": tty,
+    })
+    if f is None:
+        return None
+    with f:
+        try:
+            reply = json.loads(f.readline().decode("utf-8"))
+        except (IOError, OSError, ValueError):
+            return None
+        if not reply.get("accepted"):
+            return None
+        for line in f:
+            message = json.loads(line.decode("utf-8"))
+            if "exit" in message:
+                return message["exit"]
+            stream = getattr(sys, message["stream"])
+            stream.write(message["data"])
+            stream.flush()
+    click.secho("error: the daemon exited while running the command",
+                fg="red", err=True)
+    return 1
+
+
+class HydrogenGroup(click.Group):
+    """The command group of :func:`main`, which reports errors any command
+    may run into without a traceback.
+    """
+    def invoke(self, ctx):
+        try:
+            return super(HydrogenGroup, self).invoke(ctx)
+        except OfflineError as e:
+            fatal(text_type(e))
+
+
+def groups_option(f):
+    new_func = click.option("-g", "--groups",
+                            help="Comma-separated list of requirement groups "
+                            "to include.")(f)
+    return update_wrapper(new_func, f)
+
+
+@click.group(cls=HydrogenGroup)
+@click.version_option(prog_name=prog_name)
+@click.option("-j", "--jobs", type=int, default=default_workers,
+              help="Number of bower packages to fetch concurrently.")
+@click.option("--no-cache", is_flag=True,
+              help="Do not read or write the download cache.")
+@click.option("work_offline", "--offline", is_flag=True,
+              help="Never access the network; use cached metadata and "
+              "downloads only.")
+@click.option("--cache-ttl", type=int, default=metadata_ttl,
+              help="Seconds cached registry and GitHub metadata is used "
+              "before it is revalidated.")
+@click.option("--segments", type=int, default=download_segments,
+              help="Number of parallel byte ranges large downloads are "
+              "split into, if the server supports it.")
+@click.option("--no-store", is_flag=True,
+              help="Extract packages into each project instead of linking "
+              "them from the global package store.")
+@click.option("--profile", is_flag=True,
+              help="Print the time spent in each phase when done.")
+@click.option("--trace", type=click.Path(dir_okay=False, writable=True),
+              help="Write a Chrome trace of the command to this file.")
+@click.pass_context
+def main(ctx, jobs, no_cache, work_offline, cache_ttl, segments, no_store,
+         profile, trace):
+    global offline, metadata_ttl, download_segments
+    offline = work_offline
+    metadata_ttl = cache_ttl
+    download_segments = max(segments, 1)
+    if profile or trace:
+        tracer = Tracer.default()
+        tracer.enabled = True
+        tracer.started = time.time()
+
+        @ctx.call_on_close
+        def report():
+            if profile:
+                click.echo(tracer.format_summary(), err=True)
+            if trace:
+                tracer.save_chrome_trace(trace)
+    ctx.obj = Hydrogen(workers=max(jobs, 1), cache=not no_cache,
+                       store=not no_store)
+
+
+@main.command()
+@click.pass_obj
+@click.option("output_yaml", "--yaml", "-y", is_flag=True,
+              help="Show requirements in YAML format.")
+@click.option("--resolve", "-r", is_flag=True,
+              help="Resolve version numbers for ambiguous packages.")
+@groups_option
+def freeze(h, output_yaml, resolve, groups):
+    """Output installed packages."""
+    if not groups:
+        groups = filter(lambda group: not group.lower().startswith("bower"),
+                        h.requirements.keys())
+    else:
+        groups = [text_type.strip(group) for group in groups.split(",")]
+
+    if output_yaml:
+        for requirements in h.requirements.values():
+            for requirement in requirements:
+                if resolve and not requirement.version:
+                    requirement.load_installed_version()
+        click.echo(h.requirements.yaml)
+    else:
+        for group in groups:
+            if not h.requirements[group]:
+                continue
+            click.echo("# {}".format(group))
+            for requirement in h.requirements[group]:
+                if resolve and not requirement.version:
+                    requirement.load_installed_version()
+                click.echo(str(requirement))
+
+
+@main.command()
+@click.pass_obj
+@click.option("--pip/--bower", default=True)
+@groups_option
+@click.option("--save", is_flag=True)
+@click.option("--save-dev", is_flag=True)
+@click.option("--frozen", is_flag=True,
+              help="Install exactly what is recorded in {}.".format(
+                  lockfile_name))
+@click.option("--wheelhouse", "wheelhouse_dir",
+              type=click.Path(exists=True, file_okay=False),
+              help="Install pip packages only from this directory of wheels, "
+              "as built by 'hydrogen wheelhouse build'.")
+@click.argument("packages", nargs=-1)
+def install(h, pip, groups, save, save_dev, frozen, wheelhouse_dir,
+            packages):
+    """Install a pip or bower package."""
+    h.wheelhouse = wheelhouse_dir
+    if groups:
+        groups = [text_type.strip(group) for group in groups.split(",")]
+    else:
+        groups = h.requirements.keys()
+
+    if frozen:
+        if packages:
+            fatal("--frozen installs cannot be given packages")
+        try:
+            lock = h.load_lockfile()
+        except (IOError, OSError):
+            fatal("{} not found, run 'hydrogen lock' first".format(
+                h.lockfile))
+        h.install_groups(groups, lock=lock)
+        return
+
+    if not packages:
+        h.install_groups(groups)
+        return
+    # save the requirements file once, after every package is installed
+    with h.requirements.batch():
+        for package in packages:
+            if pip:
+                h.install_pip(package, save=save, save_dev=save_dev)
+            else:
+                h.install_bower(package, save=save, save_dev=save_dev)
+
+
+@main.command()
+@click.pass_obj
+@groups_option
+@click.option("--frozen", is_flag=True,
+              help="Compare with {} instead of the requirements "
+              "file.".format(lockfile_name))
+def check(h, groups, frozen):
+    """Check that installed packages match the requirements.
+
+    Nothing is installed and the network is never accessed. Exits with
+    status 1, listing what is missing or different, if anything is out of
+    sync.
+
+    The result is reused until the requirements, the Python environment or
+    the bower manifests change; run 'hydrogen --no-cache check' to also
+    look for files changed inside installed bower packages since.
+    """
+    if groups:
+        groups = [text_type.strip(group) for group in groups.split(",")]
+    try:
+        drift = h.check(groups, frozen=frozen)
+    except (IOError, OSError) as e:
+        fatal("{}: {}".format(getattr(e, "filename", None) or "check",
+                              e.strerror or e))
+    except GroupNotFoundError as e:
+        fatal("{} not in {}".format(e, lockfile_name if frozen
+                                    else h.requirements_file))
+    if not drift:
+        success("in sync")
+        return
+    last_group = None
+    for group, wanted, installed in sorted(
+            drift, key=lambda entry: entry[0]):
+        if group != last_group:
+            click.echo("{}:".format(group))
+            last_group = group
+        click.secho("-   {}".format(wanted), fg="red")
+        if installed is not None:
+            click.secho("+   {}".format(installed), fg="green")
+    error("{} requirements out of sync".format(len(drift)))
+
+
+@main.group()
+def wheelhouse():
+    """Build a local directory of wheels to install pip packages from."""
+
+
+@wheelhouse.command("build")
+@click.pass_obj
+@groups_option
+@click.option("--dir", "directory", type=click.Path(file_okay=False),
+              help="Where to put the wheels. Defaults to '{}' next to the "
+              "requirements file.".format(wheelhouse_name))
+@click.option("--frozen", is_flag=True,
+              help="Build exactly what is recorded in {}, checking "
+              "hashes.".format(lockfile_name))
+def wheelhouse_build(h, groups, directory, frozen):
+    """Build wheels for pip requirements, in parallel.
+
+    Install from them with 'hydrogen install --wheelhouse DIR'.
+    """
+    if groups:
+        groups = [text_type.strip(group) for group in groups.split(",")]
+    else:
+        groups = h.requirements.keys()
+    lock = None
+    if frozen:
+        try:
+            lock = h.load_lockfile()
+        except (IOError, OSError):
+            fatal("{} not found, run 'hydrogen lock' first".format(
+                h.lockfile))
+    directory = directory or str(
+        Path(str(h.requirements.filename)).parent / wheelhouse_name)
+    wheels = h.build_wheelhouse(groups, directory, lock=lock)
+    success("{} wheels in {}".format(len(wheels), directory))
+
+
+@main.command()
+@click.pass_obj
+@groups_option
+def lock(h, groups):
+    """Write exact versions and hashes to the lockfile."""
+    if groups:
+        groups = [text_type.strip(group) for group in groups.split(",")]
+    h.save_lockfile(h.lock(groups))
+    success("wrote {}".format(h.lockfile))
+
+
+@main.group()
+def cache():
+    """Inspect or manage the download cache."""
+
+
+@cache.command("stats")
+@click.pass_obj
+def cache_stats(h):
+    """Show download cache usage."""
+    stats = (h.cache or DownloadCache()).stats()
+    click.echo("path: {}".format(stats["path"]))
+    click.echo("files: {} ({} urls)".format(stats["blobs"], stats["urls"]))
+    click.echo("size: {} of {}".format(format_size(stats["size"]),
+                                       format_size(stats["max_size"])))
+
+
+@cache.command("clean")
+@click.pass_obj
+@click.option("--max-size", type=int, default=None,
+              help="Only evict least recently used files until the cache is "
+              "at most this many megabytes.")
+@click.option("--store", is_flag=True,
+              help="Also remove the package store. Installed projects keep "
+              "their files.")
+def cache_clean(h, max_size, store):
+    """Remove cached downloads."""
+    download_cache = h.cache or DownloadCache()
+    if max_size is None:
+        download_cache.clean()
+        success("cache removed")
+    else:
+        removed = download_cache.evict(max_size * 1024 * 1024)
+        success("evicted {} files".format(removed))
+    if store:
+        (h.store or PackageStore()).clean()
+        success("package store removed")
+
+
+@cache.command("verify")
+@click.pass_obj
+def cache_verify(h):
+    """Check cached downloads for corruption."""
+    valid, removed = (h.cache or DownloadCache()).verify()
+    if removed:
+        warning("removed {} corrupt or dangling entries".format(removed))
+    success("{} files ok".format(valid))
+
+
+@main.group()
+def mirror():
+    """Manage the local mirror of the bower registry."""
+
+
+@mirror.command("sync")
+@click.option("source", "--from", type=click.Path(exists=True, dir_okay=False),
+              help="Read the registry from a JSON file instead, in the format "
+              "of the registry's /packages listing.")
+@click.argument("packages", nargs=-1)
+def mirror_sync(source, packages):
+    """Copy the bower registry, or the given packages, into the mirror.
+
+    Syncing the whole registry replaces the mirror, while syncing packages
+    adds to it.
+    """
+    registry_mirror = RegistryMirror.default()
+    if source is not None:
+        with open(source, "rb") as f:
+            listing = RegistryMirror.parse_packages(
+                json.loads(f.read().decode("utf-8")))
+        if packages:
+            wanted = set(packages)
+            listing = [package for package in listing if package[0] in wanted]
+        source = os.path.abspath(source)
+    elif packages:
+        def fetch(name):
+            try:
+                info = get("{}/packages/{}".format(Bower.bower_base_uri,
+                                                   name))
+                if info.status_code == 404:
+                    raise PackageNotFoundError(name)
+            except PackageNotFoundError:
+                warning("{} not found in registry".format(name))
+                return None
+            info.raise_for_status()
+            return name, info.json()["url"]
+
+        listing = [package for package in map_concurrently(fetch, packages)
+                   if package is not None]
+        source = Bower.bower_base_uri
+    else:
+        response = get("{}/packages".format(Bower.bower_base_uri))
+        response.raise_for_status()
+        listing = RegistryMirror.parse_packages(response.json())
+        source = Bower.bower_base_uri
+    synced = registry_mirror.update(listing, source,
+                                    replace=not packages)
+    success("mirrored {} packages".format(synced))
+
+
+@mirror.command("status")
+def mirror_status():
+    """Show what the mirror contains."""
+    status = RegistryMirror.default().status()
+    if status is None:
+        fatal("no mirror, run 'hydrogen mirror sync' first")
+    click.echo("path: {}".format(status["path"]))
+    click.echo("packages: {}".format(status["packages"]))
+    click.echo("source: {}".format(status["source"]))
+    if status["synced"] is not None:
+        click.echo("synced: {}".format(time.strftime(
+            "%Y-%m-%d %H:%M:%S", time.localtime(status["synced"]))))
+
+
+@mirror.command("clean")
+def mirror_clean():
+    """Remove the mirror."""
+    RegistryMirror.default().clean()
+    success("mirror removed")
+
+
+@main.group()
+def daemon():
+    """Manage the background daemon.
+
+    While it is running, hydrogen commands are run by the daemon, which
+    keeps connections, imports and indexes warm between them. Set
+    HYDROGEN_NO_DAEMON=1 to run a command in-process anyway.
+    """
+
+
+@daemon.command("start")
+def daemon_start():
+    """Start the daemon in the background."""
+    if is_daemon_running():
+        warning("the daemon is already running")
+        return
+    if not hasattr(socket, "AF_UNIX"):
+        fatal("the daemon needs Unix sockets, which this platform lacks")
+    makedirs(app_dir)
+    kwargs = ({"preexec_fn": os.setsid} if PY2 else
+              {"start_new_session": True})
+    with open(os.devnull, "rb") as devnull, \
+            open(os.path.join(app_dir, "daemon.log"), "ab") as log:
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "daemon", "run"],
+            stdin=devnull, stdout=log, stderr=log, close_fds=True, cwd="/",
+            **kwargs)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        status = daemon_status()
+        if status is not None:
+            success("daemon started (pid {})".format(status["pid"]))
+            return
+        time.sleep(0.05)
+    fatal("the daemon did not start, see {}".format(
+        os.path.join(app_dir, "daemon.log")))
+
+
+@daemon.command("run")
+@click.option("--idle-timeout", type=int, default=daemon_idle_timeout,
+              help="Exit after this many seconds without a command.")
+def daemon_run(idle_timeout):
+    """Run the daemon in the foreground."""
+    try:
+        Daemon(idle_timeout=idle_timeout).serve()
+    except RuntimeError as e:
+        fatal(text_type(e))
+
+
+@daemon.command("stop")
+def daemon_stop():
+    """Stop the daemon, once any command it is running finishes."""
+    f = connect_to_daemon({"action": "stop"}, timeout=5)
+    if f is None:
+        warning("the daemon is not running")
+        return
+    with f:
+        f.readline()
+    deadline = time.time() + 60
+    while os.path.exists(daemon_socket_path()) and time.time() < deadline:
+        time.sleep(0.05)
+    success("daemon stopped")
+
+
+@daemon.command("status")
+def daemon_status_command():
+    """Show whether the daemon is running. Exits with status 1 if not."""
+    status = daemon_status()
+    if status is None:
+        click.echo("not running")
+        sys.exit(1)
+    click.echo("pid: {}".format(status["pid"]))
+    click.echo("uptime: {:.0f}s".format(time.time() - status["started"]))
+    click.echo("commands: {}".format(status["commands"]))
+    click.echo("python: {}".format(status["executable"]))
+    click.echo("socket: {}".format(daemon_socket_path()))
+
+
+def run():
+    """The entry point of the ``hydrogen`` command.
+
+    Commands are forwarded to the daemon if it is running, and run in this
+    process otherwise.
+    """
+    args = sys.argv[1:]
+    if args[:1] != ["daemon"] and not os.environ.get("HYDROGEN_NO_DAEMON"):
+        status = forward_to_daemon(args)
+        if status is not None:
+            sys.exit(status)
+    main()
+
+
+if __name__ == "__main__":
+    run()
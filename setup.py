@@ -11,6 +11,6 @@ setup(
     version=__import__("hydrogen").__version__,
     long_description=__doc__,
     entry_points={
-        "console_scripts": ["hydrogen=hydrogen:main"],
+        "console_scripts": ["hydrogen=hydrogen:run"],
     },
 )
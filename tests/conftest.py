@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import subprocess
+import sys
+import zipfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hydrogen  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def app_dir(tmp_path, monkeypatch):
+    """Give every test its own application directory, and forget the state
+    shared by the process.
+    """
+    path = tmp_path / "app"
+    monkeypatch.setattr(hydrogen, "app_dir", str(path))
+    monkeypatch.setattr(hydrogen, "offline", False)
+    for cls in hydrogen.Shared.__subclasses__():
+        cls.reset_default()
+    hydrogen.TagIndex.forget()
+    yield path
+    if hydrogen.RegistryMirror.__dict__.get("_default") is not None:
+        hydrogen.RegistryMirror.default().close()
+    for cls in hydrogen.Shared.__subclasses__():
+        cls.reset_default()
+    hydrogen.TagIndex.forget()
+
+
+def make_zip(path, files):
+    """Write a zip file of *files*, a mapping of member names to contents;
+    dicts are written as JSON. Directory entries are only written if listed
+    with a trailing slash.
+    """
+    with zipfile.ZipFile(str(path), "w") as z:
+        for name, content in sorted(files.items()):
+            if isinstance(content, dict):
+                content = json.dumps(content)
+            z.writestr(name, content)
+    return str(path)
+
+
+@pytest.fixture
+def git_repo(tmp_path):
+    """Return a function creating a local git repository with a tag per
+    version, each with a ``bower.json`` of that version.
+    """
+    if shutil.which("git") is None:
+        pytest.skip("git is not installed")
+
+    def create(name, versions, dependencies=None):
+        repo = tmp_path / "repos" / (name + ".git")
+        repo.mkdir(parents=True)
+
+        def git(*args):
+            subprocess.check_call(
+                ["git", "-c", "user.name=test", "-c", "user.email=t@t",
+                 "-c", "init.defaultBranch=main"] + list(args),
+                cwd=str(repo), stdout=subprocess.DEVNULL)
+
+        git("init", "-q")
+        for version in versions:
+            (repo / "bower.json").write_text(json.dumps({
+                "name": name,
+                "version": version,
+                "dependencies": (dependencies or {}).get(version, {}),
+                "ignore": ["test"],
+            }))
+            (repo / "test").mkdir(exist_ok=True)
+            (repo / "test" / "spec.js").write_text(version)
+            (repo / (name + ".js")).write_text("// " + version)
+            git("add", "-A")
+            git("commit", "-q", "-m", version)
+            git("tag", "v" + version)
+        return "file://" + str(repo)
+
+    return create
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import shutil
+
+import pytest
+from click.testing import CliRunner
+
+import hydrogen
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    path = tmp_path / "project"
+    path.mkdir()
+    monkeypatch.chdir(path)
+    return path
+
+
+@pytest.fixture
+def installed(project, git_repo):
+    """Install ``foo``, which depends on ``bar``, into the project."""
+    foo = git_repo("foo", ["1.0.0", "1.1.0"],
+                   dependencies={"1.1.0": {"bar": "^1.0"}})
+    bar = git_repo("bar", ["1.0.0"])
+    hydrogen.RegistryMirror.default().update(
+        [("foo", foo), ("bar", bar)], source="test")
+    (project / "requirements.yml").write_text("bower:\n- foo ^1.0\n")
+    result = CliRunner().invoke(hydrogen.main, ["install"])
+    assert result.exit_code == 0, result.output
+    return project
+
+
+def check(*args):
+    return CliRunner().invoke(hydrogen.main, list(args) + ["check"])
+
+
+def test_in_sync(installed):
+    result = check()
+    assert result.exit_code == 0, result.output
+    assert "in sync" in result.output
+
+
+@pytest.mark.parametrize("options", [[], ["--no-cache"]])
+def test_missing_dependency(installed, options):
+    assert check(*options).exit_code == 0
+    shutil.rmtree(str(installed / "assets" / "bar"))
+    result = check(*options)
+    assert result.exit_code == 1
+    assert "bar^1.0 (required by foo)" in result.output
+    assert "bar==1.0.0 (modified)" in result.output
+
+
+def test_pip_drift(project):
+    (project / "requirements.yml").write_text(
+        "all:\n- pytest\n- no-such-package-here\n")
+    h = hydrogen.Hydrogen(cache=False)
+    assert h.check() == [("all", "no-such-package-here", None)]
+
+
+def test_unknown_group(project):
+    (project / "requirements.yml").write_text("all:\n- pytest\n")
+    result = CliRunner().invoke(hydrogen.main, ["check", "-g", "al"])
+    assert result.exit_code == 1
+    assert "al not in requirements.yml" in result.output
+    with pytest.raises(hydrogen.GroupNotFoundError):
+        hydrogen.Hydrogen().check(["all", "al"])
+
+
+def test_reuses_the_cached_result(project, monkeypatch):
+    requirements = project / "requirements.yml"
+    requirements.write_text("all:\n- pytest\n")
+    h = hydrogen.Hydrogen()
+    assert h.check() == []
+    calls = []
+    monkeypatch.setattr(h, "_find_drift",
+                        lambda *args: calls.append(args) or [])
+    assert h.check() == []
+    assert calls == []
+    requirements.write_text("all:\n- pytest\n- no-such-package-here\n")
+    assert h.check() == []
+    assert calls == [(None, False)]
+
+
+def test_frozen(installed):
+    version = hydrogen.get_installed_pypackages()["pytest"]
+    lock = {
+        "pip": {"all": [
+            {"name": "pytest", "version": version, "hashes": [],
+             "requested": True},
+            {"name": "pluggy", "version": "0.0.1", "hashes": [],
+             "requested": False},
+        ]},
+        "bower": {"bower": [
+            {"name": "foo", "version": "1.1.0", "url": "x",
+             "sha256": "0" * 64},
+        ]},
+    }
+    (installed / hydrogen.lockfile_name).write_text(hydrogen.dump_yaml(lock))
+    result = check("--no-cache")
+    assert result.exit_code == 0, result.output
+    result = CliRunner().invoke(hydrogen.main, ["check", "--frozen"])
+    assert result.exit_code == 1
+    assert "-   pluggy==0.0.1" in result.output
+    assert "-   foo==1.1.0" in result.output
+    assert "+   foo==1.1.0 (different zipball)" in result.output
+    assert "-   pytest" not in result.output
+    result = CliRunner().invoke(hydrogen.main,
+                                ["check", "--frozen", "-g", "all"])
+    assert "foo" not in result.output
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import os
+import socket
+import subprocess
+import sys
+
+import pytest
+
+import hydrogen
+
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "AF_UNIX"),
+                                reason="the daemon needs Unix sockets")
+
+
+@pytest.fixture
+def cli(tmp_path):
+    """Return a function running the ``hydrogen`` command in a project, with
+    an application directory of its own, and stop any daemon it started.
+    """
+    project = tmp_path / "project"
+    project.mkdir()
+    env = dict(os.environ, XDG_CONFIG_HOME=str(tmp_path / "config"))
+    env.pop("HYDROGEN_NO_DAEMON", None)
+
+    def run(*args, **extra_env):
+        process = subprocess.Popen(
+            [sys.executable, hydrogen.__file__] + list(args),
+            cwd=str(project), env=dict(env, **extra_env),
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = process.communicate(timeout=60)[0].decode("utf-8")
+        return process.returncode, output
+
+    run.project = project
+    yield run
+    run("daemon", "stop")
+
+
+def test_round_trip(cli):
+    (cli.project / "requirements.yml").write_text("all:\n- pytest\n")
+    assert cli("daemon", "status") == (1, "not running\n")
+    status, output = cli("daemon", "start")
+    assert status == 0, output
+    assert "daemon started" in output
+
+    # forwarded, with the exit status of the command
+    status, output = cli("check")
+    assert (status, output) == (0, "in sync\n")
+    status, output = cli("check", "-g", "nosuch")
+    assert status == 1
+    assert "nosuch not in requirements.yml" in output
+    # run in this process
+    status, output = cli("check", HYDROGEN_NO_DAEMON="1")
+    assert (status, output) == (0, "in sync\n")
+
+    status, output = cli("daemon", "status")
+    assert status == 0
+    assert "commands: 2\n" in output
+
+    status, output = cli("daemon", "stop")
+    assert status == 0, output
+    assert "daemon stopped" in output
+    assert cli("daemon", "status") == (1, "not running\n")
+    assert cli("check") == (0, "in sync\n")
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import threading
+
+import pytest
+
+import hydrogen
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def server():
+    """Serve ``server.files`` (paths to ``(body, etag)``) over HTTP.
+
+    ``If-None-Match`` is answered with ``304 Not Modified``, and ``Range``
+    requests with ``206 Partial Content`` unless ``If-Range`` names another
+    version. The status of every response is recorded in ``server.log``,
+    and the ``Range`` header of every request in ``server.ranges``.
+    Responses to the ranges in ``server.interrupt`` (`None` for whole
+    files) are cut off halfway, once.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body, etag = httpd.files[self.path]
+            requested = self.headers.get("Range")
+            httpd.ranges.append(requested)
+            if self.headers.get("If-None-Match") == etag:
+                httpd.log.append(304)
+                self.send_response(304)
+                self.end_headers()
+                return
+            status, start, end = 200, 0, len(body) - 1
+            if requested and self.headers.get("If-Range", etag) == etag:
+                first, last = requested[len("bytes="):].split("-")
+                status, start = 206, int(first)
+                end = min(int(last), end) if last else end
+                if start >= len(body):
+                    httpd.log.append(416)
+                    self.send_response(416)
+                    self.send_header("Content-Range",
+                                     "bytes */{}".format(len(body)))
+                    self.end_headers()
+                    return
+            data = body[start:end + 1]
+            httpd.log.append(status)
+            self.send_response(status)
+            self.send_header("ETag", etag)
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(len(data)))
+            if status == 206:
+                self.send_header("Content-Range", "bytes {}-{}/{}".format(
+                    start, end, len(body)))
+            self.end_headers()
+            if requested in httpd.interrupt:
+                httpd.interrupt.remove(requested)
+                data = data[:len(data) // 2]
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.files = {}
+    httpd.log = []
+    httpd.ranges = []
+    httpd.interrupt = set()
+    httpd.url = "http://127.0.0.1:{}".format(httpd.server_address[1])
+    thread = threading.Thread(target=httpd.serve_forever, args=(0.05,))
+    thread.daemon = True
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.mark.parametrize("url, immutable", [
+    ("git+file:///repos/foo.git#v1.0.0", True),
+    ("https://api.github.com/repos/a/b/zipball/v1.0.0", True),
+    ("https://api.github.com/repos/a/b/zipball/refs/tags/latest", True),
+    ("https://api.github.com/repos/a/b/zipball/master", False),
+    ("https://api.github.com/repos/a/b/zipball", False),
+    ("https://codeload.github.com/a/b/zip/refs/tags/v2.1", True),
+    ("https://codeload.github.com/a/b/zip/main", False),
+    ("https://example.com/v1.0.0/foo.zip", False),
+])
+def test_is_immutable(url, immutable):
+    assert hydrogen.DownloadCache.is_immutable(url) is immutable
+
+
+def test_download_revalidates_by_etag(tmp_path, server):
+    server.files["/foo.zip"] = (b"first", '"1"')
+    url = server.url + "/foo.zip"
+    cache = hydrogen.DownloadCache(tmp_path / "downloads")
+    blob, digest = cache.download(url, revalidate=True)
+    assert open(blob, "rb").read() == b"first"
+    assert cache.entry(url)["etag"] == '"1"'
+
+    assert cache.download(url, revalidate=True) == (blob, digest)
+    assert server.log == [200, 304]
+
+    server.files["/foo.zip"] = (b"second", '"2"')
+    blob, digest = cache.download(url, revalidate=True)
+    assert open(blob, "rb").read() == b"second"
+    assert cache.entry(url)["etag"] == '"2"'
+    assert server.log == [200, 304, 200]
+
+    assert cache.download(url) == (blob, digest)
+    assert server.log == [200, 304, 200]
+
+
+def test_fetch_zipball_revalidates_mutable_urls(tmp_path, server):
+    server.files["/foo.zip"] = (b"first", '"1"')
+    url = server.url + "/foo.zip"
+    h = hydrogen.Hydrogen(
+        cache=hydrogen.DownloadCache(tmp_path / "downloads"))
+    first, _ = h.fetch_zipball(url, progress=False)
+    server.files["/foo.zip"] = (b"second", '"2"')
+    second, _ = h.fetch_zipball(url, progress=False)
+    assert open(second, "rb").read() == b"second"
+    assert server.log == [200, 200]
+
+
+def test_session_pool_fits_workers_and_segments(monkeypatch):
+    monkeypatch.setattr(hydrogen, "_session", None)
+    monkeypatch.setattr(hydrogen, "_session_size", 0)
+    monkeypatch.setattr(hydrogen, "_session_workers", 0)
+    monkeypatch.setattr(hydrogen, "download_segments", 4)
+
+    def pool_size(session):
+        adapter = session.get_adapter("https://example.com")
+        return adapter.poolmanager.connection_pool_kw["maxsize"]
+
+    session = hydrogen.get_session()
+    assert pool_size(session) == hydrogen.default_workers * 4
+    hydrogen.Hydrogen(workers=16, cache=False, store=False)
+    assert hydrogen.get_session() is session
+    assert pool_size(session) == 64
+    hydrogen.Hydrogen(workers=2, cache=False, store=False)
+    assert pool_size(hydrogen.get_session()) == 64
+
+
+def body(size):
+    return bytes(bytearray(i * 7 % 251 for i in range(size)))
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_resume_after_an_interruption(tmp_path, server):
+    data = body(64 * 1024)
+    server.files["/foo.zip"] = (data, '"1"')
+    server.interrupt.add(None)
+    url = server.url + "/foo.zip"
+    part = str(tmp_path / "foo.part")
+    with pytest.raises(Exception):
+        hydrogen.fetch_resumable(url, part, segments=1, chunk_size=1024)
+    offset = os.path.getsize(part)
+    assert 0 < offset < len(data)
+    assert hydrogen.fetch_resumable(url, part, sha256=sha256(data),
+                                    segments=1) == (sha256(data), len(data))
+    assert server.ranges == [None, "bytes={}-".format(offset)]
+    assert server.log == [200, 206]
+    with open(part, "rb") as f:
+        assert f.read() == data
+    assert not os.path.exists(part + ".json")
+
+
+def test_resume_starts_over_if_the_file_changed(tmp_path, server):
+    server.files["/foo.zip"] = (body(64 * 1024), '"1"')
+    server.interrupt.add(None)
+    url = server.url + "/foo.zip"
+    part = str(tmp_path / "foo.part")
+    with pytest.raises(Exception):
+        hydrogen.fetch_resumable(url, part, segments=1, chunk_size=1024)
+    data = body(32 * 1024)[::-1]
+    server.files["/foo.zip"] = (data, '"2"')
+    assert hydrogen.fetch_resumable(url, part, segments=1) == \
+        (sha256(data), len(data))
+    assert server.log == [200, 200]
+    with open(part, "rb") as f:
+        assert f.read() == data
+
+
+def test_complete_part_file_is_only_verified(tmp_path, server):
+    data = body(1024)
+    server.files["/foo.zip"] = (data, '"1"')
+    url = server.url + "/foo.zip"
+    part = tmp_path / "foo.part"
+    part.write_bytes(data)
+    (tmp_path / "foo.part.json").write_text(json.dumps(
+        {"url": url, "etag": '"1"', "size": len(data)}))
+    assert hydrogen.fetch_resumable(url, str(part), segments=1) == \
+        (sha256(data), len(data))
+    assert server.log == [416]
+
+
+def test_segmented_download_skips_completed_segments(tmp_path, server,
+                                                     monkeypatch):
+    monkeypatch.setattr(hydrogen, "segment_min_size", 1024)
+    data = body(64 * 1024)
+    server.files["/foo.zip"] = (data, '"1"')
+    server.interrupt.add("bytes=16384-32767")
+    url = server.url + "/foo.zip"
+    part = str(tmp_path / "foo.part")
+    with pytest.raises(Exception):
+        hydrogen.fetch_resumable(url, part, segments=4, chunk_size=1024)
+    assert sorted(server.ranges[1:]) == [
+        "bytes=0-16383", "bytes=16384-32767", "bytes=32768-49151",
+        "bytes=49152-65535"]
+    del server.ranges[:]
+    assert hydrogen.fetch_resumable(url, part, sha256=sha256(data),
+                                    segments=4) == (sha256(data), len(data))
+    assert server.ranges == ["bytes=16384-32767"]
+    with open(part, "rb") as f:
+        assert f.read() == data
+
+
+def test_segmented_download_is_verified(tmp_path, server, monkeypatch):
+    monkeypatch.setattr(hydrogen, "segment_min_size", 1024)
+    server.files["/foo.zip"] = (body(64 * 1024), '"1"')
+    url = server.url + "/foo.zip"
+    part = str(tmp_path / "foo.part")
+    with pytest.raises(hydrogen.InvalidPackageError):
+        hydrogen.fetch_resumable(url, part, sha256="0" * 64, segments=4)
+    assert server.log == [200, 206, 206, 206, 206]
+    assert not os.path.exists(part)
+    assert not os.path.exists(part + ".json")
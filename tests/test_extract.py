@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+import json
+import zipfile
+
+import hydrogen
+
+from conftest import make_zip
+
+
+names = [
+    "pkg/",
+    "pkg/bower.json",
+    "pkg/test/",
+    "pkg/test/a.js",
+    "pkg/src/",
+    "pkg/src/a.js",
+    "pkg/src/deep/",
+    "pkg/src/deep/b.js",
+    "pkg/docs/",
+    "pkg/docs/x.md",
+    "pkg/.travis.yml",
+    "pkg/dist/",
+    "pkg/dist/keep.js",
+    "pkg/dist/drop.js",
+    "outside.txt",
+]
+
+
+def select(names, patterns, root="pkg"):
+    return hydrogen.select_package_members(
+        names, root, hydrogen.compile_ignore_patterns(patterns))
+
+
+def paths(members):
+    return sorted(path for _, path in members)
+
+
+def test_no_patterns_selects_everything_under_root():
+    directories, members = select(names, [])
+    assert directories == ["dist", "docs", "src/deep", "test"]
+    assert paths(members) == [
+        ".travis.yml", "bower.json", "dist/drop.js", "dist/keep.js",
+        "docs/x.md", "src/a.js", "src/deep/b.js", "test/a.js"]
+    assert ("pkg/src/a.js", "src/a.js") in members
+
+
+def test_ignored_directory_excludes_its_contents():
+    directories, members = select(names, ["test", "docs/"])
+    assert directories == ["dist", "src/deep"]
+    assert not [path for path in paths(members)
+                if path.startswith(("test/", "docs/"))]
+
+
+def test_ignored_directory_without_directory_entries():
+    flat = [name for name in names if not name.endswith("/")]
+    flat.append("pkg/test/sub/c.js")
+    directories, members = select(flat, ["test", "docs/"])
+    assert directories == ["dist", "src/deep"]
+    assert paths(members) == [
+        ".travis.yml", "bower.json", "dist/drop.js", "dist/keep.js",
+        "src/a.js", "src/deep/b.js"]
+
+
+def test_dotfiles():
+    _, members = select(names, ["**/.*"])
+    assert ".travis.yml" not in paths(members)
+
+
+def test_negated_pattern():
+    _, members = select(names, ["dist/*", "!dist/keep.js"])
+    assert "dist/keep.js" in paths(members)
+    assert "dist/drop.js" not in paths(members)
+
+
+def test_anchored_pattern():
+    nested = names + ["pkg/lib/src/deep/c.js"]
+    directories, members = select(nested, ["/src/deep"])
+    assert "src/deep/b.js" not in paths(members)
+    assert "lib/src/deep/c.js" in paths(members)
+    assert "src" in directories
+
+
+def test_root_level_bower_json():
+    flat = ["bower.json", "a/b.js", "c.js", "d/e/f.js"]
+    directories, members = select(flat, ["c.js"], root=".")
+    assert directories == ["a", "d/e"]
+    assert members == [("bower.json", "bower.json"), ("a/b.js", "a/b.js"),
+                       ("d/e/f.js", "d/e/f.js")]
+
+
+def test_read_bower_json_prefers_shallowest(tmp_path):
+    path = make_zip(tmp_path / "p.zip", {
+        "pkg/bower.json": {"name": "pkg", "version": "1.0.0"},
+        "pkg/test/fixture/bower.json": {"name": "fixture"},
+    })
+    with zipfile.ZipFile(path) as z:
+        bower_json, root = hydrogen.read_bower_json(z)
+    assert bower_json["name"] == "pkg"
+    assert root == "pkg"
+
+
+def test_extract_bower_zipfile(tmp_path):
+    path = make_zip(tmp_path / "p.zip", {
+        "bower.json": {"name": "pkg", "version": "1.0.0",
+                       "ignore": ["test", "**/.*"]},
+        "dist/pkg.js": "js",
+        "test/spec.js": "spec",
+        ".npmignore": "x",
+    })
+    dest = tmp_path / "assets"
+    h = hydrogen.Hydrogen(assets_dir=dest, cache=False, store=False)
+    with zipfile.ZipFile(path) as z:
+        installed = h.extract_bower_zipfile(z, dest, process_deps=False)
+    assert installed == [("pkg", "1.0.0")]
+    assert (dest / "pkg" / "dist" / "pkg.js").read_text() == "js"
+    assert not (dest / "pkg" / "test").exists()
+    assert not (dest / "pkg" / ".npmignore").exists()
+    manifest = json.loads(
+        hydrogen.manifest_path(dest, "pkg").read_text())
+    assert sorted(manifest["files"]) == ["bower.json", "dist/pkg.js"]
+
+
+def test_extract_removes_stale_files(tmp_path):
+    dest = tmp_path / "assets"
+    h = hydrogen.Hydrogen(assets_dir=dest, cache=False, store=False)
+    for version, files in [("1.0.0", ["a.js", "old/b.js"]),
+                           ("1.1.0", ["a.js"])]:
+        contents = dict(("pkg/" + name, version) for name in files)
+        contents["pkg/bower.json"] = {"name": "pkg", "version": version}
+        path = make_zip(tmp_path / (version + ".zip"), contents)
+        with zipfile.ZipFile(path) as z:
+            h.extract_bower_zipfile(z, dest, process_deps=False)
+    assert (dest / "pkg" / "a.js").read_text() == "1.1.0"
+    assert not (dest / "pkg" / "old").exists()
+
+
+def test_parallel_extractions_share_one_pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(hydrogen, "parallel_extract_size", 0)
+    started = []
+    real_pool = hydrogen._shared_extract_pool.__wrapped__
+
+    def shared_pool(processes):
+        for pool in real_pool(processes):
+            started.append(pool)
+            yield pool
+    monkeypatch.setattr(hydrogen, "_shared_extract_pool",
+                        contextmanager(shared_pool))
+
+    def extract(i):
+        files = {"f{}.txt".format(n): "{} {}".format(i, n)
+                 for n in range(8)}
+        dest = tmp_path / str(i)
+        dest.mkdir()
+        with zipfile.ZipFile(make_zip(tmp_path / "{}.zip".format(i),
+                                      files)) as z:
+            hydrogen.extract_members(z, dest, [(name, name)
+                                               for name in files],
+                                     processes=2)
+        return all((dest / name).read_text() == content
+                   for name, content in files.items())
+
+    try:
+        assert all(hydrogen.map_concurrently(extract, range(4), workers=4))
+        assert len(started) == 4
+        assert len(set(map(id, started))) == 1
+    finally:
+        hydrogen.close_extract_pool()
+    assert hydrogen._extract_pool is None
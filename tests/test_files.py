@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import os
+import stat
+import time
+
+import pytest
+
+import hydrogen
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(str(path)).st_mode)
+
+
+@pytest.mark.skipif(os.name != "posix", reason="POSIX permissions")
+def test_atomic_write_uses_umask_for_new_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(hydrogen, "_umask", 0o022)
+    path = tmp_path / "hydrogen.lock"
+    hydrogen.atomic_write(path, b"data")
+    assert path.read_bytes() == b"data"
+    assert mode(path) == 0o644
+
+
+@pytest.mark.skipif(os.name != "posix", reason="POSIX permissions")
+def test_atomic_write_keeps_the_mode(tmp_path):
+    path = tmp_path / "requirements.yml"
+    path.write_bytes(b"old")
+    os.chmod(str(path), 0o664)
+    hydrogen.atomic_write(path, b"new")
+    assert path.read_bytes() == b"new"
+    assert mode(path) == 0o664
+    assert os.listdir(str(tmp_path)) == ["requirements.yml"]
+
+
+def test_file_lock_is_refreshed_while_held(tmp_path):
+    path = tmp_path / "download.lock"
+    with hydrogen.file_lock(path, timeout=0.4):
+        os.utime(str(path), (0, 0))
+        time.sleep(0.3)
+        assert time.time() - os.path.getmtime(str(path)) < 0.4
+    assert not path.exists()
+
+
+def test_file_lock_takes_over_a_stale_lock(tmp_path):
+    path = tmp_path / "download.lock"
+    path.write_bytes(b"1")
+    os.utime(str(path), (0, 0))
+    with hydrogen.file_lock(path, timeout=60):
+        assert path.read_bytes() == str(os.getpid()).encode("ascii")
+    assert not path.exists()
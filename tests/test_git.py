@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import json
+import zipfile
+
+import pytest
+from click.testing import CliRunner
+
+import hydrogen
+
+
+def test_tags(tmp_path, git_repo):
+    url = git_repo("foo", ["1.0.0", "1.1.0"])
+    cache = hydrogen.GitCache(tmp_path / "git")
+    assert sorted(cache.tags(url)) == ["v1.0.0", "v1.1.0"]
+
+
+def test_archive(tmp_path, git_repo):
+    url = git_repo("foo", ["1.0.0", "1.1.0"])
+    cache = hydrogen.GitCache(tmp_path / "git")
+    dest = str(tmp_path / "foo.zip")
+    cache.archive(url, "v1.0.0", dest)
+    with zipfile.ZipFile(dest) as z:
+        bower_json, root = hydrogen.read_bower_json(z)
+        assert root == "foo-v1.0.0"
+        assert bower_json["version"] == "1.0.0"
+        assert z.read("foo-v1.0.0/foo.js") == b"// 1.0.0"
+
+
+def test_offline_uses_cached_tags(tmp_path, git_repo, monkeypatch):
+    url = git_repo("foo", ["1.0.0", "1.1.0"])
+    cache = hydrogen.GitCache(tmp_path / "git")
+    cache.archive(url, "v1.0.0", str(tmp_path / "foo.zip"))
+    monkeypatch.setattr(hydrogen, "offline", True)
+    assert cache.tags(url) == ["v1.0.0"]
+    with pytest.raises(hydrogen.OfflineError):
+        cache.archive(url, "v1.1.0", str(tmp_path / "bar.zip"))
+
+
+def test_zipball_url_round_trip():
+    url = hydrogen.GitCache.zipball_url("file:///repos/foo.git", "v1.0.0")
+    assert url == "git+file:///repos/foo.git#v1.0.0"
+    assert hydrogen.GitCache.parse_zipball_url(url) == \
+        ("file:///repos/foo.git", "v1.0.0")
+    assert hydrogen.GitCache.parse_zipball_url("https://x/y.zip") is None
+
+
+def test_install_from_mirrored_git_repositories(tmp_path, git_repo):
+    foo = git_repo("foo", ["1.0.0", "1.1.0", "2.0.0"],
+                   dependencies={"1.1.0": {"bar": "^1.0"}})
+    bar = git_repo("bar", ["1.0.0", "1.0.1"])
+    hydrogen.RegistryMirror.default().update(
+        [("foo", foo), ("bar", bar)], source="test")
+    dest = tmp_path / "assets"
+    h = hydrogen.Hydrogen(assets_dir=dest, workers=2)
+    installed = h.install_bower_batch(["foo ^1.0"], dest=dest)
+    assert sorted(installed) == [("bar", "1.0.1"), ("foo", "1.1.0")]
+    assert (dest / "foo" / "foo.js").read_text() == "// 1.1.0"
+    assert not (dest / "foo" / "test").exists()
+    manifest = json.loads(hydrogen.manifest_path(dest, "bar").read_text())
+    assert manifest["url"] == "git+{}#v1.0.1".format(bar)
+
+
+def test_install_command_honours_and_saves_the_range(tmp_path, git_repo,
+                                                     monkeypatch):
+    foo = git_repo("foo", ["1.0.0", "1.1.0"])
+    hydrogen.RegistryMirror.default().update([("foo", foo)], source="test")
+    project = tmp_path / "project"
+    project.mkdir()
+    (project / "requirements.yml").write_text("bower: []\n")
+    monkeypatch.chdir(project)
+    runner = CliRunner()
+    result = runner.invoke(hydrogen.main, [
+        "install", "--bower", "--save", "foo~1.0"])
+    assert result.exit_code == 0, result.output
+    assert json.loads((project / "assets" / "foo" / "bower.json")
+                      .read_text())["version"] == "1.0.0"
+    assert "foo~1.0" in (project / "requirements.yml").read_text()
+    result = runner.invoke(hydrogen.main, ["--no-cache", "check"])
+    assert result.exit_code == 0, result.output
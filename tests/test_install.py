@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import threading
+
+import pytest
+from click.testing import CliRunner
+
+import hydrogen
+
+
+class FakeEnvoy(object):
+    """Stands in for :mod:`envoy` when running pip, calling *hook* with
+    each pip command. Other commands, such as git, are really run.
+    """
+    class Response(object):
+        def __init__(self, status_code, std_err):
+            self.status_code = status_code
+            self.std_out = ""
+            self.std_err = std_err
+
+    def __init__(self, hook=None, status_code=0, std_err=""):
+        self.hook = hook
+        self.status_code = status_code
+        self.std_err = std_err
+        self.commands = []
+        self.envoy = hydrogen.envoy
+
+    def run(self, command):
+        if not (isinstance(command, str) and command.startswith("pip ")):
+            return self.envoy.run(command)
+        self.commands.append(command)
+        if self.hook is not None:
+            self.hook(command)
+        return self.Response(self.status_code, self.std_err)
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch, git_repo):
+    """A project requiring the pip package ``foo`` and the bower package
+    ``bar``, where ``foo`` is installed as soon as pip has run.
+    """
+    path = tmp_path / "project"
+    path.mkdir()
+    monkeypatch.chdir(path)
+    hydrogen.RegistryMirror.default().update(
+        [("bar", git_repo("bar", ["1.0.0"]))], source="test")
+    (path / "requirements.yml").write_text(
+        "all:\n- foo\nbower:\n- bar ^1.0\n")
+    monkeypatch.setattr(hydrogen, "get_installed_pypackages",
+                        lambda: {"foo": "1.0"})
+    return path
+
+
+def test_lanes_run_concurrently(project, monkeypatch):
+    # neither lane gets past the barrier unless the other one is running
+    barrier = threading.Barrier(2, timeout=10)
+    monkeypatch.setattr(hydrogen, "envoy",
+                        FakeEnvoy(lambda command: barrier.wait()))
+    install_bower_batch = hydrogen.Hydrogen.install_bower_batch
+
+    def bower_lane(self, requirements):
+        barrier.wait()
+        return install_bower_batch(self, requirements)
+    monkeypatch.setattr(hydrogen.Hydrogen, "install_bower_batch", bower_lane)
+
+    result = CliRunner().invoke(hydrogen.main, ["install"])
+    assert result.exit_code == 0, result.output
+    assert "installed foo==1.0" in result.output
+    assert "installed bar==1.0.0" in result.output
+    assert (project / "assets" / "bar" / "bar.js").exists()
+    for group in ("all", "bower", "total"):
+        assert "\n" + group + " " in "\n" + result.output
+
+
+def test_failure_in_one_lane_is_reported(project, monkeypatch):
+    envoy = FakeEnvoy(status_code=1, std_err="pip exploded")
+    monkeypatch.setattr(hydrogen, "envoy", envoy)
+    result = CliRunner().invoke(hydrogen.main, ["install"])
+    assert result.exit_code == 1
+    assert "pip exploded" in result.output
+    # the other lane is not cut short
+    assert "installed bar==1.0.0" in result.output
+    assert (project / "assets" / "bar" / "bar.js").exists()
+    assert len(envoy.commands) == 1
+
+
+class Terminal(io.StringIO):
+    def isatty(self):
+        return True
+
+
+def test_progress_reporter_shares_one_line(capsys):
+    stream = Terminal()
+    reporter = hydrogen.ProgressReporter(stream)
+    assert reporter.enabled
+    assert not hydrogen.ProgressReporter(io.StringIO()).enabled
+
+    first = reporter.task("foo.zip", 1024)
+    second = reporter.task("bar.zip", 3072)
+    second.update(1024)
+    assert reporter.status() == \
+        "[2 active, 1.0KB of 4.0KB (25%)] foo.zip, bar.zip"
+    with first:
+        pass
+    assert reporter.status() == \
+        "[1 active, 1 done, 1.0KB of 3.0KB (33%)] bar.zip"
+
+    # messages clear the line, which is then drawn again below them
+    drawn = reporter._drawn
+    stream.seek(0)
+    stream.truncate()
+    reporter.secho("hello")
+    assert capsys.readouterr().out == "hello\n"
+    assert stream.getvalue() == \
+        "\r" + " " * drawn + "\r" + "\r" + reporter.status()
+
+
+def test_trace(project, monkeypatch):
+    monkeypatch.setattr(hydrogen, "envoy", FakeEnvoy())
+    result = CliRunner().invoke(
+        hydrogen.main, ["--trace", "trace.json", "install"])
+    assert result.exit_code == 0, result.output
+    with (project / "trace.json").open() as f:
+        trace = json.load(f)
+    events = trace["traceEvents"]
+    assert events
+    for event in events:
+        assert {"name", "ph", "ts", "pid"} <= set(event)
+    spans = [event for event in events if event["ph"] == "X"]
+    assert spans == sorted(spans, key=lambda event: event["ts"])
+    groups = {event["args"]["group"]: event for event in spans
+              if event["name"] == "install group"}
+    assert set(groups) == {"all", "bower"}
+    assert all(event["dur"] >= 0 for event in spans)
+    assert "pip install" in {event["name"] for event in spans}
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+import pytest
+
+import hydrogen
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    """Make an empty directory the only entry on `sys.path`."""
+    path = tmp_path / "site"
+    path.mkdir()
+    hydrogen.pkg_resources.WorkingSet  # import before sys.path goes away
+    monkeypatch.setattr(sys, "path", [str(path)])
+    return path
+
+
+def add_distribution(site, name, version):
+    """Install the metadata of a distribution, and move the directory's
+    modification time on, as filesystems with a coarse clock may not.
+    """
+    info = site / "{}-{}.dist-info".format(name, version)
+    info.mkdir()
+    (info / "METADATA").write_text(
+        "Metadata-Version: 2.1\nName: {}\nVersion: {}\n".format(name, version))
+    mtime = os.stat(str(site)).st_mtime + 10
+    os.utime(str(site), (mtime, mtime))
+
+
+def counting_scans(index, monkeypatch):
+    scans = []
+    scan = index._scan
+    monkeypatch.setattr(index, "_scan", lambda: scans.append(1) or scan())
+    return scans
+
+
+def test_rescans_when_sys_path_changes(tmp_path, site, monkeypatch):
+    index = hydrogen.InstalledPackageIndex(tmp_path / "index.json")
+    scans = counting_scans(index, monkeypatch)
+    assert index.packages() == {}
+    assert index.packages() == {}
+    assert len(scans) == 1
+    add_distribution(site, "Foo_Bar", "1.2")
+    assert index.versions() == {"foo-bar": "1.2"}
+    assert len(scans) == 2
+    index.invalidate()
+    assert index.versions() == {"foo-bar": "1.2"}
+    assert len(scans) == 3
+
+
+def test_persists_across_processes(tmp_path, site, monkeypatch):
+    add_distribution(site, "foo", "1.0")
+    path = tmp_path / "index.json"
+    assert hydrogen.InstalledPackageIndex(path).versions() == {"foo": "1.0"}
+    assert path.exists()
+
+    index = hydrogen.InstalledPackageIndex(path)
+    scans = counting_scans(index, monkeypatch)
+    assert index.versions() == {"foo": "1.0"}
+    assert scans == []
+    add_distribution(site, "bar", "2.0")
+    assert index.versions() == {"foo": "1.0", "bar": "2.0"}
+    assert scans == [1]
+
+
+def test_in_memory_only(tmp_path, site):
+    path = tmp_path / "index.json"
+    hydrogen.InstalledPackageIndex(path, persist=False).packages()
+    assert not path.exists()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import json
+import re
+
+import pytest
+
+import hydrogen
+
+
+class FakeEnvoy(object):
+    """Stands in for :mod:`envoy`, answering ``pip install --report`` with
+    a report of *resolved* ``(name, version)`` tuples.
+    """
+    class Response(object):
+        status_code = 0
+        std_out = std_err = ""
+
+    def __init__(self, resolved, requested):
+        self.resolved = resolved
+        self.requested = requested
+        self.commands = []
+
+    def run(self, command):
+        self.commands.append(command)
+        report = re.search(r'--report "([^"]+)"', command).group(1)
+        with open(report, "w") as f:
+            json.dump({"install": [{
+                "metadata": {"name": name, "version": version},
+                "requested": name in self.requested,
+                "download_info": {"archive_info": {
+                    "hashes": {"sha256": "{}-{}".format(name, version)}}},
+            } for name, version in self.resolved]}, f)
+        return self.Response()
+
+
+def fake_pypi(releases):
+    def get_json(url, session=None, ttl=None):
+        name, version = url.split("/")[-3:-1]
+        if (name, version) not in releases:
+            raise hydrogen.PackageNotFoundError(url)
+        return {"urls": [{"digests": {"sha256": digest}}
+                         for digest in releases[name, version]]}
+    return get_json
+
+
+def test_lock_includes_dependencies(tmp_path, monkeypatch):
+    envoy = FakeEnvoy([("Flask", "1.1.0"), ("click", "7.0")], ["Flask"])
+    monkeypatch.setattr(hydrogen, "envoy", envoy)
+    monkeypatch.setattr(hydrogen, "get_json", fake_pypi({
+        ("Flask", "1.1.0"): ["b", "a"]}))
+    h = hydrogen.Hydrogen(cache=False, store=False)
+    assert h.lock_pip_requirements(["flask>=1,<2"]) == [
+        {"name": "click", "version": "7.0", "hashes": ["sha256:click-7.0"],
+         "requested": False},
+        {"name": "Flask", "version": "1.1.0",
+         "hashes": ["sha256:a", "sha256:b"], "requested": True},
+    ]
+    assert "--dry-run --ignore-installed" in envoy.commands[0]
+
+
+def test_lock_rejects_versions_out_of_range(monkeypatch):
+    monkeypatch.setattr(hydrogen, "envoy",
+                        FakeEnvoy([("flask", "2.0.0")], ["flask"]))
+    monkeypatch.setattr(hydrogen, "get_json", fake_pypi({}))
+    h = hydrogen.Hydrogen(cache=False, store=False)
+    with pytest.raises(SystemExit):
+        h.lock_pip_requirements(["flask<2"])
+
+
+@pytest.mark.parametrize("entries, hashes, no_deps", [
+    ([{"name": "flask", "version": "1.1.0", "hashes": ["sha256:a"],
+       "requested": True},
+      {"name": "click", "version": "7.0", "hashes": ["sha256:b"],
+       "requested": False}],
+     {"flask": ["sha256:a"], "click": ["sha256:b"]}, True),
+    # written before dependencies were locked
+    ([{"name": "flask", "version": "1.1.0", "hashes": ["sha256:a"]}],
+     None, False),
+])
+def test_install_locked_pip(monkeypatch, entries, hashes, no_deps):
+    calls = []
+    h = hydrogen.Hydrogen(cache=False, store=False)
+    monkeypatch.setattr(h, "install_pip_batch",
+                        lambda lines, **kwargs: calls.append((lines, kwargs)))
+    h.install_locked_pip(entries)
+    [(lines, kwargs)] = calls
+    assert lines == ["{name}=={version}".format(**entry)
+                     for entry in entries]
+    assert kwargs == {"hashes": hashes, "no_deps": no_deps}
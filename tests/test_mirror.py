@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import json
+
+from click.testing import CliRunner
+
+import hydrogen
+
+
+def test_update_and_lookup(tmp_path):
+    mirror = hydrogen.RegistryMirror(tmp_path / "mirror.sqlite")
+    assert mirror.lookup("jquery") is None
+    assert mirror.status() is None
+    mirror.update([("jquery", "git://github.com/jquery/jquery.git")],
+                  source="test")
+    assert mirror.lookup("jquery") == "git://github.com/jquery/jquery.git"
+    status = mirror.status()
+    assert status["packages"] == 1
+    assert status["source"] == "test"
+    mirror.update([("lodash", "git://github.com/lodash/lodash.git")],
+                  source="test", replace=True)
+    assert mirror.lookup("jquery") is None
+    mirror.clean()
+    assert mirror.lookup("lodash") is None
+
+
+def test_parse_packages():
+    listing = [{"name": "a", "url": "git://a"}, {"name": "b"},
+               {"name": "c", "url": "git://c"}]
+    assert hydrogen.RegistryMirror.parse_packages(listing) == \
+        [("a", "git://a"), ("c", "git://c")]
+    assert hydrogen.RegistryMirror.parse_packages(
+        {"b": "git://b", "a": "git://a"}) == \
+        [("a", "git://a"), ("b", "git://b")]
+
+
+def test_sync_from_file(tmp_path):
+    registry = tmp_path / "packages.json"
+    registry.write_text(json.dumps([
+        {"name": "jquery", "url": "git://github.com/jquery/jquery.git"},
+        {"name": "lodash", "url": "git://github.com/lodash/lodash.git"},
+    ]))
+    runner = CliRunner()
+    result = runner.invoke(hydrogen.main, [
+        "mirror", "sync", "--from", str(registry), "jquery"])
+    assert result.exit_code == 0, result.output
+    mirror = hydrogen.RegistryMirror.default()
+    assert mirror.lookup("jquery") == "git://github.com/jquery/jquery.git"
+    assert mirror.lookup("lodash") is None
+
+    result = runner.invoke(hydrogen.main, [
+        "mirror", "sync", "--from", str(registry)])
+    assert result.exit_code == 0, result.output
+    assert mirror.status()["packages"] == 2
+
+
+def test_registry_lookups_use_the_mirror(monkeypatch):
+    hydrogen.RegistryMirror.default().update(
+        [("jquery", "file:///repos/jquery.git")], source="test")
+
+    def no_network(*args, **kwargs):
+        raise AssertionError("the registry was accessed")
+
+    monkeypatch.setattr(hydrogen, "get_json", no_network)
+    assert hydrogen.Bower.get_package_url("jquery") == \
+        "file:///repos/jquery.git"
+
+
+def test_offline_registry_lookup_is_reported(tmp_path, monkeypatch):
+    (tmp_path / "requirements.yml").write_text("bower: []\n")
+    monkeypatch.chdir(tmp_path)
+    result = CliRunner().invoke(hydrogen.main, [
+        "--offline", "install", "--bower", "jquery"])
+    assert result.exit_code == 1
+    assert not isinstance(result.exception, hydrogen.OfflineError)
+    assert "jquery is not cached" in result.output
+    assert "hydrogen mirror sync" in result.output
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import hydrogen
+from hydrogen import Requirement, Requirements
+
+
+@pytest.mark.parametrize("spec, package, version, specifiers", [
+    ("Flask", "Flask", None, []),
+    ("flask>=0.10,<1.0", "flask", ">=0.10,<1.0",
+     [(">=", "0.10"), ("<", "1.0")]),
+    ("Django == 1.8 ; python_version<'3'", "Django", "==1.8",
+     [("==", "1.8")]),
+    ("foo 1.2.3", "foo", "==1.2.3", [("==", "1.2.3")]),
+    ("jquery ^2.1", "jquery", "^2.1", [("^", "2.1")]),
+    ("x 1.2 - 2.0", "x", "1.2 - 2.0", [(None, "1.2 - 2.0")]),
+    ("a >=1 <2", "a", ">=1 <2", [(None, ">=1 <2")]),
+    ("Foo_Bar.baz==1 # comment", "Foo_Bar.baz", "==1", [("==", "1")]),
+    ("jquery latest", "jquery", "latest", [(None, "latest")]),
+    ("jquery *", "jquery", "*", [(None, "*")]),
+])
+def test_parse(spec, package, version, specifiers):
+    requirement = Requirement.coerce(spec)
+    assert requirement.package == package
+    assert requirement.version == version
+    assert requirement.specifiers == specifiers
+
+
+@pytest.mark.parametrize("spec", [
+    "flask>=0.10,<1.0", "foo==1.2.3", "jquery^2.1", "x 1.2 - 2.0",
+    "a>=1 <2", "jquery latest", "jquery *", "Flask",
+])
+def test_str_round_trip(spec):
+    requirement = Requirement.coerce(spec)
+    assert str(requirement) == spec
+    parsed = Requirement.coerce(str(requirement))
+    assert (parsed.package, parsed.version) == \
+        (requirement.package, requirement.version)
+
+
+@pytest.mark.parametrize("name, key", [
+    ("Foo_Bar.baz", "foo-bar-baz"),
+    ("PKG--1", "pkg-1"),
+    ("requests", "requests"),
+])
+def test_normalize_name(name, key):
+    assert hydrogen.normalize_name(name) == key
+    assert Requirement.coerce(name).key == key
+
+
+def test_equality_is_by_name():
+    assert Requirement.coerce("Foo_Bar==1") == Requirement.coerce("foo-bar")
+    assert len(set([Requirement.coerce("a"), Requirement.coerce("A==2")])) \
+        == 1
+
+
+def test_requirements_loads_skips_comments_and_options():
+    requirements = Requirements()
+    requirements.loads("a==1\n# comment\n-r other.txt\n\nB_c>=2\n")
+    assert [str(r) for r in requirements] == ["a==1", "B_c>=2"]
+    assert "b-c" in requirements
+    assert "B.C" in requirements
+    assert len(requirements) == 2
+
+
+def test_requirements_add_keeps_or_replaces():
+    requirements = Requirements()
+    requirements.add("a==1")
+    requirements.add("A==2")
+    assert str(requirements.get("a")) == "a==1"
+    requirements.add("A==2", replace=True)
+    assert str(requirements.get("a")) == "A==2"
+
+
+def test_requirements_remove():
+    requirements = Requirements()
+    requirements.loads("a\nb\n")
+    requirements.remove("A")
+    assert [str(r) for r in requirements] == ["b"]
+    with pytest.raises(KeyError):
+        requirements.remove("a")
+    requirements.discard("a")
+
+
+def test_grouped_requirements_round_trip(tmp_path):
+    path = tmp_path / "requirements.yml"
+    path.write_text("all:\n- flask>=0.10\nbower:\n- jquery ^2.1\n")
+    grouped = hydrogen.GroupedRequirements(cache=False)
+    grouped.load(str(path))
+    assert [str(r) for r in grouped["all"]] == ["flask>=0.10"]
+    grouped["all"].add("requests==2.0")
+    grouped.save()
+    reloaded = hydrogen.GroupedRequirements(cache=False)
+    reloaded.load(str(path))
+    assert reloaded.serialized == grouped.serialized
+
+
+@pytest.mark.parametrize("version, spec, matches", [
+    ("1.2.3", "^1.0", True),
+    ("2.0.0", "^1.0", False),
+    ("1.2.3", "~1.2", True),
+    ("1.3.0", "~1.2", False),
+    ("1.5.0", "1.2 - 2.0", True),
+    ("1.5.0", ">=1 <2", True),
+    ("1.5.0", "<1 || >=1.5", True),
+    ("1.0.0-beta", "*", False),
+    ("3.0.0", "", True),
+    ("3.0.0", "==3.0.0", True),
+    ("3.0.0", "latest", True),
+    ("3.0.0", "*", True),
+])
+def test_bower_match_version(version, spec, matches):
+    assert hydrogen.Bower.match_version(version, spec) is matches
+
+
+def test_batch_saves_once(tmp_path):
+    path = tmp_path / "requirements.yml"
+    path.write_text("all: []\n")
+    grouped = hydrogen.GroupedRequirements(cache=False)
+    grouped.load(str(path))
+    with grouped.batch():
+        grouped["all"].add("a==1")
+        grouped.save()
+        grouped["all"].add("b==1")
+        grouped.save()
+        assert "a==1" not in path.read_text()
+    assert "a==1" in path.read_text()
+    assert "b==1" in path.read_text()
+
+
+def test_batch_saves_when_the_block_fails(tmp_path):
+    path = tmp_path / "requirements.yml"
+    path.write_text("all: []\n")
+    grouped = hydrogen.GroupedRequirements(cache=False)
+    grouped.load(str(path))
+    with pytest.raises(SystemExit):
+        with grouped.batch():
+            grouped["all"].add("a==1")
+            grouped.save()
+            raise SystemExit(1)
+    assert "a==1" in path.read_text()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import hashlib
+
+import pytest
+
+import hydrogen
+
+from conftest import make_zip
+
+
+class FakeHydrogen(object):
+    """Serves a fixed set of bower packages to a :class:`BowerResolver`.
+
+    :param packages: a mapping of names to mappings of versions to the
+        dependencies of that version.
+    """
+    workers = 1
+
+    def __init__(self, tmp_path, packages):
+        self.tmp_path = tmp_path
+        self.packages = packages
+        self.fetched = []
+
+    def get_bower_candidates(self, url):
+        return hydrogen.TagIndex(dict(
+            (version, "fake://{}/{}".format(url, version))
+            for version in self.packages[url]))
+
+    def fetch_zipball(self, url, sha256=None):
+        name, version = url[len("fake://"):].split("/")
+        self.fetched.append((name, version))
+        path = make_zip(self.tmp_path / "{}-{}.zip".format(name, version), {
+            name + "/bower.json": {
+                "name": name,
+                "version": version,
+                "dependencies": self.packages[name][version],
+            },
+        })
+        with open(path, "rb") as f:
+            return path, hashlib.sha256(f.read()).hexdigest()
+
+
+def resolve(tmp_path, packages, roots):
+    fake = FakeHydrogen(tmp_path, packages)
+    resolver = hydrogen.BowerResolver(fake)
+    resolver.urls.update((name, name) for name in packages)
+    for name, version in roots:
+        resolver.add(name, version)
+    return dict((package["name"], package["version"])
+                for package in resolver.resolve())
+
+
+def test_shared_dependency_satisfies_everyone(tmp_path):
+    packages = {
+        "a": {"1.0.0": {"c": "^1.0"}},
+        "b": {"1.0.0": {"c": "~1.1"}},
+        "c": {"1.0.0": {}, "1.1.5": {}, "1.2.0": {}, "2.0.0": {}},
+    }
+    assert resolve(tmp_path, packages, [("a", None), ("b", None)]) == \
+        {"a": "1.0.0", "b": "1.0.0", "c": "1.1.5"}
+
+
+def test_dependencies_come_first(tmp_path):
+    packages = {
+        "a": {"1.0.0": {"b": "*"}},
+        "b": {"1.0.0": {"c": "*"}},
+        "c": {"1.0.0": {}},
+    }
+    fake = FakeHydrogen(tmp_path, packages)
+    resolver = hydrogen.BowerResolver(fake)
+    resolver.urls.update((name, name) for name in packages)
+    resolver.add("a")
+    assert [p["name"] for p in resolver.resolve()] == ["c", "b", "a"]
+
+
+def test_reselection_replaces_dependencies(tmp_path):
+    # a@2 is picked first, until b narrows a to ^1, which needs other
+    # dependencies
+    packages = {
+        "a": {"1.0.0": {"d": "*"}, "2.0.0": {"c": "*"}},
+        "b": {"1.0.0": {"a": "^1.0"}},
+        "c": {"1.0.0": {}},
+        "d": {"1.0.0": {}},
+    }
+    assert resolve(tmp_path, packages, [("a", None), ("b", None)]) == \
+        {"a": "1.0.0", "b": "1.0.0", "d": "1.0.0"}
+
+
+def test_conflict(tmp_path):
+    packages = {
+        "a": {"1.0.0": {"c": "^1.0"}},
+        "b": {"1.0.0": {"c": "^2.0"}},
+        "c": {"1.0.0": {}, "2.0.0": {}},
+    }
+    with pytest.raises(hydrogen.VersionConflictError) as e:
+        resolve(tmp_path, packages, [("a", None), ("b", None)])
+    assert "no version of c satisfies" in str(e.value)
+
+
+def test_root_range(tmp_path):
+    packages = {"a": {"1.0.0": {}, "1.1.0": {}, "2.0.0": {}}}
+    assert resolve(tmp_path, packages, [("a", "~1.0")]) == {"a": "1.0.0"}
+
+
+def test_dropped_dependency_releases_its_ranges(tmp_path):
+    # a@2 needs x, which needs c ^2; but b narrows a to ^1, so x is no
+    # longer required and its range on c must not conflict with b's
+    packages = {
+        "a": {"1.0.0": {}, "2.0.0": {"x": "*"}},
+        "b": {"1.0.0": {"a": "^1.0", "c": "^1.0"}},
+        "c": {"1.0.0": {}, "2.0.0": {}},
+        "x": {"1.0.0": {"c": "^2.0"}},
+    }
+    assert resolve(tmp_path, packages, [("a", None), ("b", None)]) == \
+        {"a": "1.0.0", "b": "1.0.0", "c": "1.0.0"}
+
+
+def test_dropped_dependencies_are_released_recursively(tmp_path):
+    packages = {
+        "a": {"1.0.0": {}, "2.0.0": {"x": "*"}},
+        "b": {"1.0.0": {"a": "^1.0", "c": "^1.0"}},
+        "c": {"1.0.0": {}, "2.0.0": {}},
+        "x": {"1.0.0": {"y": "*"}},
+        "y": {"1.0.0": {"c": "^2.0"}},
+    }
+    assert resolve(tmp_path, packages, [("a", None), ("b", None)]) == \
+        {"a": "1.0.0", "b": "1.0.0", "c": "1.0.0"}
+
+
+def test_latest(tmp_path):
+    packages = {"a": {"1.0.0": {}, "2.0.0": {}}}
+    requirement = hydrogen.Requirement.coerce("a latest")
+    assert resolve(tmp_path, packages, [("a", requirement.version)]) == \
+        {"a": "2.0.0"}
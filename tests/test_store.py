@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import os
+import zipfile
+
+import pytest
+from click.testing import CliRunner
+
+import hydrogen
+
+from conftest import make_zip
+
+
+@pytest.fixture
+def foo(git_repo):
+    url = git_repo("foo", ["1.0.0"])
+    hydrogen.RegistryMirror.default().update([("foo", url)], source="test")
+    return url
+
+
+def install(tmp_path, project, *options):
+    path = tmp_path / project
+    path.mkdir()
+    (path / "requirements.yml").write_text("bower:\n- foo ^1.0\n")
+    cwd = os.getcwd()
+    os.chdir(str(path))
+    try:
+        result = CliRunner().invoke(hydrogen.main, list(options) +
+                                    ["install"])
+    finally:
+        os.chdir(cwd)
+    assert result.exit_code == 0, result.output
+    return path / "assets" / "foo" / "foo.js"
+
+
+def test_projects_share_the_store(tmp_path, foo):
+    first = install(tmp_path, "first")
+    second = install(tmp_path, "second")
+    assert first.read_text() == "// 1.0.0"
+    assert os.path.samefile(str(first), str(second))
+    # the store, and each project
+    assert os.stat(str(first)).st_nlink == 3
+    [stored] = hydrogen.PackageStore().path.glob("*/*/foo.js")
+    assert os.path.samefile(str(stored), str(first))
+
+
+def test_no_store_copies(tmp_path, foo):
+    first = install(tmp_path, "first", "--no-store")
+    second = install(tmp_path, "second", "--no-store")
+    assert first.read_text() == second.read_text() == "// 1.0.0"
+    assert not os.path.samefile(str(first), str(second))
+    assert os.stat(str(first)).st_nlink == 1
+    assert not hydrogen.PackageStore().path.exists()
+
+
+def test_store_extracts_once(tmp_path, monkeypatch):
+    path = make_zip(tmp_path / "foo.zip", {"foo/a.js": "a", "foo/b/c.js": "c"})
+    store = hydrogen.PackageStore(tmp_path / "store")
+    members = [("foo/a.js", "a.js"), ("foo/b/c.js", "b/c.js")]
+    with zipfile.ZipFile(path) as z:
+        package = store.add(z, "ab" * 32, ["b"], members)
+    assert package == str(tmp_path / "store" / "ab" / ("ab" * 32))
+    with open(os.path.join(package, "b", "c.js")) as f:
+        assert f.read() == "c"
+
+    def extract(*args, **kwargs):
+        raise AssertionError("extracted again")
+    monkeypatch.setattr(hydrogen, "extract_members", extract)
+    with zipfile.ZipFile(path) as z:
+        assert store.add(z, "ab" * 32, ["b"], members) == package
+    assert [name for name in os.listdir(str(tmp_path / "store" / "ab"))
+            if not name.endswith(".lock")] == ["ab" * 32]
+
+
+def test_link_file_falls_back_to_a_copy(tmp_path, monkeypatch):
+    source = tmp_path / "source"
+    source.write_bytes(b"data")
+    assert hydrogen.link_file(str(source), str(tmp_path / "link")) == "link"
+    assert os.path.samefile(str(source), str(tmp_path / "link"))
+
+    def fail(*args):
+        raise OSError(18, "Invalid cross-device link")
+    monkeypatch.setattr(os, "link", fail)
+    monkeypatch.setattr(hydrogen, "reflink_file", fail)
+    assert hydrogen.link_file(str(source), str(tmp_path / "copy")) == "copy"
+    assert (tmp_path / "copy").read_bytes() == b"data"
+    assert not os.path.samefile(str(source), str(tmp_path / "copy"))
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+
+import pytest
+from click.testing import CliRunner
+
+import hydrogen
+
+
+class FakeEnvoy(object):
+    """Stands in for :mod:`envoy`, answering ``pip wheel`` with a wheel of
+    each requirement, and one of a dependency they all share.
+    """
+    class Response(object):
+        def __init__(self, status_code, std_err):
+            self.status_code = status_code
+            self.std_out = ""
+            self.std_err = std_err
+
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.commands = []
+        self.lines = []
+
+    def run(self, command):
+        self.commands.append(command)
+        wheel_dir = re.search(r'--wheel-dir "([^"]+)"', command).group(1)
+        requirements_txt = re.search(r'-r "([^"]+)"', command).group(1)
+        with open(requirements_txt) as f:
+            line = f.read().strip()
+        self.lines.append(line)
+        name = re.match(r"[\w.-]+", line).group(0)
+        if name in self.failing:
+            return self.Response(1, "no wheel for " + name)
+        os.makedirs(wheel_dir)
+        for wheel in (name, "shared"):
+            with open(os.path.join(wheel_dir, wheel + "-1.0-py3-none-any.whl"),
+                      "w") as f:
+                f.write(name)
+        return self.Response(0, "")
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    path = tmp_path / "project"
+    path.mkdir()
+    monkeypatch.chdir(path)
+    (path / "requirements.yml").write_text(
+        "all:\n- foo\n- bar>=1\ndev:\n- foo\n- baz\nbower:\n- jquery\n")
+    return path
+
+
+def build(*args):
+    return CliRunner().invoke(hydrogen.main, ["wheelhouse", "build"]
+                              + list(args))
+
+
+def test_build(project, monkeypatch):
+    envoy = FakeEnvoy()
+    monkeypatch.setattr(hydrogen, "envoy", envoy)
+    h = hydrogen.Hydrogen(cache=False, store=False)
+    dest = project / "wheels"
+    wheels = h.build_wheelhouse(h.requirements.keys(), dest)
+    # one build per requirement, bower groups left out
+    assert sorted(envoy.lines) == ["bar>=1", "baz", "foo"]
+    assert wheels == ["bar-1.0-py3-none-any.whl", "baz-1.0-py3-none-any.whl",
+                      "foo-1.0-py3-none-any.whl",
+                      "shared-1.0-py3-none-any.whl"]
+    assert sorted(os.listdir(str(dest))) == wheels
+    # builds pick up the wheels of earlier ones
+    for command in envoy.commands:
+        assert '--find-links "{}"'.format(dest) in command
+        assert "--no-deps" not in command
+    # the private build directories are gone
+    assert os.listdir(h.temp_dir) == []
+
+
+def test_build_failure_is_reported(project, monkeypatch):
+    monkeypatch.setattr(hydrogen, "envoy", FakeEnvoy(failing=["bar"]))
+    result = build("-g", "all")
+    assert result.exit_code == 1
+    assert "could not build bar>=1:\nno wheel for bar" in result.output
+    assert "failed to build bar>=1" in result.output
+    # the other builds still finish
+    assert (project / "wheelhouse" / "foo-1.0-py3-none-any.whl").exists()
+
+
+def test_build_frozen(project, monkeypatch):
+    envoy = FakeEnvoy()
+    monkeypatch.setattr(hydrogen, "envoy", envoy)
+    h = hydrogen.Hydrogen(cache=False, store=False)
+    h.save_lockfile({"pip": {"all": [
+        {"name": "foo", "version": "1.2", "hashes": ["sha256:a"],
+         "requested": True},
+        {"name": "six", "version": "1.16.0", "hashes": ["sha256:b"],
+         "requested": False},
+    ]}})
+    result = build("--frozen", "--dir", "wheels")
+    assert result.exit_code == 0, result.output
+    assert "3 wheels in wheels" in result.output
+    assert sorted(envoy.lines) == ["foo==1.2 --hash=sha256:a",
+                                   "six==1.16.0 --hash=sha256:b"]
+    # locked dependencies are built too, so pip need not look for any
+    for command in envoy.commands:
+        assert "--no-deps" in command
+        assert "--find-links" not in command